@@ -2,21 +2,36 @@
 
 import os
 import sys
+import argparse
 import errno
+import logging
+import signal
 import stat  # S_IFDIR, S_IFLNK, S_IFREG
+import threading
+from bisect import bisect_right
+from collections import namedtuple
+from contextlib import contextmanager
 from time import time
 
-from fuse import FUSE, FuseOSError, Operations
-
-from pyArango.connection import *
-from py2neo import Graph,Node, Relationship
-from py2neo.ogm import GraphObject, Property, RelatedTo, RelatedFrom
+from fuse import FUSE, FuseOSError, Operations, c_stat, set_st_attrs
 
 # ---------------------------------------------------------
 # Internal libraries
 
-from lib.passthrough import Passthrough
-
+from lib.cache import MetadataCache, ContentCache
+from lib.content import ChunkedContent, WriteBuffer
+from lib.handles import HandleTable, FileHandle, DirHandle
+from lib.schema import SCHEMA_CREATE, SCHEMA_MODES
+from lib.pool import DEFAULT_POOL_SIZE
+from lib.backends import BACKENDS
+from lib.membership import MembershipIndex
+from lib.snapshot import SnapshotError, loadSnapshot, saveSnapshot
+from lib.changes import ChangeFeed
+from lib.stats import Stats
+from lib.control import ControlFiles, CONTROL_ROOT, formatCounters
+from lib.prefetch import Prefetcher, ReadAhead, DEFAULT_PREFETCH_WORKERS, DEFAULT_READ_AHEAD_CHUNKS
+
+logger = logging.getLogger("graphfs")
 
 # ---------------------------------------------------------
 # Variables for rename function
@@ -27,37 +42,424 @@ RENAME_WHITEOUT = 2 # (1 << 2)	/* Whiteout source */
 
 # Various variables
 
+# Metadata cache defaults
+DEFAULT_CACHE_SIZE = 10000 # Entries
+DEFAULT_CACHE_TTL = 1.0 # Seconds
 
-# ---------------------------------------------------------
+# Memory used to cache the content of the files.
+# A budget of 0 disables the content cache.
+DEFAULT_CONTENT_CACHE_BYTES = 64 * 1024 * 1024 # Bytes
+
+# Buffered writes of a file are flushed when they reach this size.
+# A threshold of 0 disables the write-back buffers.
+DEFAULT_WRITE_BACK_THRESHOLD = 8 * 1024 * 1024 # Bytes
+
+# Access times are stored as with the relatime mount option: only when the stored one
+# is older than the last modification of the file, or than this interval
+RELATIME_INTERVAL = 24 * 3600 # Seconds
+
+# Maximum number of directory entries fetched from the graph with a single query
+DEFAULT_READDIR_PAGE_SIZE = 1000
+
+# Locks serializing the operations on the write-back buffers of the files
+# in a multithreaded mount. Files are spread on a fixed number of locks by node id.
+NODE_LOCK_STRIPES = 64
+
+# Kinds of element a path can refer to, as returned by __resolvePath
+PATH_ROOT = 0
+PATH_GROUP = 1
+PATH_FILE = 2
+PATH_MISSING = 3
+
+# Result of the resolution of a path:
+# - kind: one of the PATH_* values above
+# - nodeId: the Neo4j id of the node the last element refers to (None for root or missing elements)
+# - elementsIDs: the elements of the path, as returned by __parsePathInGroups
+# - parentsExist: True if all the elements apart the last one are existing groups
+# - properties: the metadata of the node (size, atime, mtime, ctime for files; mtime, ctime for groups),
+#   None for root or missing elements. Missing properties are None.
+ResolvedPath = namedtuple("ResolvedPath", ["kind", "nodeId", "elementsIDs", "parentsExist", "properties"])
 
-class Group(GraphObject):
-    __primarykey__ = "name"
+# ---------------------------------------------------------
+# FUSE bindings
+
+class GraphFUSE(FUSE):
+    """
+    fusepy does not pass the offset to the readdir operation,
+    while GraphFS needs it to resume long listings from where the kernel stopped.
+    The operations' readdir is called as readdir(path, fh, offset)
+    and must return (name, attrs, offset) tuples.
+    """
+
+    def readdir(self, path, buf, filler, offset, fip):
+        for name, attrs, entryOffset in self.operations('readdir'
+            , self._decode_optional_path(path), fip.contents.fh, offset):
+
+            if attrs:
+                st = c_stat()
+                set_st_attrs(st, attrs, use_ns=self.use_ns)
+            else:
+                st = None
 
-    name = Property()
+            if filler(buf, name.encode(self.encoding), st, entryOffset) != 0:
+                break
 
-    hasFiles = RelatedFrom("File", "isInGroup")
+        return 0
 
-class File(GraphObject):
-    __primarykey__ = "name"
+    def open(self, path, fip):
+        result = super().open(path, fip)
 
-    name = Property()
+        # The content of the control files is generated at open,
+        # so their size is unknown to the kernel: bypass the page cache
+        if self._decode_optional_path(path).startswith(CONTROL_ROOT + "/"):
+            fip.contents.direct_io = 1
 
-    isInGroup = RelatedTo("Group", "isInGroup")
+        return result
 
 # ---------------------------------------------------------
 # Main class
 
 class GraphFSNeo4j(Operations):
     
-    def __init__(self):
-        
-        self.graph = Graph(password="JAt2Y4pG$YvaIpVP")
+    def __init__(self, backend
+        , cacheSize = DEFAULT_CACHE_SIZE
+        , cacheTTL = DEFAULT_CACHE_TTL
+        , writeBackThreshold = DEFAULT_WRITE_BACK_THRESHOLD
+        , readdirPageSize = DEFAULT_READDIR_PAGE_SIZE
+        , readAheadChunks = DEFAULT_READ_AHEAD_CHUNKS
+        , prefetchWorkers = DEFAULT_PREFETCH_WORKERS
+        , contentCacheBytes = DEFAULT_CONTENT_CACHE_BYTES
+        , membershipIndex = False
+        , snapshotPath = None
+        , changePollInterval = None
+        , stats = None):
         
+        # Instrumentation of the operations and of the queries (None if disabled)
+        self.stats = stats
+
         self.fileTime = time()
+
+        # Storage of the groups, files and contents (see lib.backends).
+        # All the accesses to the graph are named operations run by the backend.
+        self.backend = backend
+
+        # Content of the files, stored as chunks of bytes.
+        # The chunks read are kept in a cache shared by all the files.
+        self.contentCache = ContentCache(maxBytes = contentCacheBytes) if contentCacheBytes > 0 else None
+        self.content = ChunkedContent(self.backend, cache = self.contentCache)
+        migratedFiles = self.content.migrateLegacy()
+        if migratedFiles > 0:
+            logger.info("Migrated the content of %s files to chunks", migratedFiles)
+
+        # Write-back buffers of the open files, keyed by node id
+        self.writeBuffers = {}
+        self.writeBackThreshold = writeBackThreshold
+        self.nodeLocks = [threading.RLock() for _ in range(NODE_LOCK_STRIPES)]
+
+        # Background fetch of the content following the reads (None if disabled)
+        self.prefetcher = None
+        if readAheadChunks > 0:
+            self.prefetcher = Prefetcher(self.content, workers = prefetchWorkers, maxWindow = readAheadChunks)
+
+        # Open files and directories
+        self.handles = HandleTable()
+
+        self.readdirPageSize = readdirPageSize
+
+        # Metadata caches, keyed by normalized path:
+        # - attrCache holds the results of getattr (None for missing paths)
+        # - direntCache holds the results of readdir
+        self.attrCache = MetadataCache(maxEntries = cacheSize, ttl = cacheTTL)
+        self.direntCache = MetadataCache(maxEntries = cacheSize, ttl = cacheTTL)
+
+        # Log of the changes shared with the other mounts of the graph (None if disabled):
+        # the changes of this mount are recorded, and the ones of the others invalidate the caches.
+        # The last change is read before the index is loaded, so that the changes committed
+        # during the load are applied to it in order, whether the load has seen them or not.
+        self.changes = None
+        if changePollInterval:
+            self.changes = ChangeFeed(self.backend, self.__applyChanges, interval = changePollInterval)
+
+        # Files of each group, held in memory to compute the listings (None if disabled).
+        # With a snapshot path, the index is read from the snapshot saved by the last unmount
+        # when the graph has not changed since, instead of scanning the graph (see lib.snapshot).
+        self.membership = None
+        self.snapshotPath = snapshotPath
+        # Version of the graph the snapshot read at mount was taken at
+        self.snapshotVersion = None
+        if membershipIndex or snapshotPath is not None:
+            self.membership = MembershipIndex()
+            self.__loadMembership()
+
+        if self.changes is not None:
+            self.changes.start()
+
+        # Hidden directory with the live measures of the mount
+        self.control = ControlFiles(
+            self.handles
+            , files = dict(stats = self.__statsReport, cache = self.__cacheReport, queries = self.__queriesReport)
+            , writers = dict(cache = self.__dropCaches))
         
+    # Membership snapshot
+    # ===================
+
+    def __graphVersion(self):
+        """
+        Return the version of the graph, or None if the backend cannot tell it.
+        """
+        try:
+            return self.backend.evaluate("graphVersion")
+        except Exception as e:
+            logger.warning("Cannot read the version of the graph: %s", e)
+            return None
+
+    def __loadMembership(self):
+        if self.snapshotPath is not None:
+            version = self.__graphVersion()
+            try:
+                snapshot = loadSnapshot(self.snapshotPath, version)
+            except (OSError, SnapshotError) as e:
+                logger.warning("Cannot read the snapshot %s: %s", self.snapshotPath, e)
+                snapshot = None
+
+            if snapshot is not None:
+                self.membership.build(*snapshot)
+                self.snapshotVersion = version
+                return
+
+        self.membership.load(self.backend)
+
+    def __saveMembership(self):
+        """
+        Save the snapshot of the membership at the current version of the graph.
+        The groups and files are read from the graph rather than from the index,
+        which does not see the changes made by other clients.
+        """
+        version = self.__graphVersion()
+        if version is None:
+            logger.info("The version of the graph is unknown: the snapshot is not saved")
+            return
+
+        if version == self.snapshotVersion:
+            # Nothing was written since the mount: the snapshot is still valid
+            return
+
+        groups = self.backend.data("membershipGroups")
+        files = self.backend.data("membershipFiles")
+        if self.__graphVersion() != version:
+            logger.warning("The graph changed while taking the snapshot: the snapshot is not saved")
+            return
+
+        try:
+            saveSnapshot(self.snapshotPath, version, groups, files)
+        except OSError as e:
+            logger.warning("Cannot save the snapshot %s: %s", self.snapshotPath, e)
+
+    def __call__(self, op, *args):
+        # The control files are served from memory
+        paths = args[:2] if op == "rename" else args[:1]
+        if any(isinstance(path, str) and self.control.owns(path) for path in paths):
+            return self.control(op, *args)
+
+        if self.stats is None:
+            return super().__call__(op, *args)
+
+        # readdir returns a generator, which is consumed after the call
+        if op == "readdir":
+            return self.stats.iterate(op, super().__call__(op, *args))
+
+        with self.stats.operation(op):
+            return super().__call__(op, *args)
+
+    # Control files
+    # =============
+
+    def __statsReport(self):
+        if self.stats is None:
+            return "Measures disabled: mount with --stats to enable them\n"
+        return self.stats.operationsReport()
+
+    def __cacheReport(self):
+        report = formatCounters("attributes", self.attrCache.stats())
+        report += formatCounters("listings", self.direntCache.stats())
+        if self.contentCache is not None:
+            report += formatCounters("content", self.contentCache.stats())
+        if self.prefetcher is not None:
+            report += formatCounters("readahead", self.prefetcher.stats())
+        if self.membership is not None:
+            report += formatCounters("membership", self.membership.stats())
+        if self.changes is not None:
+            report += formatCounters("changes", self.changes.stats())
+
+        buffers = list(self.writeBuffers.values())
+        report += formatCounters("writeback", dict(
+            buffers = len(buffers)
+            , dirtyBytes = sum(buffer.dirtyBytes for buffer in buffers)
+            , threshold = self.writeBackThreshold))
+        report += formatCounters("handles", dict(open = len(self.handles)))
+
+        return report
+
+    def __queriesReport(self):
+        report = formatCounters(self.backend.name, self.backend.counters())
+        if self.stats is None:
+            return report + "Measures disabled: mount with --stats to enable them\n"
+        return report + "\n" + self.stats.queriesReport()
+
+    def __dropCaches(self, data):
+        """
+        Writing anything to the cache control file drops all the caches.
+        """
+        logger.info("Dropping the caches")
+
+        self.attrCache.clear()
+        self.direntCache.clear()
+        if self.contentCache is not None:
+            self.contentCache.clear()
+
     # Helpers
     # =======
 
+    def __invalidate(self, *names, structural = True, nodeIds = (), update = None, publish = True):
+        """
+        Invalidate the cached metadata of the given group or file names.
+        If structural is True, the change affects the content of the directories
+        (groups or files were added, removed or moved) so all the cached listings are dropped,
+        as a group or a file can appear in many paths.
+        update is the update of the membership index the change makes, as [name, arguments...]
+        (see MembershipIndex.apply), applied to the index of the mount if enabled.
+        If publish is True, the change is in the graph and is recorded for the other mounts,
+        together with the nodeIds of the files whose content changed and the update.
+        """
+        if update is not None and self.membership is not None:
+            self.membership.apply(update)
+
+        for name in names:
+            self.attrCache.invalidate(name)
+
+        if structural:
+            self.direntCache.clear()
+
+        if publish:
+            self.__publish(names, nodeIds, structural, update)
+
+    def __publish(self, names, nodeIds = (), structural = False, update = None):
+        """
+        Record a change made to the graph in the change log, if enabled.
+        """
+        if self.changes is not None:
+            self.changes.record(names, nodeIds, structural, update)
+
+    def __applyChanges(self, changes):
+        """
+        Invalidate what the changes made by the other mounts affect, and apply their updates
+        to the membership index (everything is invalidated and the index loaded again if changes is None).
+        Called by the thread of the change feed.
+        """
+        if changes is None:
+            self.__dropCaches(None)
+            # The local changes made while the graph is read are kept (see MembershipIndex.load)
+            if self.membership is not None:
+                self.membership.load(self.backend)
+            return
+
+        nodeIds = set()
+        structural = False
+        for change in changes:
+            # Applied in the order of the log, as each update depends on the previous ones
+            if change["update"] is not None and self.membership is not None:
+                self.membership.apply(change["update"])
+            for name in change["names"]:
+                self.attrCache.invalidate(name)
+            nodeIds.update(change["nodeIds"])
+            structural = structural or change["structural"]
+
+        for nodeId in nodeIds:
+            self.content.invalidate(nodeId)
+            self.__dropReadAhead(nodeId)
+
+        # The open handles of the changed files see the new size,
+        # unless this mount has pending writes on them
+        openIds = [nodeId for nodeId in nodeIds if self.handles.forNode(nodeId) and nodeId not in self.writeBuffers]
+        if openIds:
+            for record in self.backend.data("nodeProperties", nodeIds = openIds):
+                self.__setProperties(record["nodeId"], **record["properties"])
+
+        if structural:
+            self.direntCache.clear()
+
+    @contextmanager
+    def __locked(self, *nodeIds):
+        """
+        Hold the locks of the given files for the duration of a block.
+        The locks are always taken in the same order, to avoid deadlocks.
+        """
+        stripes = sorted(set(nodeId % NODE_LOCK_STRIPES for nodeId in nodeIds if nodeId is not None))
+
+        for stripe in stripes:
+            self.nodeLocks[stripe].acquire()
+        try:
+            yield
+        finally:
+            for stripe in reversed(stripes):
+                self.nodeLocks[stripe].release()
+
+    def __handle(self, fh):
+        """
+        Return the open file with the given handle.
+        """
+        handle = self.handles.get(fh)
+
+        if not isinstance(handle, FileHandle):
+            logger.debug("Invalid file handle %s", fh)
+            raise FuseOSError(errno.EBADF)
+
+        return handle
+
+    def __setProperties(self, nodeId, **properties):
+        """
+        Update the size and times cached in all the handles of the file.
+        """
+        for handle in self.handles.forNode(nodeId):
+            handle.properties.update(properties)
+
+    def __dropReadAhead(self, nodeId):
+        """
+        Forget the content prefetched for the open handles of the file,
+        which has been modified.
+        """
+        for handle in self.handles.forNode(nodeId):
+            if handle.readAhead is not None:
+                handle.readAhead.clear()
+
+    def __writeBuffer(self, nodeId, size):
+        """
+        Return the write-back buffer of the file, creating it if needed.
+        """
+        buffer = self.writeBuffers.get(nodeId)
+
+        if buffer is None:
+            buffer = WriteBuffer(self.content, nodeId, size)
+            self.writeBuffers[nodeId] = buffer
+
+        return buffer
+
+    def __flushBuffer(self, nodeId, name = None, release = False):
+        """
+        Send the buffered writes of the file to the graph.
+        If release is True the buffer is dropped as well.
+        name is the one of the file, recorded in the change log.
+        """
+        with self.__locked(nodeId):
+            if release:
+                buffer = self.writeBuffers.pop(nodeId, None)
+            else:
+                buffer = self.writeBuffers.get(nodeId)
+
+            if buffer is not None and buffer.dirty:
+                buffer.flush()
+                self.__publish([name], [nodeId])
+
     def __parsePathInGroups(self, path):
         
         # Split the path in single elements.
@@ -78,50 +480,40 @@ class GraphFSNeo4j(Operations):
                 else:
                     raise ValueError("There was an error parsing path [{}].".format(path))
 
-    def __isGroup(self, groupId):
-        if not Group.select(self.graph, groupId).first() is None:
-            return True
-
-        return False
-
-    def __isFile(self, fileId):
-        if not File.select(self.graph, fileId).first() is None:
-            return True
-
-        return False
-    
-    def __verifyPath(self, path, lastElementMustExist = False):
+    def __resolvePath(self, path):
         """
-        A path is valid if all the elements apart the last one are existing groups.
-        If lastElementMustExist is True, then the last element must be either a Group or a File
+        Resolve a path with a single query, whatever its depth.
+        A path is valid if all the elements apart the last one are existing groups,
+        while the last element can be a group, a file or a missing element.
+        Groups take precedence over files with the same name.
         """
         elementsIDs = self.__parsePathInGroups(path)
 
         if elementsIDs is None:
-            return True
-        elif lastElementMustExist:
-            if len(elementsIDs) > 1:
-                if all(self.__isGroup(element) for element in elementsIDs[:-1]) \
-                    and (self.__isGroup(elementsIDs[-1]) \
-                        or self.__isFile(elementsIDs[-1])):
-                    return True
-                else:
-                    return False
-            else:
-                if self.__isGroup(elementsIDs[-1]) \
-                    or self.__isFile(elementsIDs[-1]):
-                    return True
-                else:
-                    return False
-        else:    
-            if len(elementsIDs) > 1:
-                if all(self.__isGroup(element) for element in elementsIDs[:-1]):
-                    return True
-                else:
-                    return False
-            else:
-                return True
-        
+            return ResolvedPath(PATH_ROOT, None, None, True, None)
+
+        groupIDs = set(elementsIDs[:-1])
+
+        record = self.backend.data(
+            "resolvePath"
+            , groupIDs = list(groupIDs)
+            , lastId = elementsIDs[-1]
+            )[0]
+
+        if record["foundGroups"] != len(groupIDs):
+            return ResolvedPath(PATH_MISSING, None, elementsIDs, False, None)
+
+        if record["groupNodeId"] is not None:
+            return ResolvedPath(PATH_GROUP, record["groupNodeId"], elementsIDs, True, record["groupProperties"])
+
+        if record["fileNodeId"] is not None:
+            properties = record["fileProperties"]
+            if properties["size"] is None:
+                properties["size"] = 0
+            return ResolvedPath(PATH_FILE, record["fileNodeId"], elementsIDs, True, properties)
+
+        return ResolvedPath(PATH_MISSING, None, elementsIDs, True, None)
+
     # Filesystem methods
     # ==================
 
@@ -137,13 +529,11 @@ class GraphFSNeo4j(Operations):
         This call is not required but is highly recommended. 
         """
         
-        print("-------")
-        print("access: {}".format(path))
-        print("mode: {}".format(mode))
+        logger.debug("access: %s (mode %s)", path, mode)
 
         
-        if not self.__verifyPath(path, lastElementMustExist=True):
-            raise FuseOSError(-errno.ENOENT)
+        if self.__resolvePath(path).kind == PATH_MISSING:
+            raise FuseOSError(errno.ENOENT)
             
         #if ---: VERIFY PERMISSION
         #     raise FuseOSError(errno.EACCES)
@@ -166,134 +556,289 @@ class GraphFSNeo4j(Operations):
         # return dict((key, getattr(st, key)) for key in ('st_atime', 'st_ctime',
         #              'st_gid', 'st_mode', 'st_mtime', 'st_nlink', 'st_size', 'st_uid'))
         
-        print("-------")
-        print("getattr: {}".format(path))
-
+        logger.debug("getattr: %s", path)
+
+        # fstat of an open file: no need to look at the graph
+        if fh:
+            handle = self.handles.get(fh)
+            if isinstance(handle, FileHandle):
+                return self.__fileAttrs(handle.nodeId, handle.properties)
+
+        # Repeated stats of the same path are served from the cache.
+        # Missing paths are cached as None.
+        found, attrs = self.attrCache.lookup(path)
+
+        if found:
+            if attrs is None:
+                raise FuseOSError(errno.ENOENT)
+            return attrs
         
-        if not self.__verifyPath(path, lastElementMustExist=True):
-            print('\tDoesn\'t exist')
+        resolved = self.__resolvePath(path)
+
+        if resolved.kind == PATH_MISSING:
+            logger.debug("%s doesn't exist", path)
+            self.attrCache.put(path, None)
             raise FuseOSError(errno.ENOENT)
             
         # Check if the last element refers to a group or a file
-        if path == "/":
-            return dict(
-                st_mode=(stat.S_IFDIR | 0o755)
-                , st_nlink=2
-                , st_size=1024
-                , st_ctime=self.fileTime
-                , st_mtime=self.fileTime
-                , st_atime=self.fileTime
-                , st_uid = os.getuid()
-                , st_gid = os.getgid()
-            )
+        if resolved.kind in (PATH_ROOT, PATH_GROUP):
+            attrs = self.__dirAttrs(resolved.properties)
 
-        # Split the path in single elements.
-        # Each element is a group, apart the last one, which could be a file.
-        # First we normalize the path (so we have all '/' as delimiters),
-        # then we remove the eventual drive letter, as we don't need it.
-        groupIDs = self.__parsePathInGroups(path)
-        
-        if self.__isGroup(groupIDs[-1]):
-            return dict(
-                st_mode=(stat.S_IFDIR | 0o755)
-                , st_nlink=2
-                , st_size=1024
-                , st_ctime=self.fileTime
-                , st_mtime=self.fileTime
-                , st_atime=self.fileTime
-                , st_uid = os.getuid()
-                , st_gid = os.getgid()
-            )
-        
-        if self.__isFile(groupIDs[-1]):
-
-            query = "MATCH (f:File{{name:'{fileId}'}}) RETURN f.value as value".format(fileId = groupIDs[-1])
-            queryResult = self.graph.evaluate(query)
-            
-            if queryResult is None:
-                fileSize = 0
+        if resolved.kind == PATH_FILE:
+            attrs = self.__fileAttrs(resolved.nodeId, resolved.properties)
+
+        self.attrCache.put(path, attrs)
+
+        return attrs
+
+    def __dirAttrs(self, properties):
+        """
+        Attributes of the root or of a group.
+        """
+        properties = properties or {}
+        mtime = properties.get("mtime") or self.fileTime
+        ctime = properties.get("ctime") or mtime
+
+        return dict(
+            st_mode=(stat.S_IFDIR | 0o755)
+            , st_nlink=2
+            , st_size=1024
+            , st_ctime=ctime
+            , st_mtime=mtime
+            , st_atime=mtime
+            , st_uid = os.getuid()
+            , st_gid = os.getgid()
+        )
+
+    def __fileAttrs(self, nodeId, properties):
+        """
+        Attributes of a file, built from its size and times only.
+        Pending writes are taken into account.
+        Files created before times were stored get the mount time.
+        """
+        fileSize = properties["size"]
+        mtime = properties.get("mtime") or self.fileTime
+        ctime = properties.get("ctime") or mtime
+        atime = properties.get("atime") or mtime
+
+        buffer = self.writeBuffers.get(nodeId)
+        if buffer is not None:
+            fileSize = buffer.size
+            if buffer.dirty:
+                mtime = ctime = buffer.mtime
+
+
+        return dict(
+            st_mode=(stat.S_IFREG | 0o755)
+            , st_nlink=1
+            , st_size= fileSize # Full size of the file
+            , st_ctime=ctime
+            , st_mtime=mtime
+            , st_atime=atime
+            , st_uid = os.getuid()
+            , st_gid = os.getgid()
+        )
+
+    def __entryAttrs(self, entry):
+        """
+        Attributes of an entry returned by the readdir queries.
+        """
+        properties = entry["properties"]
+
+        if entry["kind"] == "group":
+            return self.__dirAttrs(properties)
+
+        if properties["size"] is None:
+            properties["size"] = 0
+
+        return self.__fileAttrs(entry["nodeId"], properties)
+
+    def __listEntries(self, handle, groupIDs, lastRank, lastName):
+        """
+        Stream the entries of a directory following the key (lastRank, lastName),
+        fetching their metadata from the graph one page at a time,
+        so that only a page is held in memory and the first entries are returned right away.
+        groupIDs is None for the root.
+
+        The root is paginated with keyset queries on the indexed names. The entries of the
+        other directories are an intersection of groups, which a page cannot start from
+        the middle of: their keys are computed once when the listing starts (by a query or
+        by the membership index) and kept in the directory handle, to be resumed from.
+        """
+        if groupIDs is None and self.membership is None:
+            yield from self.__listRootEntries(lastRank, lastName)
+            return
+
+        if handle.keys is None:
+            if self.membership is not None:
+                handle.keys = self.membership.listing(groupIDs)
             else:
-                fileSize = len(queryResult.encode("utf8"))
-            
-            print('fileSize: {}'.format(fileSize))
+                handle.keys = sorted(
+                    (record["rank"], record["name"], record["nodeId"])
+                    for record in self.backend.data("readdirKeys", groupIDs = groupIDs))
 
-            return dict(
-                st_mode=(stat.S_IFREG | 0o755)
-                , st_nlink=1
-                , st_size= fileSize # Full size of the file
-                , st_ctime=self.fileTime
-                , st_mtime=self.fileTime
-                , st_atime=self.fileTime
-                , st_uid = os.getuid()
-                , st_gid = os.getgid()
-            )
-        
-        # The path does not refer to a group nor a file
-        raise FuseOSError(-errno.ENOENT)
+        keys = handle.keys
+        start = bisect_right(keys, (lastRank, lastName, float("inf")))
 
-    def readdir(self, path, fh=None):
-        
-        # How to manage the fact that a file can have the same name as a group?
+        for pageStart in range(start, len(keys), self.readdirPageSize):
+            page = keys[pageStart:pageStart + self.readdirPageSize]
 
-        print("-------")
-        print("readdir: {}".format(path))
+            records = self.backend.data("nodeProperties", nodeIds = [nodeId for _, _, nodeId in page])
+            properties = dict((record["nodeId"], record["properties"]) for record in records)
 
-        dirents = ['.', '..']
-        
-        if not self.__verifyPath(path, lastElementMustExist=True):
-            print("The path [{}] is invalid".format(path))
+            for rank, name, nodeId in page:
+                # Nodes deleted from the graph since the listing started are skipped
+                if nodeId in properties:
+                    yield dict(name = name, kind = "group" if rank == 0 else "file", rank = rank
+                        , nodeId = nodeId, properties = properties[nodeId])
+
+    def __listRootEntries(self, lastRank, lastName):
+        """
+        Stream the groups then the files of the root following the key (lastRank, lastName),
+        each page starting after the last entry of the previous one (keyset pagination).
+        """
+        while True:
+            queryName = "readdirRootGroups" if lastRank == 0 else "readdirRootFiles"
+            page = self.backend.data(queryName, lastName = lastName, limit = self.readdirPageSize)
+
+            for entry in page:
+                yield entry
+
+            if len(page) == self.readdirPageSize:
+                lastRank, lastName = page[-1]["rank"], page[-1]["name"]
+            elif lastRank == 0:
+                # Groups of the root are over, continue with the files
+                lastRank, lastName = 1, ""
+            else:
+                return
+
+    def opendir(self, path):
+        """
+        Resolve the path once and allocate a handle keeping the position of the listing.
+        """
+        logger.debug("opendir: %s", path)
+
+        resolved = self.__resolvePath(path)
+
+        if resolved.kind == PATH_MISSING:
+            logger.debug("The path [%s] is invalid", path)
             raise FuseOSError(errno.ENOENT)
-            
-        # Split the path in single elements.
-        # Each element is a group, apart the last one, which could be a file.
-        # First we normalize the path (so we have all '/' as delimiters),
-        # then we remove the eventual drive letter, as we don't need it.
-        groupIDs = self.__parsePathInGroups(path)
 
-        # Retrieve all the groups
-        if groupIDs is None:
-            query = "MATCH (g:Group) RETURN g.name as name"
-        else:
-            # Retrieve files that are connected to all the groups
-            # We achieve that by checking which files belong to the groups specified in the path
-            # and see if they belong to additional groups as well
-            query = """WITH {groupIDs} as groups
-                MATCH (g:Group)<-[:isInGroup]-(f:File)-[:isInGroup]->(gNew:Group)
-                WHERE g.name in groups
-                and not gNew.name in groups
-                WITH gNew, size(groups) as inputCnt, count(DISTINCT g) as cnt
-                WHERE cnt = inputCnt
-                RETURN gNew.name as name""".format(groupIDs = list(groupIDs))
-        
-        print("query: {}".format(query))
-        
-        queryResults = self.graph.run(query)
-        
-        dirents.extend([queryResult["name"] for queryResult in queryResults])
-        
-        # Retrieve all the files
-        if groupIDs is None:
-            query = "MATCH (f:File) RETURN f.name as name"
-        else:
-            # Retrieve files that are connected to all the groups
-            # We achieve that by checking which files belong to the groups specified in the path
-            query = """WITH {groupIDs} as groups
-                MATCH (g:Group)<-[:isInGroup]-(f:File)
-                WHERE g.name in groups
-                WITH f, size(groups) as inputCnt, count(DISTINCT g) as cnt
-                WHERE cnt = inputCnt
-                RETURN f.name as name""".format(groupIDs = list(groupIDs))
-        
-        print("query: {}".format(query))
-        
-        queryResults = self.graph.run(query)
-        
-        dirents.extend([queryResult["name"] for queryResult in queryResults])
+        if resolved.kind == PATH_FILE:
+            logger.debug("The path [%s] refers to a file", path)
+            raise FuseOSError(errno.ENOTDIR)
+
+        return self.handles.openDir(path, resolved).fh
+
+    def releasedir(self, path, fh):
+        self.handles.release(fh)
+        return 0
+
+    def readdir(self, path, fh=None, offset=0):
+        """
+        Return the entries of the directory as (name, attrs, offset) tuples,
+        starting from the given offset ('.' has offset 1, '..' 2, then the groups and the files).
+        The entries are streamed from the graph a page at a time, and a listing interrupted because
+        the kernel buffer is full resumes from the position stored in the directory handle.
+        The attributes of the entries come with the listing and are stored in the attribute cache,
+        so the getattr calls following a readdir are served without querying the graph.
+        """
         
-        print("dirents: {}".format(dirents))
+        # How to manage the fact that a file can have the same name as a group?
 
-        for r in dirents:
-            yield r
+        logger.debug("readdir: %s (offset %s)", path, offset)
+
+        handle = self.handles.get(fh) if fh else None
+        if not isinstance(handle, DirHandle):
+            handle = DirHandle(None, path, None)
+
+        # Position -> key of the entries returned by this call
+        positions = {}
+        handle.positions, previousPositions = positions, handle.positions
+
+        # Directories listed in a single page are cached as a whole
+        found, entries = self.direntCache.lookup(path)
+
+        if not found:
+            resolved = handle.resolved
+            if resolved is None:
+                resolved = self.__resolvePath(path)
+
+            if resolved.kind == PATH_MISSING:
+                logger.debug("The path [%s] is invalid", path)
+                raise FuseOSError(errno.ENOENT)
+
+            if resolved.kind == PATH_FILE:
+                logger.debug("The path [%s] refers to a file", path)
+                raise FuseOSError(errno.ENOTDIR)
+
+        if offset < 1:
+            yield ('.', None, 1)
+        if offset < 2:
+            yield ('..', None, 2)
+
+        if found:
+            for index in range(max(offset, 2) - 2, len(entries)):
+                name, rank = entries[index]
+                # The cached attributes might have been invalidated in the meanwhile:
+                # in that case the kernel will ask for them with getattr
+                _, attrs = self.attrCache.lookup(os.path.join(path, name))
+                positions[index + 3] = (rank, name)
+                yield (name, attrs, index + 3)
+            return
+
+        groupIDs = resolved.elementsIDs
+        if groupIDs is not None:
+            groupIDs = list(set(groupIDs))
+
+        # Find where to restart the listing from
+        skip = 0
+        if offset <= 2:
+            lastRank, lastName = 0, ""
+            handle.groupNames = set()
+            handle.keys = None
+        elif offset in previousPositions:
+            lastRank, lastName = previousPositions[offset]
+        else:
+            # Unknown position (e.g. seekdir): list again from the beginning
+            lastRank, lastName = 0, ""
+            handle.groupNames = set()
+            handle.keys = None
+            skip = offset - 2
+
+        entryOffset = max(offset, 2)
+        listed = []
+
+        for entry in self.__listEntries(handle, groupIDs, lastRank, lastName):
+            name = entry["name"]
+
+            # Groups come first and take precedence over files with the same name,
+            # as they do when resolving a path
+            if entry["kind"] == "group":
+                handle.groupNames.add(name)
+            elif name in handle.groupNames:
+                continue
+
+            if skip > 0:
+                skip -= 1
+                continue
+
+            attrs = self.__entryAttrs(entry)
+            self.attrCache.put(os.path.join(path, name), attrs)
+
+            if listed is not None:
+                listed.append((name, entry["rank"]))
+                if len(listed) >= self.readdirPageSize:
+                    # Too big to be cached
+                    listed = None
+
+            entryOffset += 1
+            positions[entryOffset] = (entry["rank"], name)
+            yield (name, attrs, entryOffset)
+
+        # The whole listing was returned: cache it if it is small
+        if listed is not None and offset <= 2:
+            self.direntCache.put(path, listed)
 
     def readlink(self, path):
         # pathname = os.readlink(self._full_path(path))
@@ -315,74 +860,69 @@ class GraphFSNeo4j(Operations):
         See rmdir(2) for details. 
         """
 
-        print("-------")
-        print("rmdir {}".format(path))
+        logger.debug("rmdir %s", path)
         
-        if not self.__verifyPath(path, lastElementMustExist=True):
-            print("The path [{}] is invalid".format(path))
+        resolved = self.__resolvePath(path)
+
+        if resolved.kind == PATH_MISSING:
+            logger.debug("The path [%s] is invalid", path)
             raise FuseOSError(errno.ENOENT)
             
-        # Split the path in single elements.
-        # Each element is a group, apart the last one, which could be a file.
-        # First we normalize the path (so we have all '/' as delimiters),
-        # then we remove the eventual drive letter, as we don't need it.
-        groupIDs = self.__parsePathInGroups(path)
-
-        if groupIDs is None:
-            print("Cannot remove root.")
+        if resolved.kind == PATH_ROOT:
+            logger.debug("Cannot remove root.")
             raise FuseOSError(errno.EPERM)
         
-        # Check if the last element exists already as a group
-        if not self.__isGroup(groupIDs[-1]):
-            # It already exists
-            print("The group {} does not exists".format(groupIDs[-1]))
+        groupIDs = resolved.elementsIDs
+
+        # Check if the last element exists as a group
+        if resolved.kind != PATH_GROUP:
+            logger.debug("The group %s does not exists", groupIDs[-1])
             raise FuseOSError(errno.ENOENT)
             
         # Check if the group contains files
-        if len(Group.select(self.graph, groupIDs[-1]).first().hasFiles) > 0:
+        if self.backend.evaluate("countGroupFiles", nodeId = resolved.nodeId) > 0:
             # It already exists
-            print("The group {} contains files".format(groupIDs[-1]))
+            logger.debug("The group %s contains files", groupIDs[-1])
             raise FuseOSError(errno.ENOTEMPTY)
             
-        print("Delete group {}".format(groupIDs[-1]))
+        logger.debug("Delete group %s", groupIDs[-1])
 
-        query = "MATCH (g:Group{{name:'{groupId}'}}) DELETE g".format(groupId = groupIDs[-1])
-        queryResults = self.graph.run(query)
+        self.backend.run("deleteGroup", nodeId = resolved.nodeId)
+
+        self.__invalidate(groupIDs[-1], update = ["removeGroup", resolved.nodeId])
 
     def mkdir(self, path, mode):
         
-        print("-------")
-        print("mkdir {}".format(path))
+        logger.debug("mkdir %s", path)
+
+        resolved = self.__resolvePath(path)
 
-        if not self.__verifyPath(path):
-            print("The path [{}] is invalid".format(path))
+        if not resolved.parentsExist:
+            logger.debug("The path [%s] is invalid", path)
             raise FuseOSError(errno.ENOENT)
             
-        # Split the path in single elements.
-        # Each element is a group, apart the last one, which could be a file.
-        # First we normalize the path (so we have all '/' as delimiters),
-        # then we remove the eventual drive letter, as we don't need it.
-        groupIDs = self.__parsePathInGroups(path)
-
-        if groupIDs is None:
-            print("Cannot create root.")
+        if resolved.kind == PATH_ROOT:
+            logger.debug("Cannot create root.")
             raise FuseOSError(errno.EPERM)
             
+        groupIDs = resolved.elementsIDs
+
         # Check if the last element exists already as a group
-        if self.__isGroup(groupIDs[-1]):
-            print("The group {} already exists".format(groupIDs[-1]))
+        if resolved.kind == PATH_GROUP:
+            logger.debug("The group %s already exists", groupIDs[-1])
             raise FuseOSError(errno.EEXIST)
 
         # Check if the last element exists already as a file
-        if self.__isFile(groupIDs[-1]):
+        if resolved.kind == PATH_FILE:
             # It already exists
-            print("The file {} already exists".format(groupIDs[-1]))
+            logger.debug("The file %s already exists", groupIDs[-1])
             raise FuseOSError(errno.EEXIST)
             
-        print("Create group {}".format(groupIDs[-1]))
+        logger.debug("Create group %s", groupIDs[-1])
+
+        nodeId = self.backend.evaluate("createGroup", groupId = groupIDs[-1], now = time())
 
-        query = "CREATE (g:Group{{name:'{groupId}'}})".format(groupId = groupIDs[-1])
-        queryResults = self.graph.run(query)
+        self.__invalidate(groupIDs[-1], update = ["addGroup", groupIDs[-1], nodeId])
 
     def statfs(self, path):
         # full_path = self._full_path(path)
@@ -399,27 +939,34 @@ class GraphFSNeo4j(Operations):
         the last hard link is removed. See unlink(2) for details. 
         """
         
-        print("-------")
-        print("unlink {}".format(path))
+        logger.debug("unlink %s", path)
 
-        if not self.__verifyPath(path, lastElementMustExist = True):
-            print("The path [{}] is invalid".format(path))
-            raise FuseOSError(errno.ENOENT)
+        resolved = self.__resolvePath(path)
 
-        groupIDs = self.__parsePathInGroups(path)
+        if resolved.kind == PATH_MISSING:
+            logger.debug("The path [%s] is invalid", path)
+            raise FuseOSError(errno.ENOENT)
 
-        if groupIDs is None:
-            print("Cannot unlink root.")
+        if resolved.kind == PATH_ROOT:
+            logger.debug("Cannot unlink root.")
             raise FuseOSError(errno.EPERM)
             
+        groupIDs = resolved.elementsIDs
+
         # Check if the last element exists already as a group
-        if self.__isGroup(groupIDs[-1]):
-            print("Cannot unlink group {}".format(groupIDs[-1]))
+        if resolved.kind == PATH_GROUP:
+            logger.debug("Cannot unlink group %s", groupIDs[-1])
             raise FuseOSError(errno.EPERM)
         
-        # Delete the file with all its relationships
-        query = "MATCH (f:File {{ name: '{fileId}' }}) DETACH DELETE f".format(fileId = groupIDs[-1])
-        queryResults = self.graph.run(query)
+        # Delete the file with its content and all its relationships.
+        # Its pending writes are discarded.
+        with self.__locked(resolved.nodeId):
+            self.writeBuffers.pop(resolved.nodeId, None)
+            self.content.delete(resolved.nodeId)
+
+        self.__dropReadAhead(resolved.nodeId)
+
+        self.__invalidate(groupIDs[-1], update = ["removeFile", resolved.nodeId])
 
     def symlink(self, name, target):
         # return os.symlink(target, self._full_path(name))
@@ -438,39 +985,43 @@ class GraphFSNeo4j(Operations):
         > (which will fail if the target exists) first, then unlink the old name if link succeeded.
         """
         
-        print("-------")
-        print("rename")
-        print("old: {}".format(old))
-        print("new: {}".format(new))
+        logger.debug("rename: %s -> %s", old, new)
         
         if not isinstance(old, str):
-            print("The element to rename must be a string.")
+            logger.debug("The element to rename must be a string.")
             raise FuseOSError(errno.EINVAL)
             
         if not isinstance(new, str):
-            print("The element to rename must be a string.")
+            logger.debug("The element to rename must be a string.")
             raise FuseOSError(errno.EINVAL)
         
-        if not self.__verifyPath(old, lastElementMustExist=True):
-            print("The path [{}] is invalid".format(old))
+        oldResolved = self.__resolvePath(old)
+
+        if oldResolved.kind == PATH_MISSING:
+            logger.debug("The path [%s] is invalid", old)
             raise FuseOSError(errno.ENOENT)
 
-        if not self.__verifyPath(new):
-            print("The path [{}] is invalid".format(new))
+        newResolved = self.__resolvePath(new)
+
+        if not newResolved.parentsExist:
+            logger.debug("The path [%s] is invalid", new)
             raise FuseOSError(errno.ENOENT)
         
-        oldGroupIDs = self.__parsePathInGroups(old)
-        newGroupIDs = self.__parsePathInGroups(new)    
+        oldGroupIDs = oldResolved.elementsIDs
+        newGroupIDs = newResolved.elementsIDs
         
-        if oldGroupIDs is None:
-            print("Cannot rename/move root.")
+        if oldResolved.kind == PATH_ROOT:
+            logger.debug("Cannot rename/move root.")
             raise FuseOSError(errno.EPERM)
             
-        if newGroupIDs is None:
+        if newResolved.kind == PATH_ROOT:
             # All groups and files are already in the root group,
             # so we do not have to do anything.
             return 0
             
+        # Every case is a single query run in its own transaction:
+        # the element is either fully moved or left where it was.
+
         # Check if the last element newGroupIDs 
         # is the same of oldGroupIDs. In yes, it means we
         # are trying to move the old element
@@ -482,67 +1033,38 @@ class GraphFSNeo4j(Operations):
             # We have to move old into new
             
             # Check if last element of old is a group
-            if self.__isGroup(oldGroupIDs[-1]):
-                print("Cannot move folder into a folder.")
+            if oldResolved.kind == PATH_GROUP:
+                logger.debug("Cannot move folder into a folder.")
                 raise FuseOSError(errno.EPERM)
                 
-            elif self.__isFile(oldGroupIDs[-1]):
+            elif oldResolved.kind == PATH_FILE:
                 # We have to:
                 # - remove file oldGroupIDs[-1] from all the groups in oldGroupIDs[:-1]
                 # - add file oldGroupIDs[-1] to all the groups newGroupIDs
                 
-                for groupId in oldGroupIDs[:-1]:
-                    query = "MATCH (f:File)-[r:isInGroup]->(g:Group) WHERE f.name = '{fileId}' AND g.name = '{groupId}' DELETE r".format(
-                        fileId = oldGroupIDs[-1]
-                        , groupId = groupId
-                        )
-                    
-                    queryResults = self.graph.run(query)
-                
-                if len(newGroupIDs) > 0:
-                    for groupId in newGroupIDs:
-                        query = "MATCH (f:File),(g:Group) WHERE f.name = '{fileId}' AND g.name = '{groupId}' CREATE (f)-[r:isInGroup]->(g) RETURN r".format(
-                            fileId = oldGroupIDs[-1]
-                            , groupId = groupId
-                            )
-                        
-                        queryResults = self.graph.run(query)
+                with self.backend.transaction() as tx:
+                    tx.run("moveFile", nodeId = oldResolved.nodeId, newFileId = None
+                        , oldGroupIDs = oldGroupIDs[:-1], newGroupIDs = newGroupIDs, now = time())
+
+                update = ["moveFile", oldResolved.nodeId, None, oldGroupIDs[:-1], newGroupIDs]
             
             else:
                 # We shouldn't be here
-                print('Something went wrong.')
+                logger.error('Something went wrong.')
                 raise FuseOSError(errno.EBADR)
             
         else:
             
             # Check if last element of old is a group
-            if self.__isGroup(oldGroupIDs[-1]):
+            if oldResolved.kind == PATH_GROUP:
 
-                if self.__isFile(newGroupIDs[-1]):
-                    print("Cannot rename file as an existing folder.")                    
+                if newResolved.kind == PATH_FILE:
+                    logger.debug("Cannot rename file as an existing folder.")
                     raise FuseOSError(errno.EPERM)
-            
-                    # Is the following the right behaviour?
-
-                    # We have to:
-                    # - delete file newGroupIDs[-1],
-                    # - rename group oldGroupIDs[-1] into newGroupIDs[-1],
-                    # - move group oldGroupIDs[-1] into all the groups newGroupIDs[:-1]
-                    # TBD: LAST STEP MISSING
-
-                    self.unlink(newGroupIDs[-1])
-
-                    query = """MATCH (g:Group {{ name: '{oldGroupId}' }})
-                        SET g.name = '{newGroupId}'
-                        RETURN g""".format(
-                            oldGroupId = oldGroupIDs[-1]
-                            , newGroupId = newGroupIDs[-1])
 
-                    queryResults = self.graph.run(query)
-
-                elif self.__isGroup(newGroupIDs[-1]):
+                elif newResolved.kind == PATH_GROUP:
                     # We have to move group oldGroupIDs[-1] into all the groups newGroupIDs
-                    print("Cannot move folder into a folder.")                    
+                    logger.debug("Cannot move folder into a folder.")
                     raise FuseOSError(errno.EPERM)
                     
                 else:
@@ -551,97 +1073,69 @@ class GraphFSNeo4j(Operations):
                     # - move group oldGroupIDs[-1] into all the groups newGroupIDs[:-1]
                     # TBD: LAST STEP MISSING
 
-                    query = """MATCH (g:Group {{ name: '{oldGroupId}' }})
-                        SET g.name = '{newGroupId}'
-                        RETURN g""".format(
-                            oldGroupId = oldGroupIDs[-1]
-                            , newGroupId = newGroupIDs[-1])
+                    with self.backend.transaction() as tx:
+                        tx.run("renameGroup"
+                            , nodeId = oldResolved.nodeId, newGroupId = newGroupIDs[-1], now = time())
 
-                    queryResults = self.graph.run(query)
+                    update = ["renameGroup", oldResolved.nodeId, newGroupIDs[-1]]
             
-            elif self.__isFile(oldGroupIDs[-1]):
+            elif oldResolved.kind == PATH_FILE:
                 
-                if self.__isFile(newGroupIDs[-1]):
+                if newResolved.kind == PATH_FILE:
                     # We have to:
                     # - copy the content of file oldGroupIDs[-1] in file newGroupIDs[-1],
                     # - delete file oldGroupIDs[-1]
                     # - add the file newGroupIDs[-1] to all the groups of file oldGroupIDs[-1]
-                    query = """MATCH (fOld:File {{ name: '{oldFileId}' }}), (fNew:File {{ name: '{newFileId}' }})
-                        SET fNew.value = fOld.value
-                        """.format(
-                            oldFileId = oldGroupIDs[-1]
-                            , newFileId = newGroupIDs[-1])
+                    with self.__locked(oldResolved.nodeId, newResolved.nodeId):
+                        self.__flushBuffer(oldResolved.nodeId, oldGroupIDs[-1], release = True)
+                        self.writeBuffers.pop(newResolved.nodeId, None)
 
-                    queryResults = self.graph.run(query)
-                    
-                    self.unlink(oldGroupIDs[-1])
-                    
-                    if len(oldGroupIDs) > 1:
-                        for groupId in oldGroupIDs[:-1]:
-                            query = "MATCH (f:File),(g:Group) WHERE f.name = '{fileId}' AND g.name = '{groupId}' CREATE (f)-[r:isInGroup]->(g) RETURN r".format(
-                                fileId = newGroupIDs[-1]
-                                , groupId = groupId
-                                )
-                            
-                            queryResults = self.graph.run(query)
+                        with self.backend.transaction() as tx:
+                            tx.run("replaceFile", fromNodeId = oldResolved.nodeId, toNodeId = newResolved.nodeId
+                                , groupIDs = oldGroupIDs[:-1], now = time())
+
+                        self.content.invalidate(oldResolved.nodeId)
+                        self.content.invalidate(newResolved.nodeId)
+
+                        update = ["replaceFile", oldResolved.nodeId, newResolved.nodeId, oldGroupIDs[:-1]]
+
+                        # The open handles of the old file now refer to the new one
+                        self.handles.retarget(oldResolved.nodeId, newResolved.nodeId, newGroupIDs[-1])
+                        self.__dropReadAhead(newResolved.nodeId)
                     
-                elif self.__isGroup(newGroupIDs[-1]):
+                elif newResolved.kind == PATH_GROUP:
                     # We have to:
                     # - remove file oldGroupIDs[-1] from all the groups in oldGroupIDs[:-1]
                     # - add file oldGroupIDs[-1] to all the groups newGroupIDs
                     
-                    for groupId in oldGroupIDs[:-1]:
-                        query = "MATCH (f:File)-[r:isInGroup]->(g:Group) WHERE f.name = '{fileId}' AND g.name = '{groupId}' DELETE r".format(
-                            fileId = oldGroupIDs[-1]
-                            , groupId = groupId
-                            )
-                        
-                        queryResults = self.graph.run(query)
-                    
-                    for groupId in newGroupIDs:
-                        query = "MATCH (f:File),(g:Group) WHERE f.name = '{fileId}' AND g.name = '{groupId}' CREATE (f)-[r:isInGroup]->(g) RETURN r".format(
-                            fileId = oldGroupIDs[-1]
-                            , groupId = groupId
-                            )
-                        
-                        queryResults = self.graph.run(query)
+                    with self.backend.transaction() as tx:
+                        tx.run("moveFile", nodeId = oldResolved.nodeId, newFileId = None
+                            , oldGroupIDs = oldGroupIDs[:-1], newGroupIDs = newGroupIDs, now = time())
+
+                    update = ["moveFile", oldResolved.nodeId, None, oldGroupIDs[:-1], newGroupIDs]
 
                 else:
                     # We have to:
                     # - rename file oldGroupIDs[-1] into newGroupIDs[-1],
                     # - remove file oldGroupIDs[-1] from all the groups in oldGroupIDs[:-1]
                     # - add file oldGroupIDs[-1] to all the groups newGroupIDs
-                    query = """MATCH (f:File {{ name: '{oldFileId}' }})
-                        SET f.name = '{newFileId}'
-                        RETURN f""".format(
-                            oldFileId = oldGroupIDs[-1]
-                            , newFileId = newGroupIDs[-1])
-
-                    queryResults = self.graph.run(query)
-
-                    # We remove file oldGroupIDs[-1] from groups oldGroupIDs[:-1]
-                    for groupId in oldGroupIDs[:-1]:
-                        query = "MATCH (f:File)-[r:isInGroup]->(g:Group) WHERE f.name = '{fileId}' AND g.name = '{groupId}' DELETE r".format(
-                            fileId = oldGroupIDs[-1]
-                            , groupId = groupId
-                            )
-                        
-                        queryResults = self.graph.run(query)
-                    
-                    # We have to move file old into folders new
-                    for groupId in newGroupIDs:
-                        query = "MATCH (f:File),(g:Group) WHERE f.name = '{fileId}' AND g.name = '{groupId}' CREATE (f)-[r:isInGroup]->(g) RETURN r".format(
-                            fileId = oldGroupIDs[-1]
-                            , groupId = groupId
-                            )
-                        
-                        queryResults = self.graph.run(query)
+                    with self.backend.transaction() as tx:
+                        tx.run("moveFile", nodeId = oldResolved.nodeId, newFileId = newGroupIDs[-1]
+                            , oldGroupIDs = oldGroupIDs[:-1], newGroupIDs = newGroupIDs[:-1], now = time())
+
+                    update = ["moveFile", oldResolved.nodeId, newGroupIDs[-1], oldGroupIDs[:-1], newGroupIDs[:-1]]
+
+                    self.handles.retarget(oldResolved.nodeId, oldResolved.nodeId, newGroupIDs[-1])
             else:
                 # We shouldn't be here
-                print('Something went wrong.')
+                logger.error('Something went wrong.')
                 raise FuseOSError(errno.EBADR)
-        
-            return 0
+
+        # Both names changed their paths or content
+        self.__invalidate(oldGroupIDs[-1], newResolved.elementsIDs[-1]
+            , nodeIds = [oldResolved.nodeId, newResolved.nodeId], update = update)
+
+        return 0
     
     def link(self, target, name):
         # return os.link(self._full_path(name), self._full_path(target))
@@ -649,7 +1143,27 @@ class GraphFSNeo4j(Operations):
         
     def utimens(self, path, times=None):
         # return os.utime(self._full_path(path), times)
-        pass
+        logger.debug("utimens %s", path)
+
+        resolved = self.__resolvePath(path)
+
+        if resolved.kind == PATH_MISSING:
+            logger.debug("The path [%s] is invalid", path)
+            raise FuseOSError(errno.ENOENT)
+
+        if resolved.kind == PATH_ROOT:
+            # The times of the root are the ones of the mount
+            return 0
+
+        now = time()
+        atime, mtime = times if times is not None else (now, now)
+
+        self.backend.run("setTimes", nodeId = resolved.nodeId, atime = atime, mtime = mtime, ctime = now)
+
+        self.__setProperties(resolved.nodeId, atime = atime, mtime = mtime, ctime = now)
+        self.__invalidate(resolved.elementsIDs[-1], structural = False)
+
+        return 0
         
     # File methods
     # ============
@@ -661,27 +1175,35 @@ class GraphFSNeo4j(Operations):
         If you use file handles, you should also allocate any necessary structures and set fi->fh.
         In addition, fi has some other fields that an advanced filesystem might find useful;
         see the structure definition in fuse_common.h for very brief commentary. 
+
+        The path is resolved only here: the returned handle is then used by
+        read, write, truncate, flush and release.
         """
-        print("-------")
-        print("open {}".format(path))
+        logger.debug("open %s", path)
+
+        resolved = self.__resolvePath(path)
 
-        if not self.__verifyPath(path):
-            print("The path [{}] is invalid".format(path))
+        if not resolved.parentsExist:
+            logger.debug("The path [%s] is invalid", path)
             raise FuseOSError(errno.ENOENT)
             
-        # Split the path in single elements.
-        # Each element is a group, apart the last one, which is the file name.
-        # First we normalize the path (so we have all '/' as delimiters),
-        # then we remove the eventual drive letter, as we don't need it.
-        groupIDs = self.__parsePathInGroups(path)
-
         # Check if path is root or the last element is a group
-        if groupIDs is None \
-            or self.__isGroup(groupIDs[-1]):
-            print("Must specify a proper file name. The path [{}] refers to a group".format(path))
+        if resolved.kind in (PATH_ROOT, PATH_GROUP):
+            logger.debug("Must specify a proper file name. The path [%s] refers to a group", path)
             raise FuseOSError(errno.EISDIR)
 
-        return 0
+        if resolved.kind == PATH_MISSING:
+            logger.debug("The file %s does not exists", resolved.elementsIDs[-1])
+            raise FuseOSError(errno.ENOENT)
+
+        handle = self.handles.open(resolved.nodeId, resolved.elementsIDs[-1], resolved.properties, flags)
+
+        # Start fetching the content, unless the file is opened only for writing
+        if self.prefetcher is not None and flags & os.O_ACCMODE != os.O_WRONLY:
+            handle.readAhead = ReadAhead()
+            self.prefetcher.start(handle.readAhead, handle.nodeId, handle.properties["size"] or 0)
+
+        return handle.fh
 
     def create(self, path, mode, fi=None):
         """
@@ -689,174 +1211,306 @@ class GraphFSNeo4j(Operations):
         If the file does not exist, first create it with the specified mode, and then open it.
         """
 
-        print("-------")
-        print("create {}".format(path))
+        logger.debug("create %s", path)
 
-        if not self.__verifyPath(path):
-            print("The path [{}] is invalid".format(path))
+        resolved = self.__resolvePath(path)
+
+        if not resolved.parentsExist:
+            logger.debug("The path [%s] is invalid", path)
             raise FuseOSError(errno.ENOENT)
             
-        # Split the path in single elements.
-        # Each element is a group, apart the last one, which is the file name.
-        # First we normalize the path (so we have all '/' as delimiters),
-        # then we remove the eventual drive letter, as we don't need it.
-        groupIDs = self.__parsePathInGroups(path)
-
         # Check if path is root or the last element exists already as a group
-        if groupIDs is None \
-            or self.__isGroup(groupIDs[-1]):
-            print("The path [{}] refers to a group.".format(path))
+        if resolved.kind in (PATH_ROOT, PATH_GROUP):
+            logger.debug("The path [%s] refers to a group.", path)
             raise FuseOSError(errno.EISDIR)
         
+        groupIDs = resolved.elementsIDs
+
         # Check if the last element exists already as a file
-        if self.__isFile(groupIDs[-1]):
+        if resolved.kind == PATH_FILE:
             # It already exists
-            return 0
+            return self.handles.open(resolved.nodeId, groupIDs[-1], resolved.properties).fh
         
-        print("Create file {}".format(groupIDs[-1]))
+        logger.debug("Create file %s", groupIDs[-1])
 
-        query = "CREATE (f:File{{name:'{fileId}'}})".format(fileId = groupIDs[-1])
-        queryResults = self.graph.run(query)
+        now = time()
+        nodeId = self.backend.evaluate("createFile", fileId = groupIDs[-1], now = now)
         
         # Link the file to all the groups appearing in groupIDs
         if len(groupIDs) > 1:
-            for groupId in groupIDs[:-1]:
-                query = "MATCH (f:File),(g:Group) WHERE f.name = '{fileId}' AND g.name = '{groupId}' CREATE (f)-[r:isInGroup]->(g) RETURN r".format(
-                    fileId = groupIDs[-1]
-                    , groupId = groupId
-                    )
-                
-                queryResults = self.graph.run(query)
+            self.backend.run("linkFile", nodeId = nodeId, groupIDs = groupIDs[:-1])
 
-        return 0
+        self.__invalidate(groupIDs[-1], update = ["addFile", groupIDs[-1], nodeId, groupIDs[:-1]])
+
+        return self.handles.open(nodeId, groupIDs[-1], dict(size = 0, atime = now, mtime = now, ctime = now)).fh
 
     def read(self, path, length, offset, fh):
         
-        print("-------")
-        print("read {}".format(path))
-        print("length, offset, fh:\n{}\n{}\n{}".format(length, offset, fh))
+        logger.debug("read %s (length %s, offset %s, fh %s)", path, length, offset, fh)
+
+        handle = self.__handle(fh)
+
+        # The access time is kept in the handle and stored when the file is released,
+        # to avoid a write to the graph for every read, and only when relatime requires it,
+        # so that reading a file does not write to the graph at every open
+        properties = handle.properties
+        now = time()
+        atime = properties.get("atime")
+        if atime is None \
+            or atime <= max(properties.get("mtime") or 0, properties.get("ctime") or 0) \
+            or now - atime >= RELATIME_INTERVAL:
+            properties["atime"] = now
+            handle.accessed = True
+
+        # Read through the write-back buffer, if there are pending writes
+        with self.__locked(handle.nodeId):
+            buffer = self.writeBuffers.get(handle.nodeId)
+            if buffer is not None:
+                return buffer.read(length, offset)
+
+        # Use the content fetched ahead, and fetch the following one
+        if handle.readAhead is not None:
+            return self.prefetcher.read(handle.readAhead, handle.nodeId
+                , handle.properties["size"] or 0, length, offset)
+
+        # Fetch only the chunks overlapping the requested range
+        return self.content.read(handle.nodeId, length, offset)
 
-        if not self.__verifyPath(path, lastElementMustExist = True):
-            print("The path [{}] is invalid".format(path))
-            raise FuseOSError(errno.ENOENT)
-            
-        # Split the path in single elements.
-        # Each element is a group, apart the last one, which is the file name.
-        # First we normalize the path (so we have all '/' as delimiters),
-        # then we remove the eventual drive letter, as we don't need it.
-        groupIDs = self.__parsePathInGroups(path)
+    def write(self, path, buf, offset, fh):
+        
+        logger.debug("write %s (length %s, offset %s, fh %s)", path, len(buf), offset, fh)
 
-        # Check if path is root or the last element exists already as a group
-        if groupIDs is None \
-            or self.__isGroup(groupIDs[-1]):
-            print("The path [{}] refers to a group.".format(path))
-            raise FuseOSError(errno.EISDIR)
+        handle = self.__handle(fh)
 
-        # Check if the last element exists as a file
-        if not self.__isFile(groupIDs[-1]):
-            # It already exists
-            print("The element {} is not a file".format(groupIDs[-1]))
-            raise FuseOSError(errno.ENOENT)
-        
-        query = "MATCH (f:File{{name:'{fileId}'}}) RETURN f.value as value".format(fileId = groupIDs[-1])
-        queryResult = self.graph.evaluate(query)
-        
-        print('value:{}'.format(queryResult))
+        # Whether the data is in the graph already
+        written = self.writeBackThreshold <= 0
 
-        if queryResult is None:
-            return None
+        if written:
+            # Write-through: only the chunks overlapping the written range are updated
+            self.content.write(handle.nodeId, buf, offset)
+            now = time()
+            self.__setProperties(handle.nodeId
+                , size = max(handle.properties["size"], offset + len(buf)), mtime = now, ctime = now)
         else:
-            return queryResult.encode()
+            # The data is kept in memory until the file is flushed or released,
+            # or too much data is pending
+            with self.__locked(handle.nodeId):
+                buffer = self.__writeBuffer(handle.nodeId, handle.properties["size"])
+                buffer.write(buf, offset)
 
-    def write(self, path, buf, offset, fh):
-        
-        print("-------")
-        print("write {}".format(path))
-        print("buf:\n{}".format(buf.decode('utf-8')))
-        print("\tfh {}".format(fh))
-
-        if not self.__verifyPath(path, lastElementMustExist = True):
-            print("The path [{}] is invalid".format(path))
-            raise FuseOSError(errno.ENOENT)
-            
-        # Split the path in single elements.
-        # Each element is a group, apart the last one, which is the file name.
-        # First we normalize the path (so we have all '/' as delimiters),
-        # then we remove the eventual drive letter, as we don't need it.
-        groupIDs = self.__parsePathInGroups(path)
+                if buffer.dirtyBytes >= self.writeBackThreshold:
+                    buffer.flush()
+                    written = True
 
-        if groupIDs is None:
-            print("Must specify a proper file name. The path [{}] is invalid".format(path))
-            raise FuseOSError(errno.ENOENT)
-        
-        # Check if the last element exists already as a file
-        if not self.__isFile(groupIDs[-1]):
-            print("The file {} does not exists".format(groupIDs[-1]))
-            raise FuseOSError(errno.ENOENT)
+                self.__setProperties(handle.nodeId, size = buffer.size, mtime = buffer.mtime, ctime = buffer.mtime)
 
-        query = "MATCH (f:File{{name:'{fileId}'}}) SET f.value = '{value}' RETURN f".format(
-            fileId = groupIDs[-1]
-            , value = buf.decode('utf-8')
-            )
-        queryResults = self.graph.run(query)
+        self.__dropReadAhead(handle.nodeId)
+        self.__invalidate(handle.name, structural = False, nodeIds = [handle.nodeId], publish = written)
         
         return len(buf)
 
     def truncate(self, path, length, fh=None):
         
-        print("-------")
-        print("truncate {}".format(path))
-        print("\tfh {}".format(fh))
+        logger.debug("truncate %s (length %s, fh %s)", path, length, fh)
 
-        if not self.__verifyPath(path, lastElementMustExist = True):
-            print("The path [{}] is invalid".format(path))
-            raise FuseOSError(errno.ENOENT)
+        if fh:
+            handle = self.__handle(fh)
+            nodeId, name = handle.nodeId, handle.name
+        else:
+            resolved = self.__resolvePath(path)
+
+            if resolved.kind == PATH_MISSING:
+                logger.debug("The path [%s] is invalid", path)
+                raise FuseOSError(errno.ENOENT)
+                
+            if resolved.kind == PATH_ROOT:
+                logger.debug("Must specify a proper file name. The path [%s] is invalid", path)
+                raise FuseOSError(errno.ENOENT)
             
-        # Split the path in single elements.
-        # Each element is a group, apart the last one, which is the file name.
-        # First we normalize the path (so we have all '/' as delimiters),
-        # then we remove the eventual drive letter, as we don't need it.
-        groupIDs = self.__parsePathInGroups(path)
+            # Check if the last element exists already as a file
+            if resolved.kind != PATH_FILE:
+                logger.debug("The file %s does not exists", resolved.elementsIDs[-1])
+                raise FuseOSError(errno.ENOENT)
 
-        if groupIDs is None:
-            print("Must specify a proper file name. The path [{}] is invalid".format(path))
-            raise FuseOSError(errno.ENOENT)
+            nodeId, name = resolved.nodeId, resolved.elementsIDs[-1]
         
-        # Check if the last element exists already as a file
-        if not self.__isFile(groupIDs[-1]):
-            print("The file {} does not exists".format(groupIDs[-1]))
-            raise FuseOSError(errno.ENOENT)
-        
-        query = "MATCH (f:File{{name:'{fileId}'}}) SET f.value = NULL RETURN f".format(
-            fileId = groupIDs[-1]
-            )
-        queryResults = self.graph.run(query)
+        with self.__locked(nodeId):
+            buffer = self.writeBuffers.get(nodeId)
+            if buffer is not None:
+                buffer.truncate(length)
+            else:
+                self.content.truncate(nodeId, length)
+
+            now = time()
+            self.__setProperties(nodeId, size = length, mtime = now, ctime = now)
+
+        self.__dropReadAhead(nodeId)
+        self.__invalidate(name, structural = False, nodeIds = [nodeId], publish = buffer is None)
 
         return 0
     
     def flush(self, path, fh):
         # return os.fsync(fh)
-        print("-------")
-        print("flush {}".format(path))
-        print("\tfh {}".format(fh))
+        logger.debug("flush %s (fh %s)", path, fh)
+
+        handle = self.__handle(fh)
+        self.__flushBuffer(handle.nodeId, handle.name)
+
         return 0
         
     def release(self, path, fh):
         # return os.close(fh)
-        print("-------")
-        print("release {}".format(path))
-        print("\tfh {}".format(fh))
+        logger.debug("release %s (fh %s)", path, fh)
+
+        handle = self.handles.release(fh)
+
+        if handle is not None:
+            if handle.readAhead is not None:
+                handle.readAhead.clear()
+
+            if handle.accessed:
+                self.backend.run("setTimes", nodeId = handle.nodeId
+                    , atime = handle.properties["atime"], mtime = None, ctime = None)
+
+            # The buffer is shared by all the handles of the file,
+            # so it is dropped only when the last one is released
+            with self.__locked(handle.nodeId):
+                self.__flushBuffer(handle.nodeId, handle.name, release = not self.handles.forNode(handle.nodeId))
+
         return 0
 
     def fsync(self, path, fdatasync, fh):
         # return self.flush(path, fh)
-        print("-------")
-        print("fsync {}".format(path))
-        print("\tfdatasync {}".format(fdatasync))
-        print("\tfh {}".format(fh))
+        logger.debug("fsync %s (fdatasync %s, fh %s)", path, fdatasync, fh)
+
+        handle = self.__handle(fh)
+        self.__flushBuffer(handle.nodeId, handle.name)
+
         return 0
+
+    def destroy(self, path):
+        """
+        Called on filesystem exit: send all the pending writes to the graph.
+        """
+        for nodeId in list(self.writeBuffers):
+            self.__flushBuffer(nodeId, release = True)
+
+        if self.prefetcher is not None:
+            self.prefetcher.shutdown()
+
+        if self.changes is not None:
+            self.changes.stop()
+
+        if self.snapshotPath is not None:
+            self.__saveMembership()
+
+        self.backend.close()
         
 
+def reportOnSignal(stats, signum):
+    """
+    Write the report of the measures to stderr every time the process receives the signal,
+    which must be blocked in all the threads.
+    """
+    while True:
+        signal.sigwait({signum})
+        sys.stderr.write(stats.report())
+        sys.stderr.flush()
+
 if __name__ == '__main__':
     
-    filesystem = FUSE(GraphFSNeo4j(), 'Prova', nothreads=True, foreground=True, debug=False)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description = "Mount a GraphFS filesystem.")
+    parser.add_argument("mountpoint", nargs = "?", default = "Prova")
+    parser.add_argument("--backend", choices = BACKENDS, default = "neo4j"
+        , help = "Storage of the filesystem: a Neo4j graph, an ArangoDB database, or memory (lost on unmount)")
+    parser.add_argument("--password", default = os.environ.get("NEO4J_PASSWORD")
+        , help = "Password of the Neo4j user (default: $NEO4J_PASSWORD)")
+    parser.add_argument("--arango-url", default = "http://127.0.0.1:8529"
+        , help = "URL of the ArangoDB server; the password is read from $ARANGO_PASSWORD")
+    parser.add_argument("--arango-database", default = "graphfs"
+        , help = "ArangoDB database holding the filesystem, created if missing")
+    parser.add_argument("--arango-user", default = "root"
+        , help = "ArangoDB user")
+    parser.add_argument("--cache-size", type = int, default = DEFAULT_CACHE_SIZE
+        , help = "Maximum number of entries of the metadata caches")
+    parser.add_argument("--cache-ttl", type = float, default = DEFAULT_CACHE_TTL
+        , help = "Seconds a cached attribute or directory listing stays valid")
+    parser.add_argument("--write-back-bytes", type = int, default = DEFAULT_WRITE_BACK_THRESHOLD
+        , help = "Pending bytes of a file that trigger a flush to the graph (0 to write through)")
+    parser.add_argument("--schema", choices = SCHEMA_MODES, default = SCHEMA_CREATE
+        , help = "What to do when the indexes on the names are missing: create them, warn or refuse to mount")
+    parser.add_argument("--readdir-page-size", type = int, default = DEFAULT_READDIR_PAGE_SIZE
+        , help = "Directory entries fetched from the graph with a single query")
+    parser.add_argument("--stats", action = "store_true"
+        , help = "Measure the operations and the queries; SIGUSR1 dumps the measures to stderr")
+    parser.add_argument("--log-level", default = "WARNING"
+        , choices = ["DEBUG", "INFO", "WARNING", "ERROR"]
+        , help = "Level of the messages logged to stderr (DEBUG traces every operation)")
+    parser.add_argument("--threads", action = "store_true"
+        , help = "Serve the FUSE requests from many threads, so concurrent clients do not wait for each other")
+    parser.add_argument("--pool-size", type = int, default = DEFAULT_POOL_SIZE
+        , help = "Maximum number of connections to the graph used at the same time")
+    parser.add_argument("--content-cache-bytes", type = int, default = DEFAULT_CONTENT_CACHE_BYTES
+        , help = "Memory used to cache the content of the files (0 to disable)")
+    parser.add_argument("--read-ahead-chunks", type = int, default = DEFAULT_READ_AHEAD_CHUNKS
+        , help = "Maximum number of chunks fetched ahead of sequential reads (0 to disable)")
+    parser.add_argument("--prefetch-workers", type = int, default = DEFAULT_PREFETCH_WORKERS
+        , help = "Threads fetching content ahead of the reads")
+    parser.add_argument("--membership-index", action = "store_true"
+        , help = "Load the groups of all the files at mount, and compute the listings in memory")
+    parser.add_argument("--snapshot", metavar = "PATH"
+        , help = "File the membership index is saved to on unmount, and loaded from at the next mount"
+            " if the graph has not changed since (implies --membership-index)")
+    parser.add_argument("--change-feed", type = float, default = 0, metavar = "SECONDS"
+        , help = "Record the changes of this mount in the graph, and poll every SECONDS the changes"
+            " of the other mounts to invalidate the cached paths they affect, so that longer cache TTLs"
+            " can be used (0 to disable)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level = args.log_level, format = "%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    stats = None
+    if args.stats:
+        stats = Stats()
+        # Python runs the signal handlers in the main thread only, which stays in the loop of libfuse:
+        # SIGUSR1 is blocked in every thread started from now on (libfuse ones included)
+        # and received by a thread of its own
+        signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGUSR1})
+        threading.Thread(target = reportOnSignal, args = (stats, signal.SIGUSR1)
+            , name = "stats-report", daemon = True).start()
+
+    if args.backend == "memory":
+        from lib.backends.memory import MemoryBackend
+        backend = MemoryBackend(stats = stats)
+    elif args.backend == "arango":
+        from lib.backends.arango import ArangoBackend
+        backend = ArangoBackend(password = os.environ.get("ARANGO_PASSWORD")
+            , url = args.arango_url
+            , database = args.arango_database
+            , username = args.arango_user
+            , schemaMode = args.schema
+            , poolSize = args.pool_size
+            , stats = stats)
+    else:
+        from lib.backends.neo4j import Neo4jBackend
+        backend = Neo4jBackend(password = args.password
+            , schemaMode = args.schema
+            , poolSize = args.pool_size
+            , stats = stats)
+
+    filesystem = GraphFUSE(
+        GraphFSNeo4j(
+            backend
+            , cacheSize = args.cache_size
+            , cacheTTL = args.cache_ttl
+            , writeBackThreshold = args.write_back_bytes
+            , readdirPageSize = args.readdir_page_size
+            , readAheadChunks = args.read_ahead_chunks
+            , prefetchWorkers = args.prefetch_workers
+            , contentCacheBytes = args.content_cache_bytes
+            , membershipIndex = args.membership_index
+            , snapshotPath = args.snapshot
+            , changePollInterval = args.change_feed
+            , stats = stats)
+        , args.mountpoint
+        , nothreads=not args.threads, foreground=True, debug=False)
\ No newline at end of file
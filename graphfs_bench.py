@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import argparse
+import logging
+import math
+import random
+from time import perf_counter
+
+# ---------------------------------------------------------
+# Internal libraries
+
+from graphfs import GraphFSNeo4j, DEFAULT_CACHE_TTL
+from lib.backends import BACKENDS
+from lib.stats import Stats, formatSeconds
+from lib.importer import BulkImporter, ImportRecord
+
+# ---------------------------------------------------------
+# Benchmark of the GraphFS operations.
+#
+# A synthetic graph is generated from a seed, then the FUSE operations are
+# called directly on GraphFSNeo4j (no mount needed) and measured:
+#
+#   graphfs_bench.py --files 10000 --groups 100 --tags-per-file 3 --depth 2
+#
+# Every benchmark runs the same sequence of operations for the same arguments.
+# With --backend memory the graph is held in memory, so the benchmark runs
+# anywhere; with --backend neo4j or arango it is written to the local instance.
+# Repeating --backend runs the same benchmarks on each backend, to compare them:
+#
+#   graphfs_bench.py --backend neo4j --backend arango
+
+BENCHMARKS = ["getattr", "readdir", "read", "write", "rename"]
+
+DEFAULT_FILES = 10000
+DEFAULT_GROUPS = 100
+DEFAULT_TAGS_PER_FILE = 3
+DEFAULT_DEPTH = 2
+DEFAULT_FILE_SIZE = 64 * 1024
+DEFAULT_OPS = 1000
+DEFAULT_CONTENT_FILES = 100 # Files with content, read and written by the benchmarks
+
+def generateRecords(rng, prefix, files, groups, tagsPerFile):
+    """
+    Return the import records of the synthetic graph: every file belongs to
+    tagsPerFile groups chosen at random.
+    """
+    groupIDs = ["{}-g{}".format(prefix, i) for i in range(groups)]
+
+    return [
+        ImportRecord("{}-f{}".format(prefix, i), rng.sample(groupIDs, tagsPerFile), None)
+        for i in range(files)
+    ]
+
+def syntheticNodes(backend, prefix, pageSize = 1000):
+    """
+    Return the node ids of the groups and of the files whose names start with the prefix
+    of the synthetic graph, as (groupIds, fileIds).
+    """
+    start = prefix + "-"
+    nodeIds = {}
+
+    for queryName in ["readdirRootGroups", "readdirRootFiles"]:
+        ids = nodeIds[queryName] = []
+        lastName = start
+        while True:
+            page = backend.data(queryName, lastName = lastName, limit = pageSize)
+            ids.extend(entry["nodeId"] for entry in page if entry["name"].startswith(start))
+
+            # Names are ordered: the synthetic ones are over at the first other name
+            if len(page) < pageSize or not page[-1]["name"].startswith(start):
+                break
+            lastName = page[-1]["name"]
+
+    return nodeIds["readdirRootGroups"], nodeIds["readdirRootFiles"]
+
+def deleteSynthetic(backend, prefix):
+    """
+    Delete the groups and the files of the synthetic graph (with their content),
+    so that the next run measures the same graph. Returns the number of nodes deleted.
+    """
+    groupIds, fileIds = syntheticNodes(backend, prefix)
+
+    # The files first, so that the groups are left without members
+    with backend.transaction() as tx:
+        for nodeId in fileIds:
+            tx.run("deleteFile", nodeId = nodeId)
+        for nodeId in groupIds:
+            tx.run("deleteGroup", nodeId = nodeId)
+
+    return len(groupIds) + len(fileIds)
+
+def percentile(samples, fraction):
+    """
+    Return the sample below which the given fraction of the sorted samples falls (nearest rank).
+    """
+    rank = max(1, math.ceil(len(samples) * fraction))
+    return samples[rank - 1]
+
+def filePath(rng, record, depth, name = None):
+    """
+    Return a path to the file made of depth of its groups, in random order.
+    """
+    return "/" + "/".join(rng.sample(record.groupIDs, depth) + [name or record.name])
+
+class Benchmark(object):
+    """
+    Run the benchmarks on a GraphFSNeo4j holding the synthetic graph.
+    Each benchmark runs ops operations; an operation is a sequence of FUSE calls
+    (e.g. open, read, release), measured as a whole.
+    """
+
+    def __init__(self, fs, stats, records, rng, depth, fileSize, contentFiles):
+        self.fs = fs
+        self.stats = stats
+        self.records = records
+        self.rng = rng
+        self.depth = depth
+        self.fileSize = fileSize
+        # Current name of the renamed files
+        self.names = {}
+
+        # Current path of the files with content (rename changes them)
+        self.contentPaths = [
+            filePath(rng, record, depth) for record in rng.sample(records, min(contentFiles, len(records)))
+        ]
+        self.data = bytes(rng.getrandbits(8) for _ in range(fileSize))
+
+        for path in self.contentPaths:
+            self.__write(path)
+
+    def __write(self, path):
+        fh = self.fs("open", path, os.O_WRONLY)
+        try:
+            self.fs("write", path, self.data, 0, fh)
+        finally:
+            self.fs("release", path, fh)
+
+    # Operations
+    # ==========
+
+    def getattr(self):
+        record = self.rng.choice(self.records)
+        self.fs("getattr", filePath(self.rng, record, self.depth, self.names.get(record.name)))
+
+    def readdir(self):
+        record = self.rng.choice(self.records)
+        path = "/" + "/".join(self.rng.sample(record.groupIDs, self.rng.randint(1, self.depth)))
+
+        fh = self.fs("opendir", path)
+        try:
+            for _ in self.fs("readdir", path, fh):
+                pass
+        finally:
+            self.fs("releasedir", path, fh)
+
+    def read(self):
+        path = self.rng.choice(self.contentPaths)
+
+        fh = self.fs("open", path, os.O_RDONLY)
+        try:
+            self.fs("read", path, self.fileSize, 0, fh)
+        finally:
+            self.fs("release", path, fh)
+
+    def write(self):
+        self.__write(self.rng.choice(self.contentPaths))
+
+    def rename(self):
+        index = self.rng.randrange(len(self.contentPaths))
+        old = self.contentPaths[index]
+
+        # Rename the file in the same directory, alternating between two names
+        directory, oldName = old.rsplit("/", 1)
+        originalName = oldName[:-len(".renamed")] if oldName.endswith(".renamed") else oldName
+        newName = originalName + ".renamed" if oldName == originalName else originalName
+        new = directory + "/" + newName
+
+        self.fs("rename", old, new)
+        self.contentPaths[index] = new
+        self.names[originalName] = newName
+
+    # Measures
+    # ========
+
+    def run(self, name, ops):
+        """
+        Run ops operations of the benchmark and return
+        (ops per second, sorted latencies of the operations, round trips per operation).
+        The latencies are kept one by one, for exact percentiles.
+        """
+        operation = getattr(self, name)
+        latencies = []
+        self.stats.reset()
+
+        start = perf_counter()
+        for _ in range(ops):
+            operationStart = perf_counter()
+            operation()
+            latencies.append(perf_counter() - operationStart)
+        seconds = perf_counter() - start
+
+        roundTrips = sum(measures.roundTrips for measures in self.stats.operations.values())
+
+        return ops / seconds, sorted(latencies), roundTrips / ops
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = "Benchmark the GraphFS operations on a synthetic graph.")
+    parser.add_argument("benchmarks", nargs = "*"
+        , help = "Benchmarks to run, among {} (default: all)".format(", ".join(BENCHMARKS)))
+    parser.add_argument("--backend", choices = BACKENDS, action = "append"
+        , help = "Graph the benchmark runs on: memory (default), or the local Neo4j or ArangoDB instance,"
+            " which is written to. Repeat to compare backends")
+    parser.add_argument("--password", default = os.environ.get("NEO4J_PASSWORD")
+        , help = "Password of the Neo4j user (default: $NEO4J_PASSWORD)")
+    parser.add_argument("--arango-url", default = "http://127.0.0.1:8529"
+        , help = "URL of the ArangoDB server; the password is read from $ARANGO_PASSWORD")
+    parser.add_argument("--arango-database", default = "graphfs"
+        , help = "ArangoDB database the synthetic graph is written to")
+    parser.add_argument("--files", type = int, default = DEFAULT_FILES
+        , help = "Files of the synthetic graph")
+    parser.add_argument("--groups", type = int, default = DEFAULT_GROUPS
+        , help = "Groups of the synthetic graph")
+    parser.add_argument("--tags-per-file", type = int, default = DEFAULT_TAGS_PER_FILE
+        , help = "Groups each file belongs to")
+    parser.add_argument("--depth", type = int, default = DEFAULT_DEPTH
+        , help = "Groups in the paths used to reach the files")
+    parser.add_argument("--file-size", type = int, default = DEFAULT_FILE_SIZE
+        , help = "Bytes read and written by the read and write benchmarks")
+    parser.add_argument("--content-files", type = int, default = DEFAULT_CONTENT_FILES
+        , help = "Files read, written and renamed by the benchmarks")
+    parser.add_argument("--ops", type = int, default = DEFAULT_OPS
+        , help = "Operations run by each benchmark")
+    parser.add_argument("--seed", type = int, default = 0
+        , help = "Seed of the synthetic graph and of the operations")
+    parser.add_argument("--prefix", default = "bench"
+        , help = "Prefix of the names of the groups and files created")
+    parser.add_argument("--cache-ttl", type = float, default = DEFAULT_CACHE_TTL
+        , help = "Seconds a cached attribute or directory listing stays valid")
+    parser.add_argument("--membership-index", action = "store_true"
+        , help = "Compute the listings with the in-memory membership index")
+    args = parser.parse_args()
+
+    logging.basicConfig(level = logging.WARNING, format = "%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    if not 1 <= args.depth <= args.tags_per_file <= args.groups:
+        parser.error("Expected 1 <= depth <= tags per file <= groups.")
+
+    if args.files < 1 or args.ops < 1 or args.content_files < 1:
+        parser.error("Expected at least a file, a content file and an operation.")
+
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error("Unknown benchmark [{}].".format(name))
+
+    for backendName in args.backend or ["memory"]:
+        # Every backend gets the same graph and the same operations
+        rng = random.Random(args.seed)
+        stats = Stats()
+
+        if backendName == "memory":
+            from lib.backends.memory import MemoryBackend
+            backend = MemoryBackend(stats = stats)
+        elif backendName == "arango":
+            from lib.backends.arango import ArangoBackend
+            logging.warning("Writing the synthetic graph to ArangoDB, with names starting with [%s]", args.prefix)
+            backend = ArangoBackend(password = os.environ.get("ARANGO_PASSWORD")
+                , url = args.arango_url, database = args.arango_database, stats = stats)
+        else:
+            from lib.backends.neo4j import Neo4jBackend
+            logging.warning("Writing the synthetic graph to Neo4j, with names starting with [%s]", args.prefix)
+            backend = Neo4jBackend(password = args.password, stats = stats)
+
+        # Nodes left by an interrupted run would change the workload measured
+        if any(syntheticNodes(backend, args.prefix)):
+            backend.close()
+            parser.error("The {} graph already holds groups or files starting with [{}-]: "
+                "delete them or choose another --prefix.".format(backendName, args.prefix))
+
+        records = generateRecords(rng, args.prefix, args.files, args.groups, args.tags_per_file)
+
+        fs = None
+        try:
+            setupStart = perf_counter()
+            BulkImporter(backend, reportInterval = float("inf")).run(records)
+            # The membership index is loaded at mount, so the graph is imported first
+            fs = GraphFSNeo4j(backend, cacheTTL = args.cache_ttl, membershipIndex = args.membership_index, stats = stats)
+            benchmark = Benchmark(fs, stats, records, rng, args.depth, args.file_size, args.content_files)
+            sys.stdout.write("{}: setup {} files {} groups in {}\n".format(
+                backendName, args.files, args.groups, formatSeconds(perf_counter() - setupStart)))
+
+            sys.stdout.write("{:<10} {:>10} {:>10} {:>10} {:>12}\n".format("benchmark", "ops/s", "p50", "p99", "round trips"))
+            for name in args.benchmarks or BENCHMARKS:
+                    opsPerSecond, latencies, roundTrips = benchmark.run(name, args.ops)
+                    sys.stdout.write("{:<10} {:>10.0f} {:>10} {:>10} {:>12.2f}\n".format(
+                        name
+                        , opsPerSecond
+                        , formatSeconds(percentile(latencies, 0.5))
+                        , formatSeconds(percentile(latencies, 0.99))
+                        , roundTrips))
+        finally:
+            # Every operation releases its files, so no write is pending when the graph is cleaned
+            deleted = deleteSynthetic(backend, args.prefix)
+            logging.info("Deleted the %s groups and files of the synthetic graph", deleted)
+            if fs is not None:
+                fs.destroy("/")
+            else:
+                backend.close()
+
+        sys.stdout.write("\n")
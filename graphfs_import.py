@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import argparse
+import logging
+
+# ---------------------------------------------------------
+# Internal libraries
+
+from lib.backends.neo4j import Neo4jBackend
+from lib.schema import SCHEMA_CREATE, SCHEMA_MODES
+from lib.importer import BulkImporter, BulkImportError, walkDirectory, readManifest
+from lib.importer import DEFAULT_BATCH_SIZE, DEFAULT_BATCH_BYTES, DEFAULT_WORKERS
+
+# ---------------------------------------------------------
+# Import a host directory or a manifest of files and groups into GraphFS,
+# without going through FUSE.
+#
+#   graphfs_import.py /data/photos --content
+#   graphfs_import.py --manifest files.tsv
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = "Bulk import files and groups into a GraphFS graph.")
+    parser.add_argument("source", nargs = "?"
+        , help = "Host directory to import: the folders of the path of each file become its groups")
+    parser.add_argument("--manifest"
+        , help = "Tab-separated file listing a file name and its groups per line ('-' for stdin)")
+    parser.add_argument("--content", action = "store_true"
+        , help = "Import the content of the files of the host directory, not only their names")
+    parser.add_argument("--batch-size", type = int, default = DEFAULT_BATCH_SIZE
+        , help = "Files written with a single transaction")
+    parser.add_argument("--batch-bytes", type = int, default = DEFAULT_BATCH_BYTES
+        , help = "Content written with a single transaction")
+    parser.add_argument("--workers", type = int, default = DEFAULT_WORKERS
+        , help = "Parallel transactions")
+    parser.add_argument("--password", default = os.environ.get("NEO4J_PASSWORD")
+        , help = "Password of the Neo4j user (default: $NEO4J_PASSWORD)")
+    parser.add_argument("--schema", choices = SCHEMA_MODES, default = SCHEMA_CREATE
+        , help = "What to do when the indexes on the names are missing: create them, warn or refuse to import")
+    args = parser.parse_args()
+
+    logging.basicConfig(level = logging.INFO, format = "%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    if (args.source is None) == (args.manifest is None):
+        parser.error("Give either a directory or a manifest to import.")
+
+    if args.source is not None and not os.path.isdir(args.source):
+        parser.error("[{}] is not a directory.".format(args.source))
+
+    # MERGE on names without the uniqueness constraints would scan all the nodes for every file.
+    # Each worker checks out its own connection.
+    importer = BulkImporter(
+        Neo4jBackend(password = args.password, schemaMode = args.schema, poolSize = args.workers)
+        , batchSize = args.batch_size
+        , batchBytes = args.batch_bytes
+        , workers = args.workers
+        , withContent = args.content)
+
+    try:
+        if args.manifest is None:
+            importer.run(walkDirectory(args.source))
+        elif args.manifest == "-":
+            importer.run(readManifest(sys.stdin))
+        else:
+            with open(args.manifest) as manifest:
+                importer.run(readManifest(manifest))
+    except BulkImportError as e:
+        logging.error(e)
+        sys.exit(1)
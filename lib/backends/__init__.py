@@ -0,0 +1,11 @@
+from lib.backends.base import Backend, OPERATIONS
+
+# ---------------------------------------------------------
+# Storage backends of GraphFS.
+#
+# The FUSE operations never talk to a database directly: they run named
+# operations on a Backend (see lib.backends.base). Each backend lives in its
+# own module, imported only when used, so that the client library of one
+# database is not needed to run another.
+
+BACKENDS = ["neo4j", "arango", "memory"]
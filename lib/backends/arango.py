@@ -0,0 +1,525 @@
+import base64
+import logging
+import re
+from contextlib import contextmanager, nullcontext
+
+from pyArango.connection import Connection
+
+from lib.backends.base import Backend
+from lib.schema import SchemaError, SCHEMA_CREATE, SCHEMA_REFUSE, SCHEMA_MODES
+from lib.pool import ConnectionPool, DEFAULT_POOL_SIZE
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------------
+# ArangoDB backend: the operations are AQL queries run through pyArango.
+#
+# The graph is stored in three collections:
+#
+#   nodes:     groups and files, {kind: "Group" | "File", name, size, atime, mtime, ctime}
+#              and a single {kind: "GraphFS"} node with the format of the content
+#   isInGroup: edges from a file to each of its groups
+#   chunks:    content of the files, {file: node id, index, data (base64)}
+#   changes:   log of the changes made by the mounts, {seq, mount, names, nodeIds, structural, time}
+#
+# Names are unique per kind, so nodes has a unique persistent index on (kind, name),
+# and every lookup by name is an index lookup. The id of a node is its numeric _key.
+#
+# An operation is one AQL query when it modifies a single collection.
+# AQL cannot modify a collection twice in a query, so the operations changing
+# more collections (e.g. deleteFile) are a list of queries, sent in a single
+# round trip and run atomically by a server-side transaction.
+
+DEFAULT_ARANGO_URL = "http://127.0.0.1:8529"
+DEFAULT_ARANGO_DATABASE = "graphfs"
+
+# Results fetched with each round trip of a cursor (a full readdir page)
+CURSOR_BATCH_SIZE = 1000
+
+COLLECTIONS = ["nodes", "isInGroup", "chunks", "changes"]
+EDGE_COLLECTIONS = ["isInGroup"]
+
+# Unique persistent indexes: (collection, fields)
+INDEXES = [
+    ("nodes", ["kind", "name"])
+    , ("isInGroup", ["_from", "_to"])
+    , ("chunks", ["file", "index"])
+    , ("changes", ["seq"])
+]
+
+# Lists the indexes of the collections (null for a missing collection)
+INDEXES_ACTION = """function (params) {
+    var db = require("@arangodb").db;
+    return params.collections.map(function (name) {
+        var collection = db._collection(name);
+        return collection === null ? null : collection.getIndexes();
+    });
+}"""
+
+# Runs the queries of an operation, or of a transaction block, returning the results of the last one
+TRANSACTION_ACTION = """function (params) {
+    var db = require("@arangodb").db;
+    var result = [];
+    params.statements.forEach(function (statement) {
+        result = db._query(statement.query, statement.bindVars).toArray();
+    });
+    return result;
+}"""
+
+# Last tick of the write-ahead log of the server, which changes with every write
+GRAPH_VERSION_ACTION = """function () {
+    return [{version: require("@arangodb/replication").logger.state().state.lastLogTick}];
+}"""
+
+# Operations that are not queries but server-side actions, run in a read transaction
+ACTIONS = dict(graphVersion = GRAPH_VERSION_ACTION)
+
+# Bind parameters referenced by a query (@@ are collection parameters, not used here)
+BIND_PARAMETER = re.compile(r"(?<!@)@(\w+)")
+
+# Fragments shared by the queries
+FILE_BY_ID = 'FOR f IN nodes FILTER f._key == TO_STRING(@nodeId) AND f.kind == "File"'
+GROUP_PROPERTIES = "{mtime: g.mtime, ctime: g.ctime}"
+FILE_PROPERTIES = "{size: f.size, atime: f.atime, mtime: f.mtime, ctime: f.ctime}"
+
+def linkQuery(nodeIdParameter, groupIDsParameter):
+    """
+    Query adding the file to the groups, without duplicating the existing edges.
+    """
+    return """FOR f IN nodes FILTER f._key == TO_STRING(@{0}) AND f.kind == "File"
+        FOR g IN nodes FILTER g.kind == "Group" AND g.name IN @{1}
+            COLLECT fromId = f._id, toId = g._id
+            UPSERT {{_from: fromId, _to: toId}} INSERT {{_from: fromId, _to: toId}} UPDATE {{}} IN isInGroup""".format(
+        nodeIdParameter, groupIDsParameter)
+
+def chunkRowsQuery(condition):
+    """
+    Query returning the size of the file and the chunks matching condition,
+    as a single row with null index and data if no chunk matches.
+    """
+    return FILE_BY_ID + """
+        LET rows = (FOR c IN chunks FILTER c.file == @nodeId AND """ + condition + """
+            RETURN {index: c.index, data: c.data})
+        FOR row IN (LENGTH(rows) > 0 ? rows : [{index: null, data: null}])
+            RETURN {size: NOT_NULL(f.size, 0), index: row.index, data: row.data}"""
+
+UPSERT_CHUNKS = FILE_BY_ID + """
+    FOR chunk IN @chunks
+        UPSERT {file: @nodeId, index: chunk.index}
+        INSERT {file: @nodeId, index: chunk.index, data: chunk.data}
+        UPDATE {data: chunk.data} IN chunks"""
+
+# The operations of lib.backends.base, with the parameters and results
+# of the Cypher templates of lib.queries (which document them)
+TEMPLATES = dict(
+
+    # Paths
+    # =====
+
+    resolvePath = """LET foundGroups = LENGTH(FOR n IN nodes FILTER n.kind == "Group" AND n.name IN @groupIDs RETURN 1)
+        LET g = FIRST(FOR n IN nodes FILTER n.kind == "Group" AND n.name == @lastId RETURN n)
+        LET f = FIRST(FOR n IN nodes FILTER n.kind == "File" AND n.name == @lastId RETURN n)
+        RETURN {
+            foundGroups: foundGroups
+            , groupNodeId: g == null ? null : TO_NUMBER(g._key)
+            , groupProperties: g == null ? null : """ + GROUP_PROPERTIES + """
+            , fileNodeId: f == null ? null : TO_NUMBER(f._key)
+            , fileProperties: f == null ? null : """ + FILE_PROPERTIES + """
+        }"""
+
+    , setTimes = """FOR n IN nodes FILTER n._key == TO_STRING(@nodeId)
+        UPDATE n WITH {atime: NOT_NULL(@atime, n.atime), mtime: NOT_NULL(@mtime, n.mtime), ctime: NOT_NULL(@ctime, n.ctime)} IN nodes"""
+
+    # Groups
+    # ======
+
+    , createGroup = """INSERT {kind: "Group", name: @groupId, mtime: @now, ctime: @now} INTO nodes
+        RETURN {id: TO_NUMBER(NEW._key)}"""
+
+    , countGroupFiles = """FOR g IN nodes FILTER g._key == TO_STRING(@nodeId) AND g.kind == "Group"
+        RETURN {count: LENGTH(FOR e IN isInGroup FILTER e._to == g._id RETURN 1)}"""
+
+    , deleteGroup = 'FOR g IN nodes FILTER g._key == TO_STRING(@nodeId) AND g.kind == "Group" REMOVE g IN nodes'
+
+    , renameGroup = """FOR g IN nodes FILTER g._key == TO_STRING(@nodeId) AND g.kind == "Group"
+        UPDATE g WITH {name: @newGroupId, ctime: @now} IN nodes"""
+
+    # Files
+    # =====
+
+    , createFile = """INSERT {kind: "File", name: @fileId, size: 0, atime: @now, mtime: @now, ctime: @now} INTO nodes
+        RETURN {id: TO_NUMBER(NEW._key)}"""
+
+    , linkFile = linkQuery("nodeId", "groupIDs")
+
+    , moveFile = [
+        FILE_BY_ID + " UPDATE f WITH {name: NOT_NULL(@newFileId, f.name), ctime: @now} IN nodes"
+        , """FOR e IN isInGroup FILTER e._from == CONCAT("nodes/", @nodeId)
+            FILTER DOCUMENT(e._to).name IN @oldGroupIDs
+            REMOVE e IN isInGroup"""
+        , linkQuery("nodeId", "newGroupIDs")
+    ]
+
+    # The chunks of the first file are given to the second one, not copied
+    , replaceFile = [
+        "FOR c IN chunks FILTER c.file == @toNodeId REMOVE c IN chunks"
+        , """LET old = DOCUMENT(CONCAT("nodes/", @fromNodeId))
+            FOR f IN nodes FILTER f._key == TO_STRING(@toNodeId) AND f.kind == "File" AND old != null
+            UPDATE f WITH {size: NOT_NULL(old.size, 0), mtime: old.mtime, ctime: @now} IN nodes"""
+        , "FOR c IN chunks FILTER c.file == @fromNodeId UPDATE c WITH {file: @toNodeId} IN chunks"
+        , 'FOR e IN isInGroup FILTER e._from == CONCAT("nodes/", @fromNodeId) REMOVE e IN isInGroup'
+        , 'FOR f IN nodes FILTER f._key == TO_STRING(@fromNodeId) AND f.kind == "File" REMOVE f IN nodes'
+        , linkQuery("toNodeId", "groupIDs")
+    ]
+
+    , deleteFile = [
+        "FOR c IN chunks FILTER c.file == @nodeId REMOVE c IN chunks"
+        , 'FOR e IN isInGroup FILTER e._from == CONCAT("nodes/", @nodeId) REMOVE e IN isInGroup'
+        , FILE_BY_ID + " REMOVE f IN nodes"
+    ]
+
+    # Directory listings
+    # ==================
+
+    , readdirRootGroups = """FOR g IN nodes FILTER g.kind == "Group" AND g.name > @lastName
+        SORT g.name
+        LIMIT @limit
+        RETURN {name: g.name, kind: "group", rank: 0, nodeId: TO_NUMBER(g._key), properties: """ + GROUP_PROPERTIES + "}"
+
+    , readdirRootFiles = """FOR f IN nodes FILTER f.kind == "File" AND f.name > @lastName
+        SORT f.name
+        LIMIT @limit
+        RETURN {name: f.name, kind: "file", rank: 1, nodeId: TO_NUMBER(f._key), properties: """ + FILE_PROPERTIES + "}"
+
+    # Keys of the entries of a directory, whose metadata is then read a page at a time.
+    # The intersection starts from the group with the fewest files,
+    # and every candidate file is checked against the edges to the remaining groups
+    , readdirKeys = """LET groups = (
+            FOR g IN nodes FILTER g.kind == "Group" AND g.name IN @groupIDs
+                LET size = LENGTH(FOR e IN isInGroup FILTER e._to == g._id RETURN 1)
+                SORT size
+                RETURN g._id)
+        LET others = SLICE(groups, 1)
+        LET files = (
+            FOR e IN isInGroup FILTER e._to == FIRST(groups)
+                FILTER LENGTH(FOR o IN isInGroup FILTER o._from == e._from AND o._to IN others RETURN 1) == LENGTH(others)
+                RETURN DOCUMENT(e._from))
+        LET newGroups = (
+            FOR f IN files
+                FOR e IN isInGroup FILTER e._from == f._id AND e._to NOT IN groups
+                    COLLECT groupId = e._to
+                    RETURN DOCUMENT(groupId))
+        FOR entry IN APPEND(
+                (FOR g IN newGroups RETURN {rank: 0, name: g.name, nodeId: TO_NUMBER(g._key)})
+                , (FOR f IN files RETURN {rank: 1, name: f.name, nodeId: TO_NUMBER(f._key)}))
+            RETURN entry"""
+
+    # Metadata of a page of entries (missing nodes are skipped)
+    , nodeProperties = """FOR nodeId IN @nodeIds
+        LET f = DOCUMENT(CONCAT("nodes/", nodeId))
+        FILTER f != null
+        RETURN {nodeId: nodeId, properties: """ + FILE_PROPERTIES + "}"
+
+    # Content
+    # =======
+
+    , readRange = chunkRowsQuery("c.index >= @firstChunk AND c.index <= @lastChunk")
+
+    , readChunks = chunkRowsQuery("c.index IN @indexes")
+
+    , writeChunks = [
+        FILE_BY_ID + " UPDATE f WITH {size: MAX([NOT_NULL(f.size, 0), @end]), mtime: @mtime, ctime: @mtime} IN nodes"
+        , UPSERT_CHUNKS
+    ]
+
+    , truncateContent = [
+        FILE_BY_ID + " UPDATE f WITH {size: @length, mtime: @mtime, ctime: @mtime} IN nodes"
+        , "FOR c IN chunks FILTER c.file == @nodeId AND c.index >= @firstDroppedChunk REMOVE c IN chunks"
+        , """FOR chunk IN @chunks
+            FOR c IN chunks FILTER c.file == @nodeId AND c.index == chunk.index
+                UPDATE c WITH {data: chunk.data} IN chunks"""
+    ]
+
+    # firstDroppedChunk is null when the file was not truncated (null compares lower than any number)
+    , flushContent = [
+        FILE_BY_ID + " UPDATE f WITH {size: @size, mtime: @mtime, ctime: @mtime} IN nodes"
+        , """FOR c IN chunks FILTER @firstDroppedChunk != null AND c.file == @nodeId AND c.index >= @firstDroppedChunk
+            REMOVE c IN chunks"""
+        , UPSERT_CHUNKS
+    ]
+
+    , replaceContent = [
+        "FOR c IN chunks FILTER c.file == @nodeId REMOVE c IN chunks"
+        , FILE_BY_ID + " UPDATE f WITH {size: @size, value: null} IN nodes OPTIONS {keepNull: false}"
+        , FILE_BY_ID + """
+            FOR chunk IN @chunks
+                INSERT {file: @nodeId, index: chunk.index, data: chunk.data} INTO chunks"""
+    ]
+
+    , legacyFiles = 'FOR f IN nodes FILTER f.kind == "File" AND HAS(f, "value") RETURN {nodeId: TO_NUMBER(f._key), value: f.value}'
+
+    # Format of the content, recorded on a node of its own kind once the legacy files are migrated
+    , contentFormat = """RETURN {format: FIRST(
+        FOR m IN nodes FILTER m.kind == "GraphFS" AND m.name == "graphfs" RETURN m.contentFormat)}"""
+
+    , setContentFormat = """UPSERT {kind: "GraphFS", name: "graphfs"}
+        INSERT {kind: "GraphFS", name: "graphfs", contentFormat: @format}
+        UPDATE {contentFormat: @format} IN nodes"""
+
+    # Bulk import
+    # ===========
+
+    , importGroups = """FOR groupId IN UNIQUE(@groupIDs)
+        UPSERT {kind: "Group", name: groupId}
+        INSERT {kind: "Group", name: groupId, mtime: @now, ctime: @now}
+        UPDATE {} IN nodes"""
+
+    , importFiles = [
+        """FOR file IN @files
+            COLLECT name = file.name AGGREGATE mtime = MIN(file.mtime)
+            UPSERT {kind: "File", name: name}
+            INSERT {kind: "File", name: name, size: 0, atime: mtime, mtime: mtime, ctime: @now}
+            UPDATE {} IN nodes"""
+        , """FOR file IN @files
+            FOR f IN nodes FILTER f.kind == "File" AND f.name == file.name
+                FOR g IN nodes FILTER g.kind == "Group" AND g.name IN file.groupIDs
+                    COLLECT fromId = f._id, toId = g._id
+                    UPSERT {_from: fromId, _to: toId} INSERT {_from: fromId, _to: toId} UPDATE {} IN isInGroup"""
+    ]
+
+    , importContent = [
+        """FOR content IN @contents
+            FOR f IN nodes FILTER f.kind == "File" AND f.name == content.name
+                UPDATE f WITH {size: content.size, mtime: content.mtime} IN nodes"""
+        , """FOR content IN @contents
+            FOR f IN nodes FILTER f.kind == "File" AND f.name == content.name
+                FOR c IN chunks FILTER c.file == TO_NUMBER(f._key)
+                    REMOVE c IN chunks"""
+        , """FOR content IN @contents
+            FOR f IN nodes FILTER f.kind == "File" AND f.name == content.name
+                FOR chunk IN content.chunks
+                    INSERT {file: TO_NUMBER(f._key), index: chunk.index, data: chunk.data} INTO chunks"""
+    ]
+
+    # Membership index
+    # ================
+
+    , membershipGroups = 'FOR g IN nodes FILTER g.kind == "Group" RETURN {nodeId: TO_NUMBER(g._key), name: g.name}'
+
+    , membershipFiles = """FOR f IN nodes FILTER f.kind == "File"
+        RETURN {
+            nodeId: TO_NUMBER(f._key)
+            , name: f.name
+            , groupNodeIds: (FOR e IN isInGroup FILTER e._from == f._id RETURN TO_NUMBER(PARSE_IDENTIFIER(e._to).key))
+        }"""
+
+    # Change log
+    # ==========
+
+    # The exclusive lock on the collection is held until the commit,
+    # so the changes are numbered without gaps and committed in order
+    , recordChange = """LET last = FIRST(FOR c IN changes SORT c.seq DESC LIMIT 1 RETURN c.seq)
+        INSERT {seq: (last || 0) + 1, mount: @mount, names: @names, nodeIds: @nodeIds
+            , structural: @structural, update: @update, time: @now} INTO changes OPTIONS {exclusive: true}"""
+
+    , changesSince = """FOR c IN changes FILTER c.seq > @after SORT c.seq LIMIT @limit
+        RETURN {seq: c.seq, mount: c.mount, names: c.names, nodeIds: c.nodeIds, structural: c.structural
+            , update: c.update}"""
+
+    , lastChange = "RETURN {seq: FIRST(FOR c IN changes SORT c.seq DESC LIMIT 1 RETURN c.seq) || 0}"
+
+    # The last change is always kept, so that a mount which missed the pruned ones notices the gap
+    , pruneChanges = """LET last = FIRST(FOR c IN changes SORT c.seq DESC LIMIT 1 RETURN c.seq)
+        FOR c IN changes FILTER c.time < @before AND c.seq < last
+            REMOVE c IN changes"""
+)
+
+# ---------------------------------------------------------
+# Content encoding: AQL values are JSON, so the chunks travel as base64 strings
+
+def encodeChunks(chunks):
+    return [dict(chunk, data = base64.b64encode(chunk["data"]).decode("ascii")) for chunk in chunks]
+
+def encodeParameters(parameters):
+    if "chunks" in parameters:
+        parameters = dict(parameters, chunks = encodeChunks(parameters["chunks"]))
+    if "contents" in parameters:
+        parameters = dict(parameters, contents = [
+            dict(content, chunks = encodeChunks(content["chunks"])) for content in parameters["contents"]])
+    return parameters
+
+def decodeRecords(records):
+    for record in records:
+        if isinstance(record.get("data"), str):
+            record["data"] = base64.b64decode(record["data"])
+    return records
+
+def statements(name, parameters):
+    """
+    Return the queries of an operation, with their bind parameters,
+    as sent to the server: [{query, bindVars}] (none for ACTIONS).
+    """
+    if name in ACTIONS:
+        return []
+
+    try:
+        queries = TEMPLATES[name]
+    except KeyError:
+        raise ValueError("Unknown query [{}].".format(name))
+
+    if isinstance(queries, str):
+        queries = [queries]
+
+    parameters = encodeParameters(parameters)
+    return [
+        dict(query = query, bindVars = dict(
+            (key, parameters[key]) for key in set(BIND_PARAMETER.findall(query))))
+        for query in queries
+    ]
+
+class ArangoTransaction(object):
+    """
+    Operations of a transaction block, sent together when the block ends.
+    As nothing is sent before, only run() is available.
+    """
+
+    def __init__(self):
+        self.statements = []
+
+    def run(self, name, **parameters):
+        self.statements.extend(statements(name, parameters))
+
+class ArangoBackend(Backend):
+    """
+    Run the operations on an ArangoDB database.
+    Each operation checks out a connection from a bounded pool,
+    so that the threads of a multithreaded mount do not wait for each other.
+    """
+
+    name = "arango"
+
+    def __init__(self, password
+        , url = DEFAULT_ARANGO_URL
+        , database = DEFAULT_ARANGO_DATABASE
+        , username = "root"
+        , schemaMode = SCHEMA_CREATE
+        , poolSize = DEFAULT_POOL_SIZE
+        , stats = None):
+
+        if schemaMode not in SCHEMA_MODES:
+            raise ValueError("Unknown schema mode [{}].".format(schemaMode))
+
+        self.stats = stats
+
+        connection = Connection(arangoURL = url, username = username, password = password)
+        if not connection.hasDatabase(database):
+            if schemaMode == SCHEMA_REFUSE:
+                raise SchemaError("The database [{}] does not exist.".format(database))
+            connection.createDatabase(name = database)
+
+        self.database = connection[database]
+        self.ensureSchema(schemaMode)
+
+        self.pool = ConnectionPool(
+            lambda: Connection(arangoURL = url, username = username, password = password, pool_maxsize = 1)[database]
+            , poolSize)
+
+    # Schema
+    # ======
+
+    def verifySchema(self):
+        """
+        Return the list of problems found as tuples (collection, fields, problem).
+        """
+        collections = [collection for collection, fields in INDEXES]
+        result = self.database.transaction(
+            collections = dict(read = []), action = INDEXES_ACTION, params = dict(collections = collections))["result"]
+
+        problems = []
+        for (collection, fields), indexes in zip(INDEXES, result):
+            if indexes is None:
+                problems.append((collection, fields, "missing (no collection)"))
+            elif not any(index["type"] == "persistent" and index["fields"] == fields and index.get("unique") for index in indexes):
+                problems.append((collection, fields, "missing"))
+
+        return problems
+
+    def ensureSchema(self, mode = SCHEMA_CREATE):
+        """
+        Check the collections and the unique indexes at mount time and act according to mode,
+        as lib.schema.SchemaManager.ensure does for Neo4j. Returns the problems that are left.
+        """
+        problems = self.verifySchema()
+
+        if problems and mode == SCHEMA_CREATE:
+            try:
+                for name in COLLECTIONS:
+                    if not self.database.hasCollection(name):
+                        self.database.createCollection(
+                            className = "Edges" if name in EDGE_COLLECTIONS else "Collection", name = name)
+                for collection, fields in INDEXES:
+                    self.database[collection].ensurePersistentIndex(fields, unique = True, sparse = False)
+            except Exception as e:
+                # e.g. duplicated names prevent the creation of the unique index
+                logger.warning("Cannot create the indexes: %s", e)
+            problems = self.verifySchema()
+
+        for collection, fields, problem in problems:
+            logger.warning("Index on %s(%s) is %s: lookups will scan the whole collection"
+                , collection, ", ".join(fields), problem)
+
+        if problems and mode == SCHEMA_REFUSE:
+            raise SchemaError("The database is missing the required indexes: {}".format(
+                ", ".join("{}({}) {}".format(collection, ", ".join(fields), problem) for collection, fields, problem in problems)))
+
+        return problems
+
+    # Operations
+    # ==========
+
+    def __measure(self, name):
+        if self.stats is None:
+            return nullcontext()
+        return self.stats.query(name)
+
+    def __execute(self, name, queries):
+        """
+        Send the queries in a single round trip and return the records of the last one
+        (or run the action of the operation, for ACTIONS).
+        """
+        with self.pool.connection() as database, self.__measure(name):
+            if name in ACTIONS:
+                return database.transaction(collections = dict(read = []), action = ACTIONS[name])["result"]
+
+            if len(queries) == 1:
+                return list(database.AQLQuery(
+                    queries[0]["query"], bindVars = queries[0]["bindVars"], rawResults = True, batchSize = CURSOR_BATCH_SIZE))
+
+            return database.transaction(
+                collections = dict(write = COLLECTIONS)
+                , action = TRANSACTION_ACTION
+                , params = dict(statements = queries))["result"]
+
+    def run(self, name, **parameters):
+        self.__execute(name, statements(name, parameters))
+
+    def data(self, name, **parameters):
+        return decodeRecords(self.__execute(name, statements(name, parameters)))
+
+    def evaluate(self, name, **parameters):
+        records = self.__execute(name, statements(name, parameters))
+
+        if not records:
+            return None
+        return next(iter(records[0].values()))
+
+    @contextmanager
+    def transaction(self):
+        tx = ArangoTransaction()
+        yield tx
+
+        if tx.statements:
+            self.__execute("commit", tx.statements)
+
+    def counters(self):
+        return self.pool.stats()
@@ -0,0 +1,77 @@
+# ---------------------------------------------------------
+# Interface of the storage backends.
+#
+# A backend stores groups, files and their content, and runs the named
+# operations below with keyword parameters. The names, parameters and
+# results are the ones of the Cypher templates of lib.queries, which
+# document each operation.
+
+OPERATIONS = dict(
+    # Kind and metadata of the elements of a path
+    resolve = ["resolvePath"]
+    # Directory listings, one page at a time
+    , list = ["readdirRootGroups", "readdirRootFiles", "readdirKeys", "nodeProperties", "countGroupFiles"]
+    # Creation, renaming, deletion of groups and files, and the groups of the files
+    , membership = ["createGroup", "deleteGroup", "renameGroup", "createFile", "linkFile"
+        , "moveFile", "replaceFile", "deleteFile", "setTimes"]
+    # Content of the files, as chunks
+    , content = ["readRange", "readChunks", "writeChunks", "truncateContent"
+        , "flushContent", "replaceContent", "legacyFiles", "contentFormat", "setContentFormat"]
+    # Batched writes of the bulk importer
+    , bulk = ["importGroups", "importFiles", "importContent"]
+    # Loading of the membership index (see lib.membership),
+    # and version of the graph its snapshot is validated against (see lib.snapshot)
+    , index = ["membershipGroups", "membershipFiles", "graphVersion"]
+    # Log of the changes made by the mounts, read by the others to invalidate their caches (see lib.changes)
+    , changes = ["recordChange", "changesSince", "lastChange", "pruneChanges"]
+)
+
+OPERATION_NAMES = frozenset(name for names in OPERATIONS.values() for name in names)
+
+class Backend(object):
+    """
+    Storage of GraphFS. Subclasses run the named operations of OPERATIONS,
+    and can be shared by the threads of a multithreaded mount.
+    """
+
+    # Name of the backend, as given on the command line
+    name = None
+
+    def run(self, name, **parameters):
+        """
+        Run the operation, discarding its results.
+        """
+        raise NotImplementedError
+
+    def data(self, name, **parameters):
+        """
+        Run the operation and return its records as a list of dicts.
+        """
+        raise NotImplementedError
+
+    def evaluate(self, name, **parameters):
+        """
+        Run the operation and return the first value of the first record (None if there are no records).
+        """
+        raise NotImplementedError
+
+    def transaction(self):
+        """
+        Return a context manager running the operations of a block atomically:
+
+            with backend.transaction() as tx:
+                tx.run(...)
+        """
+        raise NotImplementedError
+
+    def counters(self):
+        """
+        Return a dict of counters describing the state of the backend (e.g. its connections).
+        """
+        return {}
+
+    def close(self):
+        """
+        Release the resources of the backend on unmount.
+        """
+        pass
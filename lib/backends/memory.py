@@ -0,0 +1,493 @@
+import threading
+from contextlib import contextmanager, nullcontext
+
+from lib.backends.base import Backend, OPERATION_NAMES
+
+# ---------------------------------------------------------
+# In-memory backend.
+#
+# Each operation is a Python method on dict and set indexes, with the same
+# parameters and the same results as the Cypher template of lib.queries:
+#
+#   groups: name -> node id          groupFiles: group id -> set of file ids
+#   files:  name -> node id          fileGroups: file id -> set of group ids
+#   chunks: file id -> {index: data}
+#   changeLog: list of the recorded changes, numbered from 1 without gaps
+#
+# It needs no database, so GraphFS can be mounted for ephemeral or CI use,
+# and benchmarked without the latency of a server. Everything is lost on unmount.
+
+GROUP_PROPERTIES = ("mtime", "ctime")
+FILE_PROPERTIES = ("size", "atime", "mtime", "ctime")
+
+class MemoryBackend(Backend):
+    """
+    Run the operations on in-memory indexes.
+    Each query is atomic; a transaction holds the lock for the whole block,
+    but the queries of a failed block are not rolled back.
+    """
+
+    name = "memory"
+
+    def __init__(self, stats = None):
+        self.stats = stats
+
+        self.nodes = {}
+        self.groups = {}
+        self.files = {}
+        self.groupFiles = {}
+        self.fileGroups = {}
+        self.chunks = {}
+        # Changes recorded by the mounts, by sequence number
+        self.changeLog = []
+        # Format of the content (see lib.content.CONTENT_FORMAT)
+        self.format = None
+
+        self.__nextId = 0
+        # Sorted names of the groups and of the files, rebuilt after a change
+        self.__sortedNames = {}
+
+        self.__lock = threading.RLock()
+
+    # Interface of Backend
+    # ====================
+
+    def __query(self, name):
+        if name not in OPERATION_NAMES:
+            raise ValueError("Unknown query [{}].".format(name))
+        return getattr(self, name)
+
+    def __measure(self, name):
+        if self.stats is None:
+            return nullcontext()
+        return self.stats.query(name)
+
+    def run(self, name, **parameters):
+        query = self.__query(name)
+        with self.__lock, self.__measure(name):
+            query(**parameters)
+
+    def data(self, name, **parameters):
+        query = self.__query(name)
+        with self.__lock, self.__measure(name):
+            return query(**parameters)
+
+    def evaluate(self, name, **parameters):
+        query = self.__query(name)
+        with self.__lock, self.__measure(name):
+            records = query(**parameters)
+
+        if not records:
+            return None
+        return next(iter(records[0].values()))
+
+    @contextmanager
+    def transaction(self):
+        with self.__lock:
+            yield self
+
+    def counters(self):
+        with self.__lock:
+            return dict(
+                groups = len(self.groups)
+                , files = len(self.files)
+                , chunks = sum(len(chunks) for chunks in self.chunks.values())
+            )
+
+    # Helpers
+    # =======
+
+    def __newNode(self, **properties):
+        nodeId = self.__nextId
+        self.__nextId += 1
+        self.nodes[nodeId] = properties
+        return nodeId
+
+    def __projection(self, nodeId, keys):
+        node = self.nodes[nodeId]
+        return dict((key, node.get(key)) for key in keys)
+
+    def __file(self, nodeId):
+        return self.nodes[nodeId] if nodeId in self.fileGroups else None
+
+    def __link(self, fileId, groupNames):
+        for groupName in groupNames:
+            groupId = self.groups.get(groupName)
+            if groupId is not None:
+                self.groupFiles[groupId].add(fileId)
+                self.fileGroups[fileId].add(groupId)
+
+    def __unlink(self, fileId, groupNames):
+        for groupName in groupNames:
+            groupId = self.groups.get(groupName)
+            if groupId is not None:
+                self.groupFiles[groupId].discard(fileId)
+                self.fileGroups[fileId].discard(groupId)
+
+    def __rename(self, index, nodeId, newName):
+        node = self.nodes[nodeId]
+        if newName in index and index[newName] != nodeId:
+            raise ValueError("The name [{}] already exists.".format(newName))
+
+        del index[node["name"]]
+        index[newName] = nodeId
+        node["name"] = newName
+        self.__sortedNames.clear()
+
+    def __names(self, index):
+        names = self.__sortedNames.get(id(index))
+        if names is None:
+            names = self.__sortedNames[id(index)] = sorted(index)
+        return names
+
+    def __page(self, index, kind, rank, keys, lastName, limit):
+        names = self.__names(index)
+
+        # First name after lastName
+        low, high = 0, len(names)
+        while low < high:
+            middle = (low + high) // 2
+            if names[middle] <= lastName:
+                low = middle + 1
+            else:
+                high = middle
+
+        return [
+            dict(name = name, kind = kind, rank = rank, nodeId = index[name]
+                , properties = self.__projection(index[name], keys))
+            for name in names[low:low + limit]
+        ]
+
+    def __chunkRows(self, nodeId, indexes):
+        file = self.__file(nodeId)
+        if file is None:
+            return []
+
+        size = file.get("size") or 0
+        chunks = self.chunks.get(nodeId, {})
+        rows = [dict(size = size, index = index, data = chunks[index]) for index in indexes if index in chunks]
+
+        return rows or [dict(size = size, index = None, data = None)]
+
+    def __deleteFile(self, nodeId):
+        for groupId in self.fileGroups.pop(nodeId):
+            self.groupFiles[groupId].discard(nodeId)
+
+        self.chunks.pop(nodeId, None)
+        del self.files[self.nodes.pop(nodeId)["name"]]
+        self.__sortedNames.clear()
+
+    def __setChunks(self, nodeId, chunks):
+        fileChunks = self.chunks.setdefault(nodeId, {})
+        for chunk in chunks:
+            fileChunks[chunk["index"]] = chunk["data"]
+
+    def __dropChunks(self, nodeId, firstDroppedChunk):
+        fileChunks = self.chunks.get(nodeId, {})
+        for index in [index for index in fileChunks if index >= firstDroppedChunk]:
+            del fileChunks[index]
+
+    # Paths
+    # =====
+
+    def resolvePath(self, groupIDs, lastId):
+        groupId = self.groups.get(lastId)
+        fileId = self.files.get(lastId)
+
+        return [dict(
+            foundGroups = len(set(name for name in groupIDs if name in self.groups))
+            , groupNodeId = groupId
+            , groupProperties = self.__projection(groupId, GROUP_PROPERTIES) if groupId is not None else None
+            , fileNodeId = fileId
+            , fileProperties = self.__projection(fileId, FILE_PROPERTIES) if fileId is not None else None
+        )]
+
+    def setTimes(self, nodeId, atime, mtime, ctime):
+        node = self.nodes.get(nodeId)
+        if node is None:
+            return []
+
+        for key, value in (("atime", atime), ("mtime", mtime), ("ctime", ctime)):
+            if value is not None:
+                node[key] = value
+        return []
+
+    # Groups
+    # ======
+
+    def createGroup(self, groupId, now):
+        if groupId in self.groups:
+            raise ValueError("The group [{}] already exists.".format(groupId))
+
+        nodeId = self.__newNode(name = groupId, mtime = now, ctime = now)
+        self.groups[groupId] = nodeId
+        self.groupFiles[nodeId] = set()
+        self.__sortedNames.clear()
+        return [dict(id = nodeId)]
+
+    def countGroupFiles(self, nodeId):
+        if nodeId not in self.groupFiles:
+            return []
+        return [dict(count = len(self.groupFiles[nodeId]))]
+
+    def deleteGroup(self, nodeId):
+        if nodeId not in self.groupFiles:
+            return []
+        if self.groupFiles[nodeId]:
+            raise ValueError("The group still has files.")
+
+        del self.groupFiles[nodeId]
+        del self.groups[self.nodes.pop(nodeId)["name"]]
+        self.__sortedNames.clear()
+        return []
+
+    def renameGroup(self, nodeId, newGroupId, now):
+        if nodeId in self.groupFiles:
+            self.__rename(self.groups, nodeId, newGroupId)
+            self.nodes[nodeId]["ctime"] = now
+        return []
+
+    # Files
+    # =====
+
+    def createFile(self, fileId, now):
+        if fileId in self.files:
+            raise ValueError("The file [{}] already exists.".format(fileId))
+
+        nodeId = self.__newNode(name = fileId, size = 0, atime = now, mtime = now, ctime = now)
+        self.files[fileId] = nodeId
+        self.fileGroups[nodeId] = set()
+        self.__sortedNames.clear()
+        return [dict(id = nodeId)]
+
+    def linkFile(self, nodeId, groupIDs):
+        if self.__file(nodeId) is not None:
+            self.__link(nodeId, groupIDs)
+        return []
+
+    def moveFile(self, nodeId, newFileId, oldGroupIDs, newGroupIDs, now):
+        file = self.__file(nodeId)
+        if file is None:
+            return []
+
+        if newFileId is not None:
+            self.__rename(self.files, nodeId, newFileId)
+        file["ctime"] = now
+
+        self.__unlink(nodeId, oldGroupIDs)
+        self.__link(nodeId, newGroupIDs)
+        return []
+
+    def replaceFile(self, fromNodeId, toNodeId, groupIDs, now):
+        oldFile = self.__file(fromNodeId)
+        newFile = self.__file(toNodeId)
+        if oldFile is None or newFile is None:
+            return []
+
+        newFile["size"] = oldFile.get("size") or 0
+        newFile["mtime"] = oldFile.get("mtime")
+        newFile["ctime"] = now
+        self.chunks[toNodeId] = self.chunks.pop(fromNodeId, {})
+
+        self.__deleteFile(fromNodeId)
+        self.__link(toNodeId, groupIDs)
+        return []
+
+    def deleteFile(self, nodeId):
+        if self.__file(nodeId) is not None:
+            self.__deleteFile(nodeId)
+        return []
+
+    # Directory listings
+    # ==================
+
+    def readdirRootGroups(self, lastName, limit):
+        return self.__page(self.groups, "group", 0, GROUP_PROPERTIES, lastName, limit)
+
+    def readdirRootFiles(self, lastName, limit):
+        return self.__page(self.files, "file", 1, FILE_PROPERTIES, lastName, limit)
+
+    def readdirKeys(self, groupIDs):
+        groupIds = sorted(
+            set(self.groups[name] for name in groupIDs if name in self.groups)
+            , key = lambda groupId: len(self.groupFiles[groupId]))
+
+        if not groupIds:
+            return []
+
+        # Intersection seeded from the smallest group
+        seed, others = groupIds[0], groupIds[1:]
+        files = [
+            fileId for fileId in self.groupFiles[seed]
+            if all(fileId in self.groupFiles[other] for other in others)
+        ]
+
+        newGroups = set()
+        for fileId in files:
+            newGroups.update(self.fileGroups[fileId])
+        newGroups.difference_update(groupIds)
+
+        return [
+            dict(rank = 0, name = self.nodes[groupId]["name"], nodeId = groupId) for groupId in newGroups
+        ] + [
+            dict(rank = 1, name = self.nodes[fileId]["name"], nodeId = fileId) for fileId in files
+        ]
+
+    def nodeProperties(self, nodeIds):
+        return [
+            dict(nodeId = nodeId, properties = self.__projection(nodeId, FILE_PROPERTIES))
+            for nodeId in nodeIds
+            if nodeId in self.nodes
+        ]
+
+    # Content
+    # =======
+
+    def readRange(self, nodeId, firstChunk, lastChunk):
+        return self.__chunkRows(nodeId, range(firstChunk, lastChunk + 1))
+
+    def readChunks(self, nodeId, indexes):
+        return self.__chunkRows(nodeId, sorted(set(indexes)))
+
+    def writeChunks(self, nodeId, end, chunks, mtime):
+        file = self.__file(nodeId)
+        if file is None:
+            return []
+
+        file["size"] = max(file.get("size") or 0, end)
+        file["mtime"] = file["ctime"] = mtime
+        self.__setChunks(nodeId, chunks)
+        return []
+
+    def truncateContent(self, nodeId, length, firstDroppedChunk, chunks, mtime):
+        file = self.__file(nodeId)
+        if file is None:
+            return []
+
+        file["size"] = length
+        file["mtime"] = file["ctime"] = mtime
+        self.__dropChunks(nodeId, firstDroppedChunk)
+
+        # Only the existing chunks are trimmed
+        fileChunks = self.chunks.get(nodeId, {})
+        self.__setChunks(nodeId, [chunk for chunk in chunks if chunk["index"] in fileChunks])
+        return []
+
+    def flushContent(self, nodeId, size, chunks, firstDroppedChunk, mtime):
+        file = self.__file(nodeId)
+        if file is None:
+            return []
+
+        file["size"] = size
+        file["mtime"] = file["ctime"] = mtime
+        if firstDroppedChunk is not None:
+            self.__dropChunks(nodeId, firstDroppedChunk)
+        self.__setChunks(nodeId, chunks)
+        return []
+
+    def replaceContent(self, nodeId, size, chunks):
+        file = self.__file(nodeId)
+        if file is None:
+            return []
+
+        file["size"] = size
+        file.pop("value", None)
+        self.chunks[nodeId] = {}
+        self.__setChunks(nodeId, chunks)
+        return []
+
+    def contentFormat(self):
+        return [dict(format = self.format)]
+
+    def setContentFormat(self, format):
+        self.format = format
+        return []
+
+    def legacyFiles(self):
+        return [
+            dict(nodeId = fileId, value = self.nodes[fileId]["value"])
+            for fileId in self.fileGroups
+            if "value" in self.nodes[fileId]
+        ]
+
+    # Bulk import
+    # ===========
+
+    def importGroups(self, groupIDs, now):
+        for groupId in groupIDs:
+            if groupId not in self.groups:
+                self.createGroup(groupId, now)
+        return []
+
+    def importFiles(self, files, now):
+        for file in files:
+            nodeId = self.files.get(file["name"])
+            if nodeId is None:
+                nodeId = self.createFile(file["name"], now)[0]["id"]
+                node = self.nodes[nodeId]
+                node["atime"] = node["mtime"] = file["mtime"]
+                node["ctime"] = now
+
+            self.__link(nodeId, file["groupIDs"])
+        return []
+
+    def importContent(self, contents):
+        for content in contents:
+            nodeId = self.files.get(content["name"])
+            if nodeId is None:
+                continue
+
+            node = self.nodes[nodeId]
+            node["size"] = content["size"]
+            node["mtime"] = content["mtime"]
+            self.chunks[nodeId] = {}
+            self.__setChunks(nodeId, content["chunks"])
+        return []
+
+    # Membership index
+    # ================
+
+    def membershipGroups(self):
+        return [dict(nodeId = nodeId, name = name) for name, nodeId in self.groups.items()]
+
+    def membershipFiles(self):
+        return [
+            dict(nodeId = nodeId, name = name, groupNodeIds = list(self.fileGroups[nodeId]))
+            for name, nodeId in self.files.items()
+        ]
+
+    def graphVersion(self):
+        # The graph does not outlive the mount, so no snapshot is ever valid
+        return [dict(version = None)]
+
+    # Change log
+    # ==========
+
+    def recordChange(self, mount, names, nodeIds, structural, update, now):
+        self.changeLog.append(dict(seq = self.__lastChange() + 1, mount = mount
+            , names = list(names), nodeIds = list(nodeIds), structural = structural, update = update, time = now))
+        return []
+
+    def __lastChange(self):
+        return self.changeLog[-1]["seq"] if self.changeLog else 0
+
+    def changesSince(self, after, limit):
+        if not self.changeLog:
+            return []
+
+        start = max(0, after + 1 - self.changeLog[0]["seq"])
+        return [
+            dict(seq = change["seq"], mount = change["mount"], names = list(change["names"])
+                , nodeIds = list(change["nodeIds"]), structural = change["structural"], update = change["update"])
+            for change in self.changeLog[start:start + limit]
+        ]
+
+    def lastChange(self):
+        return [dict(seq = self.__lastChange())]
+
+    def pruneChanges(self, before):
+        pruned = 0
+        while pruned < len(self.changeLog) - 1 and self.changeLog[pruned]["time"] < before:
+            pruned += 1
+        del self.changeLog[:pruned]
+        return []
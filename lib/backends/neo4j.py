@@ -0,0 +1,54 @@
+from py2neo import Graph
+
+from lib.backends.base import Backend
+from lib.queries import Queries
+from lib.schema import SchemaManager, SCHEMA_CREATE
+from lib.pool import ConnectionPool, DEFAULT_POOL_SIZE
+
+# ---------------------------------------------------------
+# Neo4j backend: the operations are the Cypher templates of lib.queries,
+# run through py2neo.
+
+# Labels and keys the lookups rely on
+# (the ones of the change log also keep a single counter node)
+SCHEMA_KEYS = [("Group", "name"), ("File", "name"), ("Change", "seq"), ("ChangeLog", "id")]
+
+class Neo4jBackend(Backend):
+    """
+    Run the operations on a Neo4j graph.
+    Each query checks out a connection from a bounded pool, so that
+    the threads of a multithreaded mount do not wait for each other.
+    """
+
+    name = "neo4j"
+
+    def __init__(self, password
+        , schemaMode = SCHEMA_CREATE
+        , poolSize = DEFAULT_POOL_SIZE
+        , stats = None):
+
+        self.graph = Graph(password = password)
+
+        # Groups and files are looked up by their primary key,
+        # which has to be indexed to avoid scanning all the nodes
+        self.schema = SchemaManager(self.graph, SCHEMA_KEYS)
+        self.schema.ensure(schemaMode)
+
+        # py2neo opens a Bolt session per transaction, so the pool also bounds the open sessions
+        self.pool = ConnectionPool(lambda: Graph(password = password), poolSize)
+        self.queries = Queries(pool = self.pool, stats = stats)
+
+    def run(self, name, **parameters):
+        self.queries.run(name, **parameters)
+
+    def data(self, name, **parameters):
+        return self.queries.data(name, **parameters)
+
+    def evaluate(self, name, **parameters):
+        return self.queries.evaluate(name, **parameters)
+
+    def transaction(self):
+        return self.queries.transaction()
+
+    def counters(self):
+        return self.pool.stats()
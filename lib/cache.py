@@ -0,0 +1,272 @@
+import os
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+# ---------------------------------------------------------
+# Helpers
+
+def normalizePath(path):
+    """
+    Normalize a path so that equivalent paths share the same cache key
+    (all '/' as delimiters, no drive letter, no trailing or double slashes).
+    """
+    return os.path.normpath(os.path.splitdrive(path)[1])
+
+def pathElements(path):
+    """
+    Return the elements (groups and file names) of a normalized path.
+    """
+    return [element for element in path.split('/') if element != ""]
+
+# ---------------------------------------------------------
+# Metadata cache
+
+class MetadataCache(object):
+    """
+    In-process cache for metadata (attributes, directory entries) keyed by normalized path.
+    The cache is bounded: when maxEntries is reached the least recently used entry is evicted.
+    Entries older than ttl seconds are considered expired and dropped on lookup.
+
+    As a path is made of group and file names, which are unique in the graph,
+    the cache keeps track of the paths each name appears in, so that a change
+    to a group or a file invalidates every path referring to it.
+
+    The cache can be shared by the threads of a multithreaded mount.
+    """
+
+    def __init__(self, maxEntries = 4096, ttl = 1.0):
+
+        if maxEntries < 1:
+            raise ValueError("The cache must hold at least one entry.")
+
+        self.maxEntries = maxEntries
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+
+        self.__lock = threading.RLock()
+
+        # path -> (expiration time, value)
+        self.__entries = OrderedDict()
+        # element name -> set of cached paths containing it
+        self.__pathsByName = {}
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __drop(self, path):
+        del self.__entries[path]
+
+        for name in pathElements(path):
+            paths = self.__pathsByName.get(name)
+            if paths is not None:
+                paths.discard(path)
+                if not paths:
+                    del self.__pathsByName[name]
+
+    def lookup(self, path):
+        """
+        Return a tuple (found, value).
+        The value can legitimately be None (e.g. to cache a missing path),
+        so found tells if the path was in the cache.
+        """
+        path = normalizePath(path)
+
+        with self.__lock:
+            entry = self.__entries.get(path)
+
+            if entry is not None:
+                if entry[0] > monotonic():
+                    self.__entries.move_to_end(path)
+                    self.hits += 1
+                    return True, entry[1]
+
+                # Expired
+                self.__drop(path)
+
+            self.misses += 1
+            return False, None
+
+    def put(self, path, value):
+        path = normalizePath(path)
+
+        with self.__lock:
+            if path in self.__entries:
+                self.__drop(path)
+
+            self.__entries[path] = (monotonic() + self.ttl, value)
+
+            for name in pathElements(path):
+                self.__pathsByName.setdefault(name, set()).add(path)
+
+            # Evict the least recently used entries
+            while len(self.__entries) > self.maxEntries:
+                self.__drop(next(iter(self.__entries)))
+
+    def invalidate(self, name):
+        """
+        Drop all the cached paths containing the group or file name.
+        """
+        with self.__lock:
+            for path in list(self.__pathsByName.get(name, ())):
+                self.__drop(path)
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.__pathsByName.clear()
+
+    def stats(self):
+        with self.__lock:
+            return dict(
+                entries = len(self.__entries)
+                , maxEntries = self.maxEntries
+                , ttl = self.ttl
+                , hits = self.hits
+                , misses = self.misses
+            )
+
+# ---------------------------------------------------------
+# Content cache
+
+class ContentCache(object):
+    """
+    Process-wide cache of the chunks of the files, keyed by (node id, chunk index),
+    bounded by the total size of the cached chunks: when maxBytes is exceeded
+    the least recently used chunks are evicted.
+    The size of each file is cached along its chunks, and holes are cached as empty chunks.
+
+    The cache is invalidated per file. Chunks fetched while a file was being
+    modified are discarded: the reader takes a token before querying the graph
+    and the chunks are stored only if nothing was invalidated in the meanwhile.
+    """
+
+    def __init__(self, maxBytes = 64 * 1024 * 1024):
+
+        if maxBytes < 1:
+            raise ValueError("The cache must hold at least one byte.")
+
+        self.maxBytes = maxBytes
+        self.bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # (node id, chunk index) -> data
+        self.__chunks = OrderedDict()
+        # node id -> (size, set of cached chunk indexes)
+        self.__files = {}
+        # Incremented at every invalidation
+        self.__version = 0
+
+        self.__lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.__chunks)
+
+    def __drop(self, key):
+        data = self.__chunks.pop(key)
+        self.bytes -= len(data)
+
+        nodeId, index = key
+        indexes = self.__files[nodeId][1]
+        indexes.discard(index)
+        if not indexes:
+            del self.__files[nodeId]
+
+    def token(self):
+        """
+        Return the token to pass to put() for the chunks about to be fetched.
+        """
+        with self.__lock:
+            return self.__version
+
+    def get(self, nodeId, indexes):
+        """
+        Return a tuple (size, chunks, missing): the size of the file (None if not cached),
+        the cached chunks among indexes (index -> data) and the list of the missing indexes.
+        """
+        chunks = {}
+        missing = []
+
+        with self.__lock:
+            file = self.__files.get(nodeId)
+
+            for index in indexes:
+                data = self.__chunks.get((nodeId, index))
+                if data is None:
+                    missing.append(index)
+                else:
+                    self.__chunks.move_to_end((nodeId, index))
+                    chunks[index] = data
+
+            self.hits += len(chunks)
+            self.misses += len(missing)
+
+            return (file[0] if file is not None else None), chunks, missing
+
+    def put(self, nodeId, size, chunks, token):
+        """
+        Store the size of the file and the given chunks (index -> data),
+        unless something was invalidated since token was taken.
+        """
+        with self.__lock:
+            if token != self.__version:
+                return
+
+            file = self.__files.get(nodeId)
+            indexes = file[1] if file is not None else set()
+
+            for index, data in chunks.items():
+                key = (nodeId, index)
+                if key in self.__chunks:
+                    self.bytes -= len(self.__chunks[key])
+
+                self.__chunks[key] = data
+                self.__chunks.move_to_end(key)
+                self.bytes += len(data)
+                indexes.add(index)
+
+            if indexes:
+                self.__files[nodeId] = (size, indexes)
+
+            # Evict the least recently used chunks
+            while self.bytes > self.maxBytes and self.__chunks:
+                self.__drop(next(iter(self.__chunks)))
+                self.evictions += 1
+
+    def invalidate(self, nodeId):
+        """
+        Drop all the cached chunks of the file.
+        """
+        with self.__lock:
+            self.__version += 1
+
+            file = self.__files.get(nodeId)
+            if file is not None:
+                for index in list(file[1]):
+                    self.__drop((nodeId, index))
+
+    def clear(self):
+        with self.__lock:
+            self.__version += 1
+            self.__chunks.clear()
+            self.__files.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.__lock:
+            lookups = self.hits + self.misses
+            return dict(
+                chunks = len(self.__chunks)
+                , files = len(self.__files)
+                , bytes = self.bytes
+                , maxBytes = self.maxBytes
+                , hits = self.hits
+                , misses = self.misses
+                , hitRatio = self.hits / lookups if lookups else 0.0
+                , evictions = self.evictions
+            )
@@ -0,0 +1,148 @@
+import json
+import logging
+import threading
+import uuid
+from time import monotonic, time
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------------
+# Coherence of the caches of several mounts of the same graph.
+#
+# The caches of a mount are invalidated by its own operations, but know nothing
+# of the changes made by the other mounts. With a change feed, every change
+# a mount makes to the graph is also recorded in a log kept in the graph: a
+# numbered entry with the names of the groups and files affected, the node ids
+# of the files whose content changed, whether directories changed (structural),
+# and the update of the membership index they made (see lib.membership), stored
+# as JSON. Each mount polls the log from the last number it has seen, invalidates
+# only what the changes of the others affect, and applies their updates to its index.
+#
+# The numbers have no gaps, so that a mount which finds a gap knows it missed
+# changes pruned from the log in the meanwhile (e.g. after being suspended),
+# and drops all its caches instead.
+
+DEFAULT_POLL_INTERVAL = 1.0 # Seconds
+DEFAULT_RETENTION = 3600.0 # Seconds changes are kept in the log
+PRUNE_INTERVAL = 60.0 # Seconds between two prunings of the log by the same mount
+
+# Changes read with a single query
+POLL_BATCH_SIZE = 1000
+
+class ChangeFeed(object):
+    """
+    Record the changes of this mount in the change log of the backend,
+    and apply the changes of the other mounts from a background thread.
+
+    apply is called with the list of the changes read, as dicts
+    {seq, mount, names, nodeIds, structural, update}, or with None if changes were
+    missed and everything has to be invalidated. update is the update of the
+    membership index made by the change, as [name, arguments...], or None.
+    """
+
+    def __init__(self, backend, apply
+        , interval = DEFAULT_POLL_INTERVAL
+        , retention = DEFAULT_RETENTION):
+
+        if interval <= 0:
+            raise ValueError("The poll interval must be positive.")
+
+        self.backend = backend
+        self.apply = apply
+        self.interval = interval
+        self.retention = retention
+
+        # Identifies the changes of this mount, which are already applied
+        self.mountId = uuid.uuid4().hex
+        # Number of the last change seen: the changes made before the mount do not matter
+        self.lastSeq = backend.evaluate("lastChange") or 0
+
+        self.recorded = 0
+        self.applied = 0
+        self.missed = 0
+
+        self.__lock = threading.Lock()
+        self.__stop = threading.Event()
+        self.__lastPrune = monotonic()
+        self.__thread = threading.Thread(target = self.__run, name = "change-feed", daemon = True)
+
+    def start(self):
+        self.__thread.start()
+
+    def stop(self):
+        self.__stop.set()
+        if self.__thread.is_alive():
+            self.__thread.join()
+
+    def record(self, names, nodeIds = (), structural = False, update = None):
+        """
+        Record a change made by this mount, once it is in the graph.
+        """
+        self.backend.run("recordChange"
+            , mount = self.mountId
+            , names = [name for name in names if name is not None]
+            , nodeIds = [nodeId for nodeId in nodeIds if nodeId is not None]
+            , structural = structural
+            , update = json.dumps(update) if update is not None else None
+            , now = time())
+
+        with self.__lock:
+            self.recorded += 1
+
+    def poll(self):
+        """
+        Apply the changes of the other mounts recorded since the last poll.
+        Returns the number of changes read.
+        """
+        read = 0
+
+        while True:
+            changes = self.backend.data("changesSince", after = self.lastSeq, limit = POLL_BATCH_SIZE)
+            if not changes:
+                break
+
+            if changes[0]["seq"] != self.lastSeq + 1:
+                logger.warning("Missed the changes %s to %s, pruned from the log: dropping all the caches"
+                    , self.lastSeq + 1, changes[0]["seq"] - 1)
+                self.apply(None)
+                with self.__lock:
+                    self.missed += 1
+            else:
+                others = [change for change in changes if change["mount"] != self.mountId]
+                for change in others:
+                    update = change["update"]
+                    change["update"] = json.loads(update) if update is not None else None
+                if others:
+                    self.apply(others)
+                    with self.__lock:
+                        self.applied += len(others)
+
+            self.lastSeq = changes[-1]["seq"]
+            read += len(changes)
+
+            if len(changes) < POLL_BATCH_SIZE:
+                break
+
+        return read
+
+    def __run(self):
+        while not self.__stop.wait(self.interval):
+            try:
+                self.poll()
+
+                if monotonic() - self.__lastPrune >= PRUNE_INTERVAL:
+                    self.__lastPrune = monotonic()
+                    self.backend.run("pruneChanges", before = time() - self.retention)
+            except Exception as e:
+                # The next poll starts again from the last change applied
+                logger.warning("Cannot read the change log: %s", e)
+
+    def stats(self):
+        with self.__lock:
+            return dict(
+                lastSeq = self.lastSeq
+                , recorded = self.recorded
+                , applied = self.applied
+                , missed = self.missed
+                , interval = self.interval
+            )
@@ -0,0 +1,439 @@
+from time import time
+
+# ---------------------------------------------------------
+# Chunked storage of the content of the files.
+#
+# The content of a file is split in fixed-size chunks of bytes,
+# each one stored in a Chunk node linked to its File:
+#
+#   (f:File {size, atime, mtime, ctime})-[:hasChunk]->(c:Chunk {index, data})
+#
+# Chunk i holds the bytes [i * CHUNK_SIZE, (i + 1) * CHUNK_SIZE) of the file,
+# so a byte range can be fetched loading only the chunks overlapping it.
+
+CHUNK_SIZE = 64 * 1024 # Bytes
+
+# Format of the content recorded in the graph once the legacy files are migrated:
+# the graph is scanned for them only while it carries an older format (or none)
+CONTENT_FORMAT = 1 # Chunks
+
+# ---------------------------------------------------------
+
+def splitInChunks(data, firstChunk = 0):
+    """
+    Split data in a list of chunk parameters ({index, data}),
+    numbering them starting from firstChunk.
+    """
+    return [
+        dict(index = firstChunk + i, data = bytes(data[start:start + CHUNK_SIZE]))
+        for i, start in enumerate(range(0, len(data), CHUNK_SIZE))
+    ]
+
+def sliceChunks(chunks, size, offset, length):
+    """
+    Return the bytes [offset, offset + length) of a file of the given size,
+    from its chunks overlapping the range (index -> data).
+    Missing chunks (e.g. holes left by a seek past the end of the file) read as zeros.
+    """
+    end = min(offset + length, size)
+    if length <= 0 or offset >= end:
+        return b""
+
+    firstChunk = offset // CHUNK_SIZE
+    lastChunk = (end - 1) // CHUNK_SIZE
+
+    buf = bytearray((lastChunk - firstChunk + 1) * CHUNK_SIZE)
+    for index in range(firstChunk, lastChunk + 1):
+        data = chunks.get(index)
+        if data is None:
+            continue
+        start = (index - firstChunk) * CHUNK_SIZE
+        buf[start:start + len(data)] = data
+
+    base = firstChunk * CHUNK_SIZE
+    return bytes(buf[offset - base:end - base])
+
+class ChunkedContent(object):
+    """
+    Read and write the content of the files stored as chunks in the graph,
+    through the named queries of lib.queries.
+    Files are identified by the id of their node.
+    With a ContentCache (see lib.cache) the chunks that are read are kept in memory,
+    and the ones of a file are dropped whenever the file is modified.
+    """
+
+    def __init__(self, queries, cache = None):
+        self.queries = queries
+        self.cache = cache
+
+    def invalidate(self, nodeId):
+        """
+        Drop the cached chunks of the file, e.g. because its content was changed by another query.
+        """
+        if self.cache is not None:
+            self.cache.invalidate(nodeId)
+
+    def read(self, nodeId, length, offset):
+        """
+        Return the bytes [offset, offset + length) of the file,
+        fetching only the chunks overlapping the range.
+        """
+        if length <= 0:
+            return b""
+
+        firstChunk = offset // CHUNK_SIZE
+        lastChunk = (offset + length - 1) // CHUNK_SIZE
+
+        if self.cache is not None:
+            size, chunks = self.readChunks(nodeId, range(firstChunk, lastChunk + 1))
+            return sliceChunks(chunks, size, offset, length)
+
+        records = self.queries.data(
+            "readRange"
+            , nodeId = nodeId
+            , firstChunk = firstChunk
+            , lastChunk = lastChunk
+            )
+
+        if not records:
+            return b""
+
+        chunks = dict(
+            (record["index"], record["data"])
+            for record in records
+            if record["index"] is not None
+        )
+
+        return sliceChunks(chunks, records[0]["size"], offset, length)
+
+    def readChunks(self, nodeId, indexes):
+        """
+        Return a tuple (size, chunks), where chunks maps the index of the requested
+        chunks to their data. Missing chunks are not returned.
+        """
+        indexes = list(indexes)
+
+        if self.cache is None:
+            return self.__fetchChunks(nodeId, indexes)
+
+        size, chunks, missing = self.cache.get(nodeId, indexes)
+
+        if missing or size is None:
+            token = self.cache.token()
+            size, fetched = self.__fetchChunks(nodeId, missing)
+            chunks.update(fetched)
+
+            # Holes are cached as empty chunks, the chunks past the end of the file are not cached
+            chunksCount = (size + CHUNK_SIZE - 1) // CHUNK_SIZE
+            self.cache.put(nodeId, size
+                , dict((index, fetched.get(index, b"")) for index in missing if index < chunksCount)
+                , token)
+
+        return size, dict((index, data) for index, data in chunks.items() if data)
+
+    def __fetchChunks(self, nodeId, indexes):
+        records = self.queries.data("readChunks", nodeId = nodeId, indexes = indexes)
+
+        if not records:
+            return 0, {}
+
+        chunks = dict(
+            (record["index"], record["data"])
+            for record in records
+            if record["index"] is not None
+        )
+
+        return records[0]["size"], chunks
+
+    def write(self, nodeId, data, offset):
+        """
+        Write data at the given offset, touching only the chunks overlapping
+        [offset, offset + len(data)). The file grows if needed.
+        Only the first and the last chunk can be partially overwritten,
+        so at most two chunks are fetched before writing.
+        """
+        if len(data) == 0:
+            return
+
+        end = offset + len(data)
+        firstChunk = offset // CHUNK_SIZE
+        lastChunk = (end - 1) // CHUNK_SIZE
+
+        # Chunks that are only partially overwritten have to be merged with their current data
+        partialChunks = set()
+        if offset % CHUNK_SIZE != 0:
+            partialChunks.add(firstChunk)
+        if end % CHUNK_SIZE != 0:
+            partialChunks.add(lastChunk)
+
+        existingChunks = {}
+        if partialChunks:
+            _, existingChunks = self.readChunks(nodeId, partialChunks)
+
+        chunks = []
+        for index in range(firstChunk, lastChunk + 1):
+            chunkStart = index * CHUNK_SIZE
+            dataStart = max(offset, chunkStart)
+            dataEnd = min(end, chunkStart + CHUNK_SIZE)
+
+            chunk = bytearray(existingChunks.get(index, b""))
+            if len(chunk) < dataEnd - chunkStart:
+                chunk.extend(bytes(dataEnd - chunkStart - len(chunk)))
+            chunk[dataStart - chunkStart:dataEnd - chunkStart] = data[dataStart - offset:dataEnd - offset]
+
+            chunks.append(dict(index = index, data = bytes(chunk)))
+
+        self.queries.run(
+            "writeChunks"
+            , nodeId = nodeId
+            , end = end
+            , chunks = chunks
+            , mtime = time()
+            )
+        self.invalidate(nodeId)
+
+    def truncate(self, nodeId, length):
+        """
+        Set the size of the file to length.
+        The chunks past the new end are deleted and the last one is trimmed;
+        when the file grows the new bytes read as zeros.
+        """
+        chunks = []
+
+        if length % CHUNK_SIZE == 0:
+            firstDroppedChunk = length // CHUNK_SIZE
+        else:
+            lastChunk = length // CHUNK_SIZE
+            firstDroppedChunk = lastChunk + 1
+
+            _, existingChunks = self.readChunks(nodeId, [lastChunk])
+            lastChunkData = existingChunks.get(lastChunk)
+            lastChunkLength = length - lastChunk * CHUNK_SIZE
+
+            if lastChunkData is not None and len(lastChunkData) > lastChunkLength:
+                chunks.append(dict(index = lastChunk, data = bytes(lastChunkData[:lastChunkLength])))
+
+        self.queries.run(
+            "truncateContent"
+            , nodeId = nodeId
+            , length = length
+            , firstDroppedChunk = firstDroppedChunk
+            , chunks = chunks
+            , mtime = time()
+            )
+        self.invalidate(nodeId)
+
+    def flush(self, nodeId, size, chunks, firstDroppedChunk = None, mtime = None):
+        """
+        Apply in a single transaction the changes collected by a WriteBuffer:
+        drop the chunks from firstDroppedChunk on (if not None),
+        then write the given chunks and set the size and the modification time of the file.
+        """
+        self.queries.run(
+            "flushContent"
+            , nodeId = nodeId
+            , size = size
+            , chunks = chunks
+            , firstDroppedChunk = firstDroppedChunk
+            , mtime = time() if mtime is None else mtime
+            )
+        self.invalidate(nodeId)
+
+    def replace(self, nodeId, data):
+        """
+        Replace the whole content of the file with data.
+        """
+        self.queries.run(
+            "replaceContent"
+            , nodeId = nodeId
+            , size = len(data)
+            , chunks = splitInChunks(data)
+            )
+        self.invalidate(nodeId)
+
+    def delete(self, nodeId):
+        """
+        Delete the file together with its chunks and relationships.
+        """
+        self.queries.run("deleteFile", nodeId = nodeId)
+        self.invalidate(nodeId)
+
+    def migrateLegacy(self):
+        """
+        Convert the files whose content is still stored as a single
+        UTF-8 string in the 'value' property into chunks.
+        The migration runs once: the graph is then marked with CONTENT_FORMAT.
+        Returns the number of migrated files.
+        """
+        if self.queries.evaluate("contentFormat") == CONTENT_FORMAT:
+            return 0
+
+        records = self.queries.data("legacyFiles")
+
+        for record in records:
+            self.replace(record["nodeId"], record["value"].encode("utf-8"))
+
+        self.queries.run("setContentFormat", format = CONTENT_FORMAT)
+        return len(records)
+
+# ---------------------------------------------------------
+# Write-back buffer
+
+class WriteBuffer(object):
+    """
+    Write-back buffer of an open file.
+    Writes and truncations are applied to in-memory chunks and sent to the graph
+    in one transaction when the buffer is flushed, so that a sequence of writes
+    costs a single database write.
+    Reads through the buffer see the buffered changes.
+    """
+
+    def __init__(self, content, nodeId, size):
+        self.content = content
+        self.nodeId = nodeId
+
+        # Size of the file, including the buffered changes
+        self.size = size
+        # Size of the file in the graph
+        self.persistedSize = size
+        # Smallest length the file was truncated to since the last flush (None if not truncated).
+        # The data in the graph past this length is stale.
+        self.truncatedTo = None
+
+        # index -> bytearray with the whole content of the chunk
+        self.dirtyChunks = {}
+        self.dirty = False
+        # Time of the last buffered change
+        self.mtime = None
+
+    @property
+    def dirtyBytes(self):
+        return sum(len(chunk) for chunk in self.dirtyChunks.values())
+
+    def __validPersistedSize(self):
+        # Bytes of the file in the graph that are still valid
+        if self.truncatedTo is None:
+            return self.persistedSize
+        return min(self.persistedSize, self.truncatedTo)
+
+    def __loadChunks(self, indexes):
+        # Load the chunks from the graph into the buffer,
+        # ignoring the data that is not valid anymore
+        validSize = self.__validPersistedSize()
+        indexes = [index for index in indexes if index * CHUNK_SIZE < validSize]
+
+        existingChunks = {}
+        if indexes:
+            _, existingChunks = self.content.readChunks(self.nodeId, indexes)
+
+        for index in indexes:
+            chunk = bytearray(existingChunks.get(index, b""))
+            del chunk[max(0, validSize - index * CHUNK_SIZE):]
+            self.dirtyChunks[index] = chunk
+
+    def write(self, data, offset):
+        if len(data) == 0:
+            return
+
+        end = offset + len(data)
+        firstChunk = offset // CHUNK_SIZE
+        lastChunk = (end - 1) // CHUNK_SIZE
+
+        # Chunks only partially overwritten and not yet buffered have to be loaded first
+        partialChunks = set()
+        if offset % CHUNK_SIZE != 0:
+            partialChunks.add(firstChunk)
+        if end % CHUNK_SIZE != 0:
+            partialChunks.add(lastChunk)
+        self.__loadChunks(partialChunks.difference(self.dirtyChunks))
+
+        for index in range(firstChunk, lastChunk + 1):
+            chunkStart = index * CHUNK_SIZE
+            dataStart = max(offset, chunkStart)
+            dataEnd = min(end, chunkStart + CHUNK_SIZE)
+
+            chunk = self.dirtyChunks.setdefault(index, bytearray())
+            if len(chunk) < dataEnd - chunkStart:
+                chunk.extend(bytes(dataEnd - chunkStart - len(chunk)))
+            chunk[dataStart - chunkStart:dataEnd - chunkStart] = data[dataStart - offset:dataEnd - offset]
+
+        self.size = max(self.size, end)
+        self.dirty = True
+        self.mtime = time()
+
+    def truncate(self, length):
+        if length < self.size:
+            boundaryChunk = length // CHUNK_SIZE
+
+            # The chunk containing the new end is trimmed,
+            # so it has to be in the buffer
+            if length % CHUNK_SIZE != 0 and boundaryChunk not in self.dirtyChunks:
+                self.__loadChunks([boundaryChunk])
+
+            for index in list(self.dirtyChunks):
+                if index * CHUNK_SIZE >= length:
+                    del self.dirtyChunks[index]
+
+            if boundaryChunk in self.dirtyChunks:
+                del self.dirtyChunks[boundaryChunk][length - boundaryChunk * CHUNK_SIZE:]
+
+            if self.truncatedTo is None or length < self.truncatedTo:
+                self.truncatedTo = length
+
+        self.size = length
+        self.dirty = True
+        self.mtime = time()
+
+    def read(self, length, offset):
+        end = min(offset + length, self.size)
+        if offset >= end:
+            return b""
+
+        buf = bytearray(end - offset)
+
+        firstChunk = offset // CHUNK_SIZE
+        lastChunk = (end - 1) // CHUNK_SIZE
+
+        # Read from the graph only if some chunk of the range is not buffered
+        persistedEnd = min(end, self.__validPersistedSize())
+        if persistedEnd > offset \
+            and any(index not in self.dirtyChunks for index in range(firstChunk, lastChunk + 1)):
+            persisted = self.content.read(self.nodeId, persistedEnd - offset, offset)
+            buf[:len(persisted)] = persisted
+
+        for index in range(firstChunk, lastChunk + 1):
+            chunk = self.dirtyChunks.get(index)
+            if chunk is None:
+                continue
+
+            chunkStart = index * CHUNK_SIZE
+            dataStart = max(offset, chunkStart)
+            dataEnd = min(end, chunkStart + CHUNK_SIZE)
+
+            # Bytes past the end of the buffered chunk are a hole
+            part = chunk[dataStart - chunkStart:dataEnd - chunkStart]
+            part.extend(bytes(dataEnd - dataStart - len(part)))
+            buf[dataStart - offset:dataEnd - offset] = part
+
+        return bytes(buf)
+
+    def flush(self):
+        if not self.dirty:
+            return
+
+        firstDroppedChunk = None
+        if self.truncatedTo is not None:
+            firstDroppedChunk = (self.truncatedTo + CHUNK_SIZE - 1) // CHUNK_SIZE
+
+        self.content.flush(
+            self.nodeId
+            , self.size
+            , [dict(index = index, data = bytes(chunk)) for index, chunk in sorted(self.dirtyChunks.items())]
+            , firstDroppedChunk
+            , self.mtime
+            )
+
+        self.persistedSize = self.size
+        self.truncatedTo = None
+        self.dirtyChunks.clear()
+        self.dirty = False
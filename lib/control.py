@@ -0,0 +1,177 @@
+import errno
+import os
+import stat
+from time import time
+
+from fuse import FuseOSError
+
+# ---------------------------------------------------------
+# Control files.
+#
+# The mount exposes a hidden directory (/.graphfs) whose files are generated
+# from the in-memory counters of the process, without querying the graph:
+#
+#   cat /mnt/.graphfs/stats
+#
+# The directory is not listed in the root, but it can be accessed and listed.
+# The content of a file is generated when it is opened, and read with direct I/O
+# as its size is not known in advance. Some files accept writes, which trigger
+# an action (e.g. writing to the cache file drops the caches).
+
+CONTROL_ROOT = "/.graphfs"
+
+def formatCounters(title, counters):
+    """
+    Format a dict of counters as a single line: title key value key value ...
+    """
+    return title + "".join(
+        " {} {}".format(key, "{:.3f}".format(value) if isinstance(value, float) else value)
+        for key, value in counters.items()) + "\n"
+
+class ControlHandle(object):
+    """
+    State of an open control file: the content generated at open.
+    """
+
+    def __init__(self, fh, name, data):
+        self.fh = fh
+        self.name = name
+        self.data = data
+
+class ControlFiles(object):
+    """
+    Serve the FUSE operations on the control namespace.
+    files maps the name of each control file to a function returning its content (a string);
+    writers maps the names of the writable files to the function called with the written bytes.
+    Handles are allocated from the HandleTable of the mount.
+    """
+
+    def __init__(self, handles, files, writers = None):
+        self.handles = handles
+        self.files = dict(files)
+        self.writers = dict(writers or {})
+        self.mountTime = time()
+
+    def owns(self, path):
+        return path == CONTROL_ROOT or path.startswith(CONTROL_ROOT + "/")
+
+    def __name(self, path):
+        """
+        Return the name of the control file (None for the directory itself).
+        """
+        if path == CONTROL_ROOT:
+            return None
+
+        name = path[len(CONTROL_ROOT) + 1:]
+        if name not in self.files:
+            raise FuseOSError(errno.ENOENT)
+
+        return name
+
+    def __generate(self, name):
+        return self.files[name]().encode("utf-8")
+
+    def __handle(self, fh):
+        handle = self.handles.get(fh)
+
+        if not isinstance(handle, ControlHandle):
+            raise FuseOSError(errno.EBADF)
+
+        return handle
+
+    def __attrs(self, mode, size):
+        return dict(
+            st_mode = mode
+            , st_nlink = 2 if stat.S_ISDIR(mode) else 1
+            , st_size = size
+            , st_ctime = self.mountTime
+            , st_mtime = time()
+            , st_atime = time()
+            , st_uid = os.getuid()
+            , st_gid = os.getgid()
+        )
+
+    # Operations
+    # ==========
+
+    def __call__(self, op, *args):
+        if not hasattr(self, op) or op.startswith("_"):
+            # Everything else (mkdir, unlink, rename, ...) is not allowed in the namespace
+            raise FuseOSError(errno.EACCES)
+
+        return getattr(self, op)(*args)
+
+    def getattr(self, path, fh = None):
+        name = self.__name(path)
+
+        if name is None:
+            return self.__attrs(stat.S_IFDIR | 0o555, 0)
+
+        mode = 0o644 if name in self.writers else 0o444
+        return self.__attrs(stat.S_IFREG | mode, len(self.__generate(name)))
+
+    def access(self, path, mode):
+        name = self.__name(path)
+
+        if mode & os.W_OK and name not in self.writers:
+            raise FuseOSError(errno.EACCES)
+
+        return 0
+
+    def opendir(self, path):
+        if self.__name(path) is not None:
+            raise FuseOSError(errno.ENOTDIR)
+        return 0
+
+    def releasedir(self, path, fh):
+        return 0
+
+    def readdir(self, path, fh = None, offset = 0):
+        if self.__name(path) is not None:
+            raise FuseOSError(errno.ENOTDIR)
+
+        entries = ['.', '..'] + sorted(self.files)
+        for index in range(offset, len(entries)):
+            yield (entries[index], None, index + 1)
+
+    def open(self, path, flags):
+        name = self.__name(path)
+
+        if name is None:
+            raise FuseOSError(errno.EISDIR)
+
+        if flags & os.O_ACCMODE != os.O_RDONLY and name not in self.writers:
+            raise FuseOSError(errno.EACCES)
+
+        return self.handles.add(ControlHandle, name, self.__generate(name)).fh
+
+    def read(self, path, length, offset, fh):
+        return self.__handle(fh).data[offset:offset + length]
+
+    def write(self, path, buf, offset, fh):
+        handle = self.__handle(fh)
+
+        if handle.name not in self.writers:
+            raise FuseOSError(errno.EACCES)
+
+        self.writers[handle.name](buf)
+        return len(buf)
+
+    def truncate(self, path, length, fh = None):
+        # Opening a writable file with O_TRUNC (e.g. echo > file) truncates it first
+        if self.__name(path) not in self.writers:
+            raise FuseOSError(errno.EACCES)
+        return 0
+
+    def utimens(self, path, times = None):
+        return 0
+
+    def flush(self, path, fh):
+        return 0
+
+    def fsync(self, path, fdatasync, fh):
+        return 0
+
+    def release(self, path, fh):
+        self.handles.release(fh)
+        return 0
@@ -0,0 +1,102 @@
+import threading
+
+# ---------------------------------------------------------
+# Table of the open files and directories.
+#
+# open() and create() resolve the path once and store what is needed
+# to work on the file under an integer handle (fh), which FUSE then
+# passes to read, write, truncate, flush and release.
+# opendir() does the same for directories, whose handle is passed to readdir.
+
+class FileHandle(object):
+    """
+    State of an open file.
+    """
+
+    def __init__(self, fh, nodeId, name, properties, flags = 0):
+        self.fh = fh
+        # Id of the File node
+        self.nodeId = nodeId
+        # Name of the file, used to invalidate the cached metadata
+        self.name = name
+        # Size and times of the file (size, atime, mtime, ctime), as known by this mount
+        self.properties = dict(properties)
+        self.flags = flags
+        # True if the file was read through this handle and its access time has to be stored
+        self.accessed = False
+        # Content fetched ahead of the reads (see lib.prefetch), None if not used
+        self.readAhead = None
+
+class DirHandle(object):
+    """
+    State of an open directory: the resolved path and the position
+    reached by readdir, to resume a listing from an offset.
+    """
+
+    def __init__(self, fh, path, resolved):
+        self.fh = fh
+        self.path = path
+        self.resolved = resolved
+        # offset -> pagination key of the entry at that offset,
+        # for the entries returned by the last readdir call
+        self.positions = {}
+        # Names of the groups listed so far, which hide the files with the same name
+        self.groupNames = set()
+        # Sorted keys (rank, name, node id) of all the entries of the listing,
+        # computed when it starts (None until then, and for the root without membership index)
+        self.keys = None
+
+class HandleTable(object):
+    """
+    Allocate and keep track of the file handles.
+    Handles start from 1, as 0 is what FUSE passes when no handle was set.
+    The table can be shared by the threads of a multithreaded mount.
+    """
+
+    def __init__(self):
+        self.__handles = {}
+        self.__nextFh = 1
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__handles)
+
+    def add(self, handleClass, *args):
+        """
+        Allocate a handle of the given class, built as handleClass(fh, *args).
+        """
+        with self.__lock:
+            handle = handleClass(self.__nextFh, *args)
+            self.__handles[handle.fh] = handle
+            self.__nextFh += 1
+
+        return handle
+
+    def open(self, nodeId, name, properties, flags = 0):
+        return self.add(FileHandle, nodeId, name, properties, flags)
+
+    def openDir(self, path, resolved):
+        return self.add(DirHandle, path, resolved)
+
+    def get(self, fh):
+        return self.__handles.get(fh)
+
+    def release(self, fh):
+        with self.__lock:
+            return self.__handles.pop(fh, None)
+
+    def forNode(self, nodeId):
+        with self.__lock:
+            return [
+                handle for handle in self.__handles.values()
+                if isinstance(handle, FileHandle) and handle.nodeId == nodeId
+            ]
+
+    def retarget(self, nodeId, newNodeId, newName):
+        """
+        Make the handles of a file refer to another node or name
+        (e.g. after the file has been renamed).
+        """
+        for handle in self.forNode(nodeId):
+            handle.nodeId = newNodeId
+            handle.name = newName
@@ -0,0 +1,265 @@
+import logging
+import os
+import threading
+from collections import namedtuple
+from queue import Queue
+from time import time, monotonic, sleep
+
+from lib.content import splitInChunks
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------------
+# Bulk import of files and groups.
+#
+# Populating the graph through FUSE costs a create() and a query per group
+# for every file. The importer reads (file, groups) records from a host
+# directory or from a manifest and writes them with batched UNWIND queries,
+# each batch in its own transaction, spread over parallel workers.
+#
+# Names are unique per label: a file found more than once is a single
+# File node belonging to all the groups of its occurrences. Records are
+# assigned to the workers by name, so the same file is always written by
+# the same worker and concurrent transactions never race to create it.
+
+DEFAULT_BATCH_SIZE = 5000 # Files per transaction
+DEFAULT_BATCH_BYTES = 64 * 1024 * 1024 # Content per transaction
+DEFAULT_WORKERS = 4
+DEFAULT_RETRIES = 5 # Attempts after a failed transaction (e.g. a deadlock on a group)
+DEFAULT_REPORT_INTERVAL = 5.0 # Seconds
+
+# A file to import:
+# - name: the name of the file
+# - groupIDs: the names of its groups
+# - hostPath: the file on the host the content and times are read from (None for manifests)
+ImportRecord = namedtuple("ImportRecord", ["name", "groupIDs", "hostPath"])
+
+class BulkImportError(Exception):
+    pass
+
+# ---------------------------------------------------------
+# Sources
+
+def walkDirectory(root):
+    """
+    Yield a record for every file under root. The folders of the path of a file
+    relative to root are its groups: a/b/c.txt is the file c.txt in the groups a and b.
+    """
+    root = os.path.abspath(root)
+
+    for dirPath, dirNames, fileNames in os.walk(root):
+        dirNames.sort()
+
+        relative = os.path.relpath(dirPath, root)
+        groupIDs = [] if relative == os.curdir else list(dict.fromkeys(relative.split(os.sep)))
+
+        for fileName in sorted(fileNames):
+            hostPath = os.path.join(dirPath, fileName)
+            if os.path.isfile(hostPath):
+                yield ImportRecord(fileName, groupIDs, hostPath)
+
+def readManifest(lines):
+    """
+    Yield a record for every line of a manifest: the name of a file followed by
+    the names of its groups, separated by tabs.
+    Empty lines and lines starting with # are skipped.
+    """
+    for number, line in enumerate(lines, 1):
+        line = line.rstrip("\r\n")
+        if not line.strip() or line.startswith("#"):
+            continue
+
+        elements = [element.strip() for element in line.split("\t")]
+        if not elements[0] or any("/" in element for element in elements):
+            raise BulkImportError("Invalid name at line {} of the manifest.".format(number))
+
+        yield ImportRecord(elements[0], list(dict.fromkeys(e for e in elements[1:] if e)), None)
+
+# ---------------------------------------------------------
+
+class ImportStats(object):
+    """
+    Counters of an import, updated by the workers.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = monotonic()
+        self.files = 0
+        self.links = 0
+        self.bytes = 0
+        self.failed = 0
+
+    def add(self, files = 0, links = 0, size = 0, failed = 0):
+        with self.lock:
+            self.files += files
+            self.links += links
+            self.bytes += size
+            self.failed += failed
+
+    def report(self):
+        with self.lock:
+            elapsed = max(monotonic() - self.start, 1e-9)
+            return "{} files, {} group links, {:.1f} MB in {:.1f}s ({:.0f} files/s, {:.1f} MB/s){}".format(
+                self.files, self.links, self.bytes / 2**20, elapsed
+                , self.files / elapsed, self.bytes / 2**20 / elapsed
+                , ", {} failed".format(self.failed) if self.failed else "")
+
+class BulkImporter(object):
+    """
+    Write import records to the graph through the named queries of lib.queries.
+    With withContent, the content of the host files is imported too.
+    """
+
+    def __init__(self, queries
+        , batchSize = DEFAULT_BATCH_SIZE
+        , batchBytes = DEFAULT_BATCH_BYTES
+        , workers = DEFAULT_WORKERS
+        , withContent = False
+        , retries = DEFAULT_RETRIES
+        , reportInterval = DEFAULT_REPORT_INTERVAL):
+
+        self.queries = queries
+        self.batchSize = batchSize
+        self.batchBytes = batchBytes
+        self.workers = max(1, workers)
+        self.withContent = withContent
+        self.retries = retries
+        self.reportInterval = reportInterval
+
+    def run(self, records):
+        """
+        Import the records and return the ImportStats.
+        Raises BulkImportError if some batches could not be written.
+        """
+        stats = ImportStats()
+        errors = []
+
+        # Small queues keep the reading of the records just ahead of the workers
+        queues = [Queue(maxsize = 2) for _ in range(self.workers)]
+        threads = [
+            threading.Thread(target = self.__work, args = (queue, stats, errors), name = "import-{}".format(i))
+            for i, queue in enumerate(queues)
+        ]
+        for thread in threads:
+            thread.start()
+
+        batches = [[] for _ in range(self.workers)]
+        lastReport = monotonic()
+
+        try:
+            for record in records:
+                worker = hash(record.name) % self.workers
+                batches[worker].append(record)
+
+                if len(batches[worker]) >= self.batchSize:
+                    queues[worker].put(batches[worker])
+                    batches[worker] = []
+
+                if monotonic() - lastReport >= self.reportInterval:
+                    logger.info("Imported %s", stats.report())
+                    lastReport = monotonic()
+        finally:
+            for worker, batch in enumerate(batches):
+                if batch:
+                    queues[worker].put(batch)
+                queues[worker].put(None)
+
+            for thread in threads:
+                thread.join()
+
+        logger.info("Imported %s", stats.report())
+
+        if errors:
+            raise BulkImportError("{} files were not imported: {}".format(stats.failed, errors[0]))
+
+        return stats
+
+    def __work(self, queue, stats, errors):
+        """
+        Write the batches of a worker until it receives None.
+        After an error the remaining batches are only counted as failed,
+        so that the reader is never blocked on a full queue.
+        """
+        while True:
+            batch = queue.get()
+            if batch is None:
+                return
+
+            if errors:
+                stats.add(failed = len(batch))
+                continue
+
+            try:
+                self.__importBatch(batch, stats)
+            except Exception as e:
+                logger.error("Import failed: %s", e)
+                errors.append(e)
+                stats.add(failed = len(batch))
+
+    def __importBatch(self, batch, stats):
+        """
+        Write a batch of records, merging the ones with the same name.
+        The batch is split in more transactions if its content exceeds batchBytes.
+        """
+        files = {}
+        contents = {}
+        size = 0
+
+        for record in batch:
+            mtime = None
+            if record.hostPath is not None:
+                mtime = os.stat(record.hostPath).st_mtime
+
+            file = files.get(record.name)
+            if file is None:
+                files[record.name] = dict(name = record.name, groupIDs = list(record.groupIDs), mtime = mtime)
+            else:
+                file["groupIDs"].extend(g for g in record.groupIDs if g not in file["groupIDs"])
+
+            if self.withContent and record.hostPath is not None:
+                with open(record.hostPath, "rb") as f:
+                    data = f.read()
+
+                previous = contents.pop(record.name, None)
+                if previous is not None:
+                    size -= previous["size"]
+
+                contents[record.name] = dict(name = record.name, size = len(data), mtime = mtime, chunks = splitInChunks(data))
+                size += len(data)
+
+                if size >= self.batchBytes:
+                    self.__commit(files, contents, stats)
+                    files, contents, size = {}, {}, 0
+
+        if files:
+            self.__commit(files, contents, stats)
+
+    def __commit(self, files, contents, stats):
+        now = time()
+        files = list(files.values())
+        for file in files:
+            if file["mtime"] is None:
+                file["mtime"] = now
+
+        contents = list(contents.values())
+        groupIDs = sorted(set(groupId for file in files for groupId in file["groupIDs"]))
+
+        for attempt in range(self.retries + 1):
+            try:
+                with self.queries.transaction() as tx:
+                    tx.run("importGroups", groupIDs = groupIDs, now = now)
+                    tx.run("importFiles", files = files, now = now)
+                    if contents:
+                        tx.run("importContent", contents = contents)
+                break
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                logger.warning("Import transaction failed (%s), retrying", e)
+                sleep(0.1 * 2**attempt)
+
+        stats.add(
+            files = len(files)
+            , links = sum(len(file["groupIDs"]) for file in files)
+            , size = sum(content["size"] for content in contents))
@@ -0,0 +1,407 @@
+import logging
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------------
+# Local index of the membership of the files in the groups.
+#
+# A path is the intersection of its groups. Listing a directory with a query
+# walks the relationships of all the groups of the path; this index keeps in
+# memory, for every group, the bitmap of its files, so that the intersection
+# and the other groups of the matched files ("next available groups") are
+# computed with a few AND of machine words.
+#
+# Every file gets a slot, a small integer, and each group is a Bitmap of slots.
+# Bitmaps are split in containers of CONTAINER_SIZE slots (as roaring bitmaps are),
+# each a Python int, so a group holding a few files costs a few small ints
+# whatever the slots of its files.
+#
+# The index is built from the graph at mount time and kept up to date by the
+# operations of the mount, and by the ones of the other mounts read from the
+# change log (see lib.changes); the graph stays the source of truth, and the
+# metadata of the listed entries is still read from it.
+
+CONTAINER_BITS = 12
+CONTAINER_SIZE = 1 << CONTAINER_BITS
+CONTAINER_MASK = CONTAINER_SIZE - 1
+
+# Listings kept, as computing one sorts all its entries
+DEFAULT_LISTINGS = 16
+
+# Updates of the index, which the change log carries to the other mounts as [name, arguments...]
+UPDATES = frozenset(["addGroup", "removeGroup", "renameGroup", "addFile", "removeFile", "moveFile", "replaceFile"])
+
+# Positions of the bits set in each byte value
+BYTE_BITS = [[bit for bit in range(8) if value >> bit & 1] for value in range(256)]
+
+class Bitmap(object):
+    """
+    Set of non-negative integers stored as bitmap containers: high bits -> int.
+    """
+
+    __slots__ = ("containers",)
+
+    def __init__(self, containers = None):
+        self.containers = containers if containers is not None else {}
+
+    def add(self, value):
+        high = value >> CONTAINER_BITS
+        self.containers[high] = self.containers.get(high, 0) | 1 << (value & CONTAINER_MASK)
+
+    def discard(self, value):
+        high = value >> CONTAINER_BITS
+        container = self.containers.get(high, 0) & ~(1 << (value & CONTAINER_MASK))
+        if container:
+            self.containers[high] = container
+        else:
+            self.containers.pop(high, None)
+
+    def __contains__(self, value):
+        return bool(self.containers.get(value >> CONTAINER_BITS, 0) >> (value & CONTAINER_MASK) & 1)
+
+    def __len__(self):
+        return sum(bin(container).count("1") for container in self.containers.values())
+
+    def __bool__(self):
+        return bool(self.containers)
+
+    def __and__(self, other):
+        if len(other.containers) < len(self.containers):
+            self, other = other, self
+
+        containers = {}
+        for high, container in self.containers.items():
+            container &= other.containers.get(high, 0)
+            if container:
+                containers[high] = container
+
+        return Bitmap(containers)
+
+    def intersects(self, other):
+        if len(other.containers) < len(self.containers):
+            self, other = other, self
+
+        return any(container & other.containers.get(high, 0) for high, container in self.containers.items())
+
+    def __iter__(self):
+        for high in sorted(self.containers):
+            base = high << CONTAINER_BITS
+            data = self.containers[high].to_bytes(CONTAINER_SIZE // 8, "little")
+            for index, byte in enumerate(data):
+                if byte:
+                    for bit in BYTE_BITS[byte]:
+                        yield base + index * 8 + bit
+
+class MembershipIndex(object):
+    """
+    Names and node ids of the groups and of the files, and the bitmap of the files of each group.
+    Updated by the operations of the mount once the graph has been changed,
+    and shared by all the threads.
+    """
+
+    def __init__(self, listings = DEFAULT_LISTINGS):
+        # Reentrant, as the updates made while the index is loaded are applied again holding it
+        self.__lock = threading.RLock()
+        # Updates made since the index started being loaded (None when it is not loading)
+        self.__replay = None
+
+        # name -> node id, node id -> name
+        self.groupIds = {}
+        self.groupNames = {}
+        self.fileIds = {}
+        self.fileNames = {}
+
+        # group node id -> Bitmap of the slots of its files
+        self.groupFiles = {}
+        # file node id -> set of group node ids
+        self.fileGroups = {}
+
+        # file node id -> slot, slot -> file node id (None for a free slot)
+        self.fileSlots = {}
+        self.slotFiles = []
+        self.freeSlots = []
+
+        # Listings computed since the last change: key -> sorted entries
+        self.maxListings = listings
+        self.__listings = OrderedDict()
+
+    def __len__(self):
+        return len(self.fileIds)
+
+    # Building
+    # ========
+
+    def load(self, backend):
+        """
+        Build the index from the graph, replacing its content. Returns the number of files.
+
+        The graph is read without holding the lock, while the threads of the mount keep
+        updating the index: the updates made in the meanwhile are applied again to the
+        index built, as the graph may have been read before them.
+        """
+        start = monotonic()
+        with self.__lock:
+            self.__replay = []
+
+        try:
+            groups = backend.data("membershipGroups")
+            files = backend.data("membershipFiles")
+
+            with self.__lock:
+                self.build(groups, files)
+
+                replay, self.__replay = self.__replay, None
+                for update in replay:
+                    self.apply(update)
+        finally:
+            self.__replay = None
+
+        logger.info("Indexed the membership of %s files in %s groups in %.1fs"
+            , len(files), len(groups), monotonic() - start)
+        return len(files)
+
+    def build(self, groups, files):
+        """
+        Replace the content of the index with the given groups ({nodeId, name})
+        and files ({nodeId, name, groupNodeIds}), as returned by the membership operations.
+        """
+        with self.__lock:
+            self.__clear()
+
+            for group in groups:
+                self.__addGroup(group["name"], group["nodeId"])
+
+            for file in files:
+                self.__addFile(file["name"], file["nodeId"])
+                for groupId in file["groupNodeIds"]:
+                    self.__link(file["nodeId"], groupId)
+
+    def __clear(self):
+        self.groupIds.clear()
+        self.groupNames.clear()
+        self.fileIds.clear()
+        self.fileNames.clear()
+        self.groupFiles.clear()
+        self.fileGroups.clear()
+        self.fileSlots.clear()
+        self.slotFiles = []
+        self.freeSlots = []
+        self.__listings.clear()
+
+    # Updates
+    # =======
+    # Called holding the lock
+
+    def __addGroup(self, name, nodeId):
+        self.groupIds[name] = nodeId
+        self.groupNames[nodeId] = name
+        self.groupFiles.setdefault(nodeId, Bitmap())
+
+    def __addFile(self, name, nodeId):
+        if nodeId in self.fileSlots:
+            # Added again (e.g. an update applied again after a load): only the name can differ
+            self.fileIds.pop(self.fileNames[nodeId], None)
+            self.fileIds[name] = nodeId
+            self.fileNames[nodeId] = name
+            return
+
+        if self.freeSlots:
+            slot = self.freeSlots.pop()
+            self.slotFiles[slot] = nodeId
+        else:
+            slot = len(self.slotFiles)
+            self.slotFiles.append(nodeId)
+
+        self.fileIds[name] = nodeId
+        self.fileNames[nodeId] = name
+        self.fileSlots[nodeId] = slot
+        self.fileGroups.setdefault(nodeId, set())
+
+    def __removeFile(self, nodeId):
+        slot = self.fileSlots.pop(nodeId, None)
+        if slot is None:
+            return
+
+        for groupId in self.fileGroups.pop(nodeId):
+            self.groupFiles[groupId].discard(slot)
+
+        del self.fileIds[self.fileNames.pop(nodeId)]
+        self.slotFiles[slot] = None
+        self.freeSlots.append(slot)
+
+    def __link(self, fileId, groupId):
+        if fileId in self.fileSlots and groupId in self.groupFiles:
+            self.groupFiles[groupId].add(self.fileSlots[fileId])
+            self.fileGroups[fileId].add(groupId)
+
+    def __unlink(self, fileId, groupId):
+        if fileId in self.fileSlots and groupId in self.groupFiles:
+            self.groupFiles[groupId].discard(self.fileSlots[fileId])
+            self.fileGroups[fileId].discard(groupId)
+
+    def __linkNames(self, fileId, groupNames, link):
+        for groupName in groupNames:
+            groupId = self.groupIds.get(groupName)
+            if groupId is not None:
+                link(fileId, groupId)
+
+    def __record(self, *update):
+        if self.__replay is not None:
+            self.__replay.append(list(update))
+
+    def apply(self, update):
+        """
+        Apply an update given as [name, arguments...], as carried by the change log.
+        """
+        name, arguments = update[0], update[1:]
+        if name not in UPDATES:
+            raise ValueError("Unknown update of the membership index [{}].".format(name))
+
+        getattr(self, name)(*arguments)
+
+    def addGroup(self, name, nodeId):
+        with self.__lock:
+            self.__record("addGroup", name, nodeId)
+            self.__addGroup(name, nodeId)
+            self.__listings.clear()
+
+    def removeGroup(self, nodeId):
+        with self.__lock:
+            self.__record("removeGroup", nodeId)
+            name = self.groupNames.pop(nodeId, None)
+            if name is None:
+                return
+
+            del self.groupIds[name]
+            for slot in self.groupFiles.pop(nodeId):
+                self.fileGroups[self.slotFiles[slot]].discard(nodeId)
+            self.__listings.clear()
+
+    def renameGroup(self, nodeId, newName):
+        with self.__lock:
+            self.__record("renameGroup", nodeId, newName)
+            name = self.groupNames.get(nodeId)
+            if name is None:
+                return
+
+            del self.groupIds[name]
+            self.groupIds[newName] = nodeId
+            self.groupNames[nodeId] = newName
+            self.__listings.clear()
+
+    def addFile(self, name, nodeId, groupNames):
+        with self.__lock:
+            self.__record("addFile", name, nodeId, groupNames)
+            self.__addFile(name, nodeId)
+            self.__linkNames(nodeId, groupNames, self.__link)
+            self.__listings.clear()
+
+    def removeFile(self, nodeId):
+        with self.__lock:
+            self.__record("removeFile", nodeId)
+            self.__removeFile(nodeId)
+            self.__listings.clear()
+
+    def moveFile(self, nodeId, newName, oldGroupNames, newGroupNames):
+        """
+        Rename the file (unless newName is None), remove it from the groups oldGroupNames
+        and add it to the groups newGroupNames, as the moveFile operation does.
+        """
+        with self.__lock:
+            self.__record("moveFile", nodeId, newName, oldGroupNames, newGroupNames)
+            if nodeId not in self.fileSlots:
+                return
+
+            if newName is not None:
+                del self.fileIds[self.fileNames[nodeId]]
+                self.fileIds[newName] = nodeId
+                self.fileNames[nodeId] = newName
+
+            self.__linkNames(nodeId, oldGroupNames, self.__unlink)
+            self.__linkNames(nodeId, newGroupNames, self.__link)
+            self.__listings.clear()
+
+    def replaceFile(self, fromNodeId, toNodeId, groupNames):
+        """
+        Delete the file fromNodeId and add the file toNodeId to the groups groupNames,
+        as the replaceFile operation does.
+        """
+        with self.__lock:
+            self.__record("replaceFile", fromNodeId, toNodeId, groupNames)
+            self.__removeFile(fromNodeId)
+            self.__linkNames(toNodeId, groupNames, self.__link)
+            self.__listings.clear()
+
+    # Listings
+    # ========
+
+    def __entries(self, groupNames):
+        """
+        Return the entries of a directory, as sorted (rank, name, nodeId):
+        the other groups of its files (rank 0), then its files (rank 1).
+        groupNames is None for the root.
+        """
+        if groupNames is None:
+            return sorted(
+                [(0, name, nodeId) for name, nodeId in self.groupIds.items()]
+                + [(1, name, nodeId) for name, nodeId in self.fileIds.items()])
+
+        # Groups of the path, the most selective first (missing groups are ignored, as in the queries)
+        groupIds = set(self.groupIds[name] for name in groupNames if name in self.groupIds)
+        if not groupIds:
+            return []
+
+        bitmaps = sorted((self.groupFiles[groupId] for groupId in groupIds), key = len)
+        files = bitmaps[0]
+        for bitmap in bitmaps[1:]:
+            if not files:
+                break
+            files = files & bitmap
+
+        fileIds = [self.slotFiles[slot] for slot in files]
+
+        # The next available groups are the ones sharing at least a file with the path
+        if len(fileIds) < len(self.groupFiles):
+            newGroups = set()
+            for fileId in fileIds:
+                newGroups.update(self.fileGroups[fileId])
+            newGroups.difference_update(groupIds)
+        else:
+            newGroups = [
+                groupId for groupId, bitmap in self.groupFiles.items()
+                if groupId not in groupIds and files.intersects(bitmap)
+            ]
+
+        return sorted(
+            [(0, self.groupNames[groupId], groupId) for groupId in newGroups]
+            + [(1, self.fileNames[fileId], fileId) for fileId in fileIds])
+
+    def listing(self, groupNames):
+        """
+        Return all the entries of a directory, as a sorted list of (rank, name, nodeId)
+        shared with the other callers, which must not modify it.
+        """
+        key = None if groupNames is None else frozenset(groupNames)
+
+        with self.__lock:
+            entries = self.__listings.get(key)
+            if entries is None:
+                entries = self.__listings[key] = self.__entries(groupNames)
+                while len(self.__listings) > self.maxListings:
+                    self.__listings.popitem(last = False)
+            else:
+                self.__listings.move_to_end(key)
+
+        return entries
+
+    def stats(self):
+        with self.__lock:
+            return dict(
+                groups = len(self.groupIds)
+                , files = len(self.fileIds)
+                , containers = sum(len(bitmap.containers) for bitmap in self.groupFiles.values())
+                , listings = len(self.__listings)
+            )
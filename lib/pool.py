@@ -0,0 +1,74 @@
+import threading
+from contextlib import contextmanager
+from queue import LifoQueue, Empty
+
+# ---------------------------------------------------------
+# Bounded pool of connections to the graph.
+#
+# In a multithreaded mount every FUSE operation runs in its own thread.
+# Each query checks out a connection for the time it runs and gives it back,
+# so concurrent clients run their queries in parallel, while the number of
+# connections (and Bolt sessions) open at the same time stays bounded.
+
+DEFAULT_POOL_SIZE = 8
+
+class ConnectionPool(object):
+    """
+    Pool of at most size connections, created on demand by factory.
+    Idle connections are reused, the most recently used first.
+    """
+
+    def __init__(self, factory, size = DEFAULT_POOL_SIZE):
+
+        if size < 1:
+            raise ValueError("The pool must hold at least one connection.")
+
+        self.factory = factory
+        self.size = size
+
+        self.__idle = LifoQueue()
+        self.__slots = threading.BoundedSemaphore(size)
+
+        self.__lock = threading.Lock()
+        self.created = 0
+        self.checkouts = 0
+        self.waits = 0
+
+    @contextmanager
+    def connection(self):
+        """
+        Check out a connection for the duration of a block,
+        waiting for one to be given back if all of them are in use.
+        """
+        if not self.__slots.acquire(blocking = False):
+            with self.__lock:
+                self.waits += 1
+            self.__slots.acquire()
+
+        try:
+            try:
+                connection = self.__idle.get_nowait()
+            except Empty:
+                connection = self.factory()
+                with self.__lock:
+                    self.created += 1
+
+            with self.__lock:
+                self.checkouts += 1
+
+            try:
+                yield connection
+            finally:
+                self.__idle.put(connection)
+        finally:
+            self.__slots.release()
+
+    def stats(self):
+        with self.__lock:
+            return dict(
+                size = self.size
+                , created = self.created
+                , idle = self.__idle.qsize()
+                , checkouts = self.checkouts
+                , waits = self.waits
+            )
@@ -0,0 +1,160 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from lib.content import CHUNK_SIZE, sliceChunks
+
+# ---------------------------------------------------------
+# Read-ahead of the content of the open files.
+#
+# A read waiting for the graph leaves the reader idle for a whole round trip.
+# When a file is opened, and while it is read sequentially, the chunks
+# following the last read are fetched in background by a pool of workers,
+# so that the next reads find them already loaded.
+# The read-ahead window starts small and doubles at every sequential read,
+# up to a maximum; a read at another offset resets it.
+
+DEFAULT_PREFETCH_WORKERS = 4
+DEFAULT_READ_AHEAD_CHUNKS = 16 # Maximum window, in chunks
+INITIAL_READ_AHEAD_CHUNKS = 2 # Window on open and after a random read
+
+class ReadAhead(object):
+    """
+    Read-ahead state of an open file: the chunks being fetched or already fetched
+    (index -> future of (size, chunks) as returned by ChunkedContent.readChunks),
+    bounded by the window.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = OrderedDict()
+        # Offset the next read starts from if the file is read sequentially
+        self.nextOffset = 0
+        self.window = INITIAL_READ_AHEAD_CHUNKS
+
+    def clear(self):
+        """
+        Forget the fetched chunks, e.g. because the file was modified.
+        """
+        with self.lock:
+            for future in self.pending.values():
+                future.cancel()
+            self.pending.clear()
+
+class Prefetcher(object):
+    """
+    Serve the reads of the open files through their ReadAhead,
+    fetching the following chunks in background.
+    """
+
+    def __init__(self, content
+        , workers = DEFAULT_PREFETCH_WORKERS
+        , maxWindow = DEFAULT_READ_AHEAD_CHUNKS):
+
+        self.content = content
+        self.maxWindow = max(1, maxWindow)
+        self.executor = ThreadPoolExecutor(max_workers = workers)
+
+        self.__lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __schedule(self, readAhead, nodeId, size, firstChunk):
+        """
+        Fetch in background the chunks of the window starting from firstChunk
+        which are not already being fetched. Called holding the lock of readAhead.
+        """
+        lastChunk = min(firstChunk + readAhead.window, (size + CHUNK_SIZE - 1) // CHUNK_SIZE) - 1
+
+        indexes = [index for index in range(firstChunk, lastChunk + 1) if index not in readAhead.pending]
+        if not indexes:
+            return
+
+        # A single query for the whole window
+        future = self.executor.submit(self.content.readChunks, nodeId, indexes)
+        for index in indexes:
+            readAhead.pending[index] = future
+
+        # Keep the buffer bounded
+        while len(readAhead.pending) > 2 * self.maxWindow:
+            readAhead.pending.popitem(last = False)
+
+    def start(self, readAhead, nodeId, size):
+        """
+        Start fetching the beginning of a file that has just been opened.
+        """
+        with readAhead.lock:
+            self.__schedule(readAhead, nodeId, size, 0)
+
+    def read(self, readAhead, nodeId, size, length, offset):
+        """
+        Return the bytes [offset, offset + length) of the file, using the prefetched
+        chunks and fetching the missing ones. size is the size of the file as known
+        by the mount, used to bound the read-ahead.
+        """
+        if length <= 0:
+            return b""
+
+        firstChunk = offset // CHUNK_SIZE
+        lastChunk = (offset + length - 1) // CHUNK_SIZE
+        indexes = range(firstChunk, lastChunk + 1)
+
+        with readAhead.lock:
+            futures = dict(
+                (index, readAhead.pending.pop(index))
+                for index in indexes
+                if index in readAhead.pending
+            )
+
+            # The chunks before the read are not going to be needed
+            for index in [index for index in readAhead.pending if index < firstChunk]:
+                del readAhead.pending[index]
+
+            sequential = offset == readAhead.nextOffset
+            readAhead.nextOffset = offset + length
+
+        # Chunks of the range which have been prefetched (a missing chunk is a hole)
+        chunks = {}
+        covered = set()
+        fetchedSize = None
+
+        for index, future in futures.items():
+            try:
+                fetchedSize, fetched = future.result()
+            except Exception:
+                # Cancelled or failed: fetched again below
+                continue
+
+            covered.add(index)
+            if index in fetched:
+                chunks[index] = fetched[index]
+
+        missing = [index for index in indexes if index not in covered]
+
+        with self.__lock:
+            self.hits += len(covered)
+            self.misses += len(missing)
+
+        if missing:
+            fetchedSize, fetched = self.content.readChunks(nodeId, missing)
+            chunks.update(fetched)
+
+        with readAhead.lock:
+            if sequential:
+                readAhead.window = min(readAhead.window * 2, self.maxWindow)
+                self.__schedule(readAhead, nodeId, max(size, fetchedSize), lastChunk + 1)
+            else:
+                readAhead.window = INITIAL_READ_AHEAD_CHUNKS
+
+        return sliceChunks(chunks, fetchedSize, offset, length)
+
+    def stats(self):
+        with self.__lock:
+            return dict(
+                hits = self.hits
+                , misses = self.misses
+                , maxWindow = self.maxWindow
+            )
+
+    def shutdown(self):
+        self.executor.shutdown(wait = False)
@@ -0,0 +1,355 @@
+from contextlib import contextmanager, nullcontext
+
+# ---------------------------------------------------------
+# Named Cypher templates used by GraphFS.
+#
+# Names and contents are always passed as parameters and never formatted
+# into the text of a query: each template is parsed and planned once by Neo4j
+# and its plan is reused for every call, large payloads travel as parameters,
+# and quotes in names or contents cannot break (or inject into) a query.
+
+TEMPLATES = dict(
+
+    # Paths
+    # =====
+
+    # Checks in a single round trip that all the parent elements are groups
+    # and whether the last element is a group or a file.
+    # Names are unique per label, so counting the distinct matched groups
+    # is enough to know if all of them exist.
+    resolvePath = """OPTIONAL MATCH (g:Group) WHERE g.name IN $groupIDs
+        WITH count(DISTINCT g) AS foundGroups
+        OPTIONAL MATCH (lg:Group {name: $lastId})
+        OPTIONAL MATCH (lf:File {name: $lastId})
+        RETURN foundGroups
+            , id(lg) AS groupNodeId, lg {.mtime, .ctime} AS groupProperties
+            , id(lf) AS fileNodeId, lf {.size, .atime, .mtime, .ctime} AS fileProperties"""
+
+    # Update the times of a group or a file, leaving unchanged the ones passed as null
+    , setTimes = """MATCH (n) WHERE id(n) = $nodeId
+        SET n.atime = coalesce($atime, n.atime)
+            , n.mtime = coalesce($mtime, n.mtime)
+            , n.ctime = coalesce($ctime, n.ctime)"""
+
+    # Groups
+    # ======
+
+    , createGroup = "CREATE (g:Group {name: $groupId, mtime: $now, ctime: $now}) RETURN id(g)"
+
+    , countGroupFiles = "MATCH (g:Group) WHERE id(g) = $nodeId RETURN size((g)<-[:isInGroup]-(:File))"
+
+    , deleteGroup = "MATCH (g:Group) WHERE id(g) = $nodeId DELETE g"
+
+    , renameGroup = "MATCH (g:Group) WHERE id(g) = $nodeId SET g.name = $newGroupId, g.ctime = $now"
+
+    # Files
+    # =====
+
+    , createFile = """CREATE (f:File {name: $fileId, size: 0, atime: $now, mtime: $now, ctime: $now})
+        RETURN id(f)"""
+
+    # Add the file to all the given groups
+    , linkFile = """MATCH (f:File) WHERE id(f) = $nodeId
+        UNWIND $groupIDs AS groupId
+        MATCH (g:Group {name: groupId})
+        MERGE (f)-[:isInGroup]->(g)"""
+
+    # Rename the file (unless $newFileId is null), remove it from the groups $oldGroupIDs
+    # and add it to the groups $newGroupIDs
+    , moveFile = """MATCH (f:File) WHERE id(f) = $nodeId
+        SET f.name = coalesce($newFileId, f.name), f.ctime = $now
+        WITH f
+        OPTIONAL MATCH (f)-[r:isInGroup]->(g:Group)
+        WHERE g.name IN $oldGroupIDs
+        DELETE r
+        WITH DISTINCT f
+        UNWIND $newGroupIDs AS groupId
+        MATCH (g:Group {name: groupId})
+        MERGE (f)-[:isInGroup]->(g)"""
+
+    # Rename a file over an existing one: the content of the first file replaces the one
+    # of the second (the chunks are relinked, not copied), the first file is deleted
+    # and the second one is added to the groups $groupIDs
+    , replaceFile = """MATCH (fOld:File), (fNew:File) WHERE id(fOld) = $fromNodeId AND id(fNew) = $toNodeId
+        OPTIONAL MATCH (fNew)-[:hasChunk]->(c:Chunk)
+        DETACH DELETE c
+        WITH DISTINCT fOld, fNew
+        SET fNew.size = coalesce(fOld.size, 0)
+            , fNew.mtime = fOld.mtime
+            , fNew.ctime = $now
+        WITH fOld, fNew
+        OPTIONAL MATCH (fOld)-[r:hasChunk]->(c:Chunk)
+        WITH fOld, fNew, collect(r) AS links, collect(c) AS chunks
+        FOREACH (c IN chunks | CREATE (fNew)-[:hasChunk]->(c))
+        FOREACH (r IN links | DELETE r)
+        DETACH DELETE fOld
+        WITH fNew
+        UNWIND $groupIDs AS groupId
+        MATCH (g:Group {name: groupId})
+        MERGE (fNew)-[:isInGroup]->(g)"""
+
+    # Delete the file together with its chunks and relationships
+    , deleteFile = """MATCH (f:File) WHERE id(f) = $nodeId
+        OPTIONAL MATCH (f)-[:hasChunk]->(c:Chunk)
+        DETACH DELETE c, f"""
+
+    # Directory listings
+    # ==================
+
+    # Listings are paginated with a key (rank, name): groups (rank 0) come before files (rank 1),
+    # both ordered by name. Each page starts after the last entry of the previous one
+    # and holds at most $limit entries.
+
+    # Groups and files of the root: each kind is paginated on its own,
+    # so that every page is an index range scan on the names
+    , readdirRootGroups = """MATCH (g:Group) WHERE g.name > $lastName
+        RETURN g.name AS name, 'group' AS kind, 0 AS rank, id(g) AS nodeId, g {.mtime, .ctime} AS properties
+        ORDER BY name
+        LIMIT $limit"""
+
+    , readdirRootFiles = """MATCH (f:File) WHERE f.name > $lastName
+        RETURN f.name AS name, 'file' AS kind, 1 AS rank, id(f) AS nodeId, f {.size, .atime, .mtime, .ctime} AS properties
+        ORDER BY name
+        LIMIT $limit"""
+
+    # Keys (rank, name, node id) of the entries of a directory: the files belonging to all the
+    # groups of the path, and the other groups of those files. The keys of a listing are computed
+    # once, and its metadata is then read a page at a time with nodeProperties.
+    # The intersection starts from the group with the fewest files (the most selective),
+    # and every candidate file is checked against the remaining groups,
+    # so the size of the intermediate results is bounded by the smallest group.
+    , readdirKeys = """UNWIND $groupIDs AS groupId
+        MATCH (g:Group {name: groupId})
+        WITH g ORDER BY size((g)<-[:isInGroup]-()) ASC
+        WITH collect(g) AS groups
+        WITH head(groups) AS seed, tail(groups) AS others
+        MATCH (seed)<-[:isInGroup]-(f:File)
+        WHERE all(other IN others WHERE (f)-[:isInGroup]->(other))
+        WITH collect(f) AS files
+        UNWIND files AS f
+        OPTIONAL MATCH (f)-[:isInGroup]->(gNew:Group)
+        WHERE NOT gNew.name IN $groupIDs
+        WITH files, collect(DISTINCT gNew) AS newGroups
+        UNWIND [g IN newGroups | {rank: 0, name: g.name, nodeId: id(g)}]
+            + [f IN files | {rank: 1, name: f.name, nodeId: id(f)}] AS entry
+        RETURN entry.rank AS rank, entry.name AS name, entry.nodeId AS nodeId"""
+
+    # Metadata of a page of entries (missing nodes are skipped)
+    , nodeProperties = """UNWIND $nodeIds AS nodeId
+        MATCH (n) WHERE id(n) = nodeId
+        RETURN nodeId, n {.size, .atime, .mtime, .ctime} AS properties"""
+
+    # Content
+    # =======
+
+    , readRange = """MATCH (f:File) WHERE id(f) = $nodeId
+        OPTIONAL MATCH (f)-[:hasChunk]->(c:Chunk)
+        WHERE c.index >= $firstChunk AND c.index <= $lastChunk
+        RETURN coalesce(f.size, 0) AS size, c.index AS index, c.data AS data"""
+
+    , readChunks = """MATCH (f:File) WHERE id(f) = $nodeId
+        OPTIONAL MATCH (f)-[:hasChunk]->(c:Chunk)
+        WHERE c.index IN $indexes
+        RETURN coalesce(f.size, 0) AS size, c.index AS index, c.data AS data"""
+
+    , writeChunks = """MATCH (f:File) WHERE id(f) = $nodeId
+        SET f.size = CASE WHEN coalesce(f.size, 0) < $end THEN $end ELSE f.size END
+            , f.mtime = $mtime
+            , f.ctime = $mtime
+        WITH f
+        UNWIND $chunks AS chunk
+        MERGE (f)-[:hasChunk]->(c:Chunk {index: chunk.index})
+        SET c.data = chunk.data"""
+
+    , truncateContent = """MATCH (f:File) WHERE id(f) = $nodeId
+        SET f.size = $length
+            , f.mtime = $mtime
+            , f.ctime = $mtime
+        WITH f
+        OPTIONAL MATCH (f)-[:hasChunk]->(c:Chunk)
+        WHERE c.index >= $firstDroppedChunk
+        DETACH DELETE c
+        WITH DISTINCT f
+        UNWIND $chunks AS chunk
+        MATCH (f)-[:hasChunk]->(c:Chunk {index: chunk.index})
+        SET c.data = chunk.data"""
+
+    # firstDroppedChunk is null when the file was not truncated
+    , flushContent = """MATCH (f:File) WHERE id(f) = $nodeId
+        SET f.size = $size
+            , f.mtime = $mtime
+            , f.ctime = $mtime
+        WITH f
+        OPTIONAL MATCH (f)-[:hasChunk]->(c:Chunk)
+        WHERE c.index >= $firstDroppedChunk
+        DETACH DELETE c
+        WITH DISTINCT f
+        UNWIND $chunks AS chunk
+        MERGE (f)-[:hasChunk]->(c:Chunk {index: chunk.index})
+        SET c.data = chunk.data"""
+
+    , replaceContent = """MATCH (f:File) WHERE id(f) = $nodeId
+        OPTIONAL MATCH (f)-[:hasChunk]->(c:Chunk)
+        DETACH DELETE c
+        WITH DISTINCT f
+        SET f.size = $size
+        REMOVE f.value
+        WITH f
+        UNWIND $chunks AS chunk
+        CREATE (f)-[:hasChunk]->(:Chunk {index: chunk.index, data: chunk.data})"""
+
+    # Bulk import
+    # ===========
+
+    , importGroups = """UNWIND $groupIDs AS groupId
+        MERGE (g:Group {name: groupId})
+        ON CREATE SET g.mtime = $now, g.ctime = $now"""
+
+    # Create the files that do not exist yet and add them to their groups
+    , importFiles = """UNWIND $files AS file
+        MERGE (f:File {name: file.name})
+        ON CREATE SET f.size = 0, f.atime = file.mtime, f.mtime = file.mtime, f.ctime = $now
+        WITH f, file
+        UNWIND file.groupIDs AS groupId
+        MATCH (g:Group {name: groupId})
+        MERGE (f)-[:isInGroup]->(g)"""
+
+    # Replace the content of the files
+    , importContent = """UNWIND $contents AS content
+        MATCH (f:File {name: content.name})
+        SET f.size = content.size, f.mtime = content.mtime
+        WITH f, content
+        OPTIONAL MATCH (f)-[:hasChunk]->(c:Chunk)
+        DETACH DELETE c
+        WITH DISTINCT f, content
+        UNWIND content.chunks AS chunk
+        CREATE (f)-[:hasChunk]->(:Chunk {index: chunk.index, data: chunk.data})"""
+
+    # Files whose content is still stored as a single string
+    , legacyFiles = "MATCH (f:File) WHERE exists(f.value) RETURN id(f) AS nodeId, f.value AS value"
+
+    # Format of the content, recorded on a single node once the legacy files are migrated
+    , contentFormat = "OPTIONAL MATCH (m:GraphFS {id: 0}) RETURN m.contentFormat AS format"
+
+    , setContentFormat = "MERGE (m:GraphFS {id: 0}) SET m.contentFormat = $format"
+
+    # Membership index
+    # ================
+
+    , membershipGroups = "MATCH (g:Group) RETURN id(g) AS nodeId, g.name AS name"
+
+    , membershipFiles = """MATCH (f:File)
+        RETURN id(f) AS nodeId, f.name AS name, [(f)-[:isInGroup]->(g:Group) | id(g)] AS groupNodeIds"""
+
+    # Id of the last committed transaction, which changes with every write to the graph
+    , graphVersion = """CALL dbms.queryJmx("org.neo4j:instance=kernel#0,name=Transactions") YIELD attributes
+        RETURN attributes.LastCommittedTxId.value AS version"""
+
+    # Change log
+    # ==========
+
+    # The sequence number is a counter on a single node: incrementing it locks the node
+    # until the commit, so the changes are committed in the order of their numbers
+    , recordChange = """MERGE (l:ChangeLog {id: 0})
+        ON CREATE SET l.seq = 0
+        SET l.seq = l.seq + 1
+        CREATE (:Change {seq: l.seq, mount: $mount, names: $names, nodeIds: $nodeIds
+            , structural: $structural, update: $update, time: $now})"""
+
+    , changesSince = """MATCH (c:Change) WHERE c.seq > $after
+        RETURN c.seq AS seq, c.mount AS mount, c.names AS names, c.nodeIds AS nodeIds, c.structural AS structural
+            , c.update AS update
+        ORDER BY seq LIMIT $limit"""
+
+    , lastChange = "OPTIONAL MATCH (l:ChangeLog {id: 0}) RETURN coalesce(l.seq, 0) AS seq"
+
+    # The last change is always kept, so that a mount which missed the pruned ones notices the gap
+    , pruneChanges = """MATCH (l:ChangeLog {id: 0})
+        MATCH (c:Change) WHERE c.time < $before AND c.seq < l.seq
+        DELETE c"""
+)
+
+# ---------------------------------------------------------
+
+class Queries(object):
+    """
+    Run the named templates against a py2neo Graph,
+    or against one of its transactions (see transaction()).
+    With a pool (see lib.pool), every query checks out its own connection
+    instead of sharing the graph, so the queries can run from many threads.
+    With stats (see lib.stats), every round trip is measured.
+    """
+
+    def __init__(self, graph = None, pool = None, stats = None):
+
+        if (graph is None) == (pool is None):
+            raise ValueError("Either a graph or a pool is required.")
+
+        self.graph = graph
+        self.pool = pool
+        self.stats = stats
+
+    def __measure(self, name):
+        if self.stats is None:
+            return nullcontext()
+        return self.stats.query(name)
+
+    @contextmanager
+    def __connection(self):
+        if self.pool is None:
+            yield self.graph
+        else:
+            with self.pool.connection() as graph:
+                yield graph
+
+    def __template(self, name):
+        try:
+            return TEMPLATES[name]
+        except KeyError:
+            raise ValueError("Unknown query [{}].".format(name))
+
+    def run(self, name, **parameters):
+        """
+        Run the query, discarding its results.
+        """
+        with self.__connection() as graph, self.__measure(name):
+            graph.run(self.__template(name), **parameters)
+
+    def data(self, name, **parameters):
+        """
+        Run the query and return its records as a list of dicts.
+        """
+        with self.__connection() as graph, self.__measure(name):
+            return graph.run(self.__template(name), **parameters).data()
+
+    def evaluate(self, name, **parameters):
+        """
+        Run the query and return the first value of the first record (None if there are no records).
+        """
+        with self.__connection() as graph, self.__measure(name):
+            return graph.evaluate(self.__template(name), **parameters)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Run the queries of a block in a single explicit transaction:
+
+            with queries.transaction() as tx:
+                tx.run(...)
+
+        The transaction is committed at the end of the block,
+        and rolled back if the block raises.
+        """
+        with self.__connection() as graph:
+            with self.__measure("begin"):
+                tx = graph.begin()
+
+            try:
+                yield Queries(tx, stats = self.stats)
+            except BaseException:
+                with self.__measure("rollback"):
+                    tx.rollback()
+                raise
+
+            with self.__measure("commit"):
+                tx.commit()
@@ -0,0 +1,123 @@
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------------
+# Schema of the graph.
+#
+# Every lookup matches groups and files by name, so each label used
+# to identify nodes needs a uniqueness constraint on its key
+# (which also creates the index backing the lookups).
+
+# Modes of SchemaManager.ensure
+SCHEMA_CREATE = "create" # Create the missing constraints
+SCHEMA_WARN = "warn" # Only report the problems
+SCHEMA_REFUSE = "refuse" # Raise an error if something is missing
+
+SCHEMA_MODES = (SCHEMA_CREATE, SCHEMA_WARN, SCHEMA_REFUSE)
+
+INDEXES_QUERY = "CALL db.indexes() YIELD description, state, type RETURN description, state, type"
+CREATE_CONSTRAINT_QUERY = "CREATE CONSTRAINT ON (n:{label}) ASSERT n.{key} IS UNIQUE"
+DROP_INDEX_QUERY = "DROP INDEX ON :{label}({key})"
+DROP_CONSTRAINT_QUERY = "DROP CONSTRAINT ON (n:{label}) ASSERT n.{key} IS UNIQUE"
+AWAIT_INDEXES_QUERY = "CALL db.awaitIndexes($timeout)"
+
+# The description of an index looks like "INDEX ON :Group(name)"
+INDEX_DESCRIPTION = re.compile(r":`?(\w+)`?\(`?(\w+)`?\)")
+
+INDEX_ONLINE = "ONLINE"
+INDEX_UNIQUE = "node_unique_property"
+
+class SchemaError(Exception):
+    pass
+
+class SchemaManager(object):
+    """
+    Verify and create the uniqueness constraints required by GraphFS.
+    keys is a list of (label, property) pairs, e.g. [("Group", "name"), ("File", "name")].
+    """
+
+    def __init__(self, graph, keys, awaitTimeout = 300):
+        self.graph = graph
+        self.keys = list(keys)
+        self.awaitTimeout = awaitTimeout
+
+    def indexes(self):
+        """
+        Return a dict (label, property) -> (state, unique) of the existing indexes.
+        """
+        indexes = {}
+
+        for record in self.graph.run(INDEXES_QUERY).data():
+            match = INDEX_DESCRIPTION.search(record["description"])
+            if match is None:
+                continue
+            indexes[match.groups()] = (record["state"], record["type"] == INDEX_UNIQUE)
+
+        return indexes
+
+    def verify(self):
+        """
+        Return the list of problems found as tuples (label, property, problem),
+        where problem is one of "missing", "not unique" or the state of an index which is not online.
+        An empty list means the schema is fine.
+        """
+        indexes = self.indexes()
+        problems = []
+
+        for label, key in self.keys:
+            if (label, key) not in indexes:
+                problems.append((label, key, "missing"))
+                continue
+
+            state, unique = indexes[(label, key)]
+            if not unique:
+                problems.append((label, key, "not unique"))
+            elif state != INDEX_ONLINE:
+                problems.append((label, key, state))
+
+        return problems
+
+    def create(self, problems):
+        """
+        Fix the given problems: stale indexes are dropped and
+        the missing uniqueness constraints are created.
+        """
+        for label, key, problem in problems:
+            if problem == "not unique":
+                self.graph.run(DROP_INDEX_QUERY.format(label = label, key = key))
+            elif problem != "missing":
+                self.graph.run(DROP_CONSTRAINT_QUERY.format(label = label, key = key))
+
+            logger.info("Create uniqueness constraint on :%s(%s)", label, key)
+            self.graph.run(CREATE_CONSTRAINT_QUERY.format(label = label, key = key))
+
+        self.graph.run(AWAIT_INDEXES_QUERY, timeout = self.awaitTimeout)
+
+    def ensure(self, mode = SCHEMA_CREATE):
+        """
+        Check the schema at mount time and act according to mode.
+        Returns the problems that are left.
+        """
+        if mode not in SCHEMA_MODES:
+            raise ValueError("Unknown schema mode [{}].".format(mode))
+
+        problems = self.verify()
+
+        if problems and mode == SCHEMA_CREATE:
+            try:
+                self.create(problems)
+            except Exception as e:
+                # e.g. duplicated names prevent the creation of the constraint
+                logger.warning("Cannot create the constraints: %s", e)
+            problems = self.verify()
+
+        for label, key, problem in problems:
+            logger.warning("Index on :%s(%s) is %s: lookups will scan all the nodes", label, key, problem)
+
+        if problems and mode == SCHEMA_REFUSE:
+            raise SchemaError("The graph is missing the required indexes: {}".format(
+                ", ".join(":{}({}) {}".format(*problem) for problem in problems)))
+
+        return problems
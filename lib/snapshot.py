@@ -0,0 +1,180 @@
+import logging
+import mmap
+import os
+import struct
+import sys
+from array import array
+from time import monotonic
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------------
+# Snapshot of the membership index on disk.
+#
+# Loading the membership index (see lib.membership) scans every group and file
+# of the graph, so that a mount with the index starts cold. The snapshot keeps
+# on disk what the scan returns: the node ids and names of the groups and of
+# the files, and the groups of each file. It is written on unmount and read
+# back at the next mount, provided that the graph has not changed since:
+# the snapshot records the version of the graph it was taken at (e.g. the last
+# committed transaction), compared at mount with the current one.
+#
+# The file is a header followed by flat arrays, read through a memory map
+# without parsing:
+#
+#   header        MAGIC, byte order, version length, groups, files, memberships
+#   version       the version of the graph, as text
+#   groupIds      int64 per group
+#   groupNames    uint64 offsets (groups + 1), then the UTF-8 names
+#   fileIds       int64 per file
+#   fileNames     uint64 offsets (files + 1), then the UTF-8 names
+#   fileGroups    uint64 offsets (files + 1), then a uint32 group index per membership
+#
+# Every array starts at a multiple of 8 bytes, so that it can be cast in place.
+
+MAGIC = b"GRAPHFS\x01"
+HEADER = struct.Struct("=8s1s3xIQQQ") # 40 bytes
+BYTE_ORDERS = dict(little = b"<", big = b">")
+
+class SnapshotError(Exception):
+    pass
+
+def padding(size):
+    return -size % 8
+
+def writeArray(output, typecode, values):
+    data = array(typecode, values)
+    data.tofile(output)
+    output.write(b"\0" * padding(len(data) * data.itemsize))
+
+def writeStrings(output, strings):
+    encoded = [string.encode("utf-8") for string in strings]
+
+    offsets = [0]
+    for value in encoded:
+        offsets.append(offsets[-1] + len(value))
+
+    writeArray(output, "Q", offsets)
+    output.write(b"".join(encoded))
+    output.write(b"\0" * padding(offsets[-1]))
+
+def saveSnapshot(path, version, groups, files):
+    """
+    Write the groups ({nodeId, name}) and the files ({nodeId, name, groupNodeIds})
+    of the graph at the given version, replacing the snapshot atomically.
+    """
+    start = monotonic()
+    groupIndexes = dict((group["nodeId"], index) for index, group in enumerate(groups))
+
+    memberships = [0]
+    groupList = []
+    for file in files:
+        indexes = [groupIndexes[groupId] for groupId in file["groupNodeIds"] if groupId in groupIndexes]
+        groupList.extend(indexes)
+        memberships.append(memberships[-1] + len(indexes))
+
+    encodedVersion = str(version).encode("utf-8")
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as output:
+        output.write(HEADER.pack(
+            MAGIC, BYTE_ORDERS[sys.byteorder], len(encodedVersion), len(groups), len(files), len(groupList)))
+        output.write(encodedVersion)
+        output.write(b"\0" * padding(len(encodedVersion)))
+
+        writeArray(output, "q", [group["nodeId"] for group in groups])
+        writeStrings(output, [group["name"] for group in groups])
+        writeArray(output, "q", [file["nodeId"] for file in files])
+        writeStrings(output, [file["name"] for file in files])
+        writeArray(output, "Q", memberships)
+        writeArray(output, "I", groupList)
+
+        output.flush()
+        os.fsync(output.fileno())
+
+    os.replace(temporary, path)
+    logger.info("Saved the snapshot of %s files in %s groups to %s in %.1fs"
+        , len(files), len(groups), path, monotonic() - start)
+
+class SnapshotReader(object):
+    """
+    Sequential reader of the arrays of a memory-mapped snapshot.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def bytes(self, size):
+        if self.offset + size > len(self.data):
+            raise SnapshotError("The snapshot is truncated.")
+
+        value = self.data[self.offset:self.offset + size]
+        self.offset += size + padding(size)
+        return value
+
+    def array(self, typecode, count):
+        view = self.bytes(array(typecode).itemsize * count)
+        try:
+            return view.cast(typecode).tolist()
+        finally:
+            view.release()
+
+    def strings(self, count):
+        offsets = self.array("Q", count + 1)
+        view = self.bytes(offsets[-1])
+        try:
+            blob = bytes(view)
+        finally:
+            view.release()
+
+        return [blob[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(count)]
+
+def loadSnapshot(path, version):
+    """
+    Return the groups and the files of the snapshot, in the format taken by
+    MembershipIndex.build(), or None if the snapshot is missing or was taken
+    at another version of the graph (or the version of the graph is unknown).
+    """
+    if version is None or not os.path.exists(path):
+        return None
+
+    start = monotonic()
+    with open(path, "rb") as input:
+        if os.fstat(input.fileno()).st_size < HEADER.size:
+            raise SnapshotError("The snapshot is truncated.")
+
+        with mmap.mmap(input.fileno(), 0, access = mmap.ACCESS_READ) as mapped:
+            data = memoryview(mapped)
+            try:
+                magic, byteOrder, versionLength, groupCount, fileCount, membershipCount = HEADER.unpack_from(data)
+                if magic != MAGIC:
+                    raise SnapshotError("Not a GraphFS snapshot.")
+                if byteOrder != BYTE_ORDERS[sys.byteorder]:
+                    raise SnapshotError("The snapshot was written with another byte order.")
+
+                reader = SnapshotReader(data)
+                reader.offset = HEADER.size
+                snapshotVersion = bytes(reader.bytes(versionLength)).decode("utf-8")
+                if snapshotVersion != str(version):
+                    logger.info("The snapshot %s is out of date (version %s, graph at %s)", path, snapshotVersion, version)
+                    return None
+
+                groupIds = reader.array("q", groupCount)
+                groupNames = reader.strings(groupCount)
+                fileIds = reader.array("q", fileCount)
+                fileNames = reader.strings(fileCount)
+                memberships = reader.array("Q", fileCount + 1)
+                groupList = reader.array("I", membershipCount)
+            finally:
+                data.release()
+
+    groups = [dict(nodeId = nodeId, name = name) for nodeId, name in zip(groupIds, groupNames)]
+    files = [
+        dict(nodeId = nodeId, name = name
+            , groupNodeIds = [groupIds[index] for index in groupList[memberships[i]:memberships[i + 1]]])
+        for i, (nodeId, name) in enumerate(zip(fileIds, fileNames))
+    ]
+
+    logger.info("Loaded the snapshot of %s files in %s groups from %s in %.1fs"
+        , fileCount, groupCount, path, monotonic() - start)
+    return groups, files
@@ -0,0 +1,284 @@
+import threading
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from time import perf_counter, time
+
+# ---------------------------------------------------------
+# Instrumentation of the FUSE operations and of the queries.
+#
+# For every FUSE operation are counted the calls, the errors, the round trips
+# to the graph, and the latency split in total (FUSE) time and time spent
+# waiting for the graph (DB time). For every query template are counted the
+# calls, the errors and the latency; the queries running and the most recent
+# ones are kept too, to find the slow ones.
+#
+# The instrumentation is optional: when it is disabled no Stats object
+# exists and nothing is measured.
+
+# Upper bounds of the buckets of the latency histograms, in seconds:
+# powers of 2 from 16 microseconds to about 67 seconds, plus an overflow bucket
+BUCKET_BOUNDS = [2**exponent / 1e6 for exponent in range(4, 27)]
+
+# Number of recent queries kept to report the slowest ones
+DEFAULT_RECENT_QUERIES = 1000
+
+def formatSeconds(seconds):
+    if seconds < 1e-3:
+        return "{:.0f}us".format(seconds * 1e6)
+    if seconds < 1:
+        return "{:.1f}ms".format(seconds * 1e3)
+    return "{:.2f}s".format(seconds)
+
+class Histogram(object):
+    """
+    Latency histogram with logarithmic buckets.
+    """
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.buckets[bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, fraction):
+        """
+        Return the upper bound of the bucket holding the given fraction of the samples
+        (at most the largest sample).
+        """
+        if self.count == 0:
+            return 0.0
+
+        threshold = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= threshold:
+                return min(BUCKET_BOUNDS[index], self.max) if index < len(BUCKET_BOUNDS) else self.max
+
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def summary(self):
+        return "mean {} p50 {} p99 {} max {}".format(
+            formatSeconds(self.mean())
+            , formatSeconds(self.percentile(0.5))
+            , formatSeconds(self.percentile(0.99))
+            , formatSeconds(self.max))
+
+class OperationStats(object):
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.roundTrips = 0
+        self.fuseTime = Histogram()
+        self.dbTime = Histogram()
+
+class QueryStats(object):
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.time = Histogram()
+
+class Stats(object):
+    """
+    Counters and histograms of the operations and of the queries,
+    shared by all the threads.
+    """
+
+    def __init__(self, recentQueries = DEFAULT_RECENT_QUERIES):
+        self.started = time()
+
+        # name -> OperationStats
+        self.operations = {}
+        # query template -> QueryStats
+        self.queries = {}
+
+        # Queries running: token -> (template, start time, thread)
+        self.__inFlight = {}
+        self.__nextToken = 0
+        # Most recent queries: (template, seconds, end time)
+        self.__recent = deque(maxlen = recentQueries)
+
+        self.__lock = threading.Lock()
+        # DB time and round trips of the operation running in each thread
+        self.__local = threading.local()
+
+    def __record(self, name, seconds, current, error):
+        with self.__lock:
+            operation = self.operations.get(name)
+            if operation is None:
+                operation = self.operations[name] = OperationStats()
+
+            operation.calls += 1
+            operation.errors += error
+            operation.roundTrips += current[1]
+            operation.fuseTime.add(seconds)
+            operation.dbTime.add(current[0])
+
+    @contextmanager
+    def operation(self, name):
+        """
+        Measure a FUSE operation, including the queries it runs.
+        """
+        local = self.__local
+        outer = getattr(local, "current", None)
+        # [DB time, round trips]
+        current = local.current = [0.0, 0]
+
+        error = False
+        start = perf_counter()
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            seconds = perf_counter() - start
+            local.current = outer
+            self.__record(name, seconds, current, error)
+
+    def iterate(self, name, iterator):
+        """
+        Measure an operation returning a generator (e.g. readdir) as a single call,
+        covering the time spent producing its items.
+        """
+        local = self.__local
+        current = [0.0, 0]
+        seconds = 0.0
+        error = False
+
+        try:
+            while True:
+                outer = getattr(local, "current", None)
+                local.current = current
+                start = perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                except BaseException:
+                    error = True
+                    raise
+                finally:
+                    seconds += perf_counter() - start
+                    local.current = outer
+
+                yield item
+        finally:
+            if hasattr(iterator, "close"):
+                iterator.close()
+            self.__record(name, seconds, current, error)
+
+    @contextmanager
+    def query(self, name):
+        """
+        Measure a round trip to the graph, accounted to the running operation.
+        """
+        with self.__lock:
+            token = self.__nextToken
+            self.__nextToken += 1
+            self.__inFlight[token] = (name, time(), threading.current_thread().name)
+
+        error = False
+        start = perf_counter()
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            seconds = perf_counter() - start
+
+            current = getattr(self.__local, "current", None)
+            if current is not None:
+                current[0] += seconds
+                current[1] += 1
+
+            with self.__lock:
+                del self.__inFlight[token]
+                self.__recent.append((name, seconds, time()))
+
+                query = self.queries.get(name)
+                if query is None:
+                    query = self.queries[name] = QueryStats()
+                query.calls += 1
+                query.errors += error
+                query.time.add(seconds)
+
+    def inFlight(self):
+        """
+        Return the queries running, as (template, seconds running, thread), the oldest first.
+        """
+        now = time()
+        with self.__lock:
+            running = list(self.__inFlight.values())
+
+        return [(name, now - start, thread) for name, start, thread in sorted(running, key = lambda q: q[1])]
+
+    def slowest(self, count = 10):
+        """
+        Return the slowest among the recent queries, as (template, seconds, end time).
+        """
+        with self.__lock:
+            recent = list(self.__recent)
+
+        return sorted(recent, key = lambda q: q[1], reverse = True)[:count]
+
+    def reset(self):
+        """
+        Forget the measures taken so far (the queries running are kept).
+        """
+        with self.__lock:
+            self.started = time()
+            self.operations = {}
+            self.queries = {}
+            self.__recent.clear()
+
+    # Reports
+    # =======
+
+    def operationsReport(self):
+        with self.__lock:
+            lines = ["uptime {:.0f}s".format(time() - self.started)]
+
+            for name in sorted(self.operations):
+                operation = self.operations[name]
+                lines.append("{} calls {} errors {} round trips {:.2f}/call".format(
+                    name, operation.calls, operation.errors, operation.roundTrips / operation.calls))
+                lines.append("    fuse {}".format(operation.fuseTime.summary()))
+                lines.append("    db   {}".format(operation.dbTime.summary()))
+
+        return "\n".join(lines) + "\n"
+
+    def queriesReport(self):
+        with self.__lock:
+            lines = []
+            for name in sorted(self.queries):
+                query = self.queries[name]
+                lines.append("{} calls {} errors {} {}".format(name, query.calls, query.errors, query.time.summary()))
+
+        lines.append("")
+        lines.append("in flight:")
+        for name, seconds, thread in self.inFlight():
+            lines.append("    {} running for {} ({})".format(name, formatSeconds(seconds), thread))
+
+        lines.append("")
+        lines.append("slowest recent:")
+        for name, seconds, end in self.slowest():
+            lines.append("    {} {} ({:.0f}s ago)".format(name, formatSeconds(seconds), time() - end))
+
+        return "\n".join(lines) + "\n"
+
+    def report(self):
+        return "operations:\n" + self.operationsReport() + "\nqueries:\n" + self.queriesReport()
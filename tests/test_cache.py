@@ -0,0 +1,68 @@
+import unittest
+
+from lib.cache import ContentCache, MetadataCache
+
+class MetadataCacheTest(unittest.TestCase):
+
+    def test_invalidate_every_path_of_a_name(self):
+        cache = MetadataCache(maxEntries = 10, ttl = 60)
+        cache.put("/a/b/f", 1)
+        cache.put("/b/a/f", 2)
+        cache.put("/a/g", 3)
+
+        cache.invalidate("f")
+
+        self.assertEqual(cache.lookup("/a/b/f"), (False, None))
+        self.assertEqual(cache.lookup("b/a/f"), (False, None))
+        self.assertEqual(cache.lookup("/a/g"), (True, 3))
+
+    def test_missing_paths_are_cached(self):
+        cache = MetadataCache(ttl = 60)
+        cache.put("/a//missing/", None)
+        self.assertEqual(cache.lookup("/a/missing"), (True, None))
+
+    def test_expiration(self):
+        cache = MetadataCache(ttl = 0)
+        cache.put("/a", 1)
+        self.assertEqual(cache.lookup("/a"), (False, None))
+        self.assertEqual(len(cache), 0)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = MetadataCache(maxEntries = 2, ttl = 60)
+        cache.put("/a", 1)
+        cache.put("/b", 2)
+        cache.lookup("/a")
+        cache.put("/c", 3)
+
+        self.assertEqual(cache.lookup("/b"), (False, None))
+        self.assertEqual(cache.lookup("/a"), (True, 1))
+        self.assertEqual(cache.lookup("/c"), (True, 3))
+
+class ContentCacheTest(unittest.TestCase):
+
+    def test_get_returns_the_missing_chunks(self):
+        cache = ContentCache(maxBytes = 100)
+        cache.put(1, 10, {0: b"abc"}, cache.token())
+
+        self.assertEqual(cache.get(1, [0, 1]), (10, {0: b"abc"}, [1]))
+        self.assertEqual(cache.get(2, [0]), (None, {}, [0]))
+
+    def test_chunks_fetched_during_an_invalidation_are_discarded(self):
+        cache = ContentCache(maxBytes = 100)
+        token = cache.token()
+        cache.invalidate(1)
+        cache.put(1, 10, {0: b"old"}, token)
+
+        self.assertEqual(cache.get(1, [0]), (None, {}, [0]))
+
+    def test_bounded_by_bytes(self):
+        cache = ContentCache(maxBytes = 10)
+        cache.put(1, 20, {0: b"x" * 6}, cache.token())
+        cache.put(2, 20, {0: b"y" * 6}, cache.token())
+
+        self.assertLessEqual(cache.bytes, 10)
+        self.assertEqual(cache.get(1, [0])[2], [0])
+        self.assertEqual(cache.get(2, [0])[1], {0: b"y" * 6})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,181 @@
+import random
+import unittest
+
+from lib.backends.memory import MemoryBackend
+from lib.cache import ContentCache
+from lib.content import CHUNK_SIZE, ChunkedContent, WriteBuffer, sliceChunks, splitInChunks
+
+# ---------------------------------------------------------
+# Chunked content and write-back buffers, checked against a bytearray model
+# of the file on the memory backend.
+
+class ModelFile(object):
+    """
+    Expected content of a file.
+    """
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data, offset):
+        if len(self.data) < offset:
+            self.data.extend(bytes(offset - len(self.data)))
+        self.data[offset:offset + len(data)] = data
+
+    def truncate(self, length):
+        if length < len(self.data):
+            del self.data[length:]
+        else:
+            self.data.extend(bytes(length - len(self.data)))
+
+def storedSize(backend, nodeId):
+    """
+    Size of the file stored in its properties, as getattr reads it.
+    """
+    return backend.data("nodeProperties", nodeIds = [nodeId])[0]["properties"]["size"]
+
+def payload(rng, length):
+    return bytes(rng.getrandbits(8) for _ in range(length))
+
+class SliceChunksTest(unittest.TestCase):
+
+    def test_holes_read_as_zeros(self):
+        chunks = {1: b"b" * CHUNK_SIZE}
+        data = sliceChunks(chunks, 3 * CHUNK_SIZE, CHUNK_SIZE - 2, CHUNK_SIZE + 4)
+        self.assertEqual(data, b"\0\0" + b"b" * CHUNK_SIZE + b"\0\0")
+
+    def test_range_past_the_end(self):
+        self.assertEqual(sliceChunks({0: b"abc"}, 3, 1, 100), b"bc")
+        self.assertEqual(sliceChunks({0: b"abc"}, 3, 3, 100), b"")
+
+    def test_split(self):
+        chunks = splitInChunks(b"x" * (CHUNK_SIZE + 1), firstChunk = 2)
+        self.assertEqual([chunk["index"] for chunk in chunks], [2, 3])
+        self.assertEqual(len(chunks[1]["data"]), 1)
+
+class ChunkedContentTest(unittest.TestCase):
+
+    cache = False
+
+    def setUp(self):
+        self.backend = MemoryBackend()
+        self.content = ChunkedContent(self.backend, cache = ContentCache() if self.cache else None)
+        self.nodeId = self.backend.evaluate("createFile", fileId = "file", now = 0)
+        self.model = ModelFile()
+        self.rng = random.Random(0)
+
+    def assertContent(self):
+        size = len(self.model.data)
+        self.assertEqual(storedSize(self.backend, self.nodeId), size)
+        self.assertEqual(self.content.read(self.nodeId, size + CHUNK_SIZE, 0), bytes(self.model.data))
+
+    def write(self, offset, length):
+        data = payload(self.rng, length)
+        self.content.write(self.nodeId, data, offset)
+        self.model.write(data, offset)
+
+    def truncate(self, length):
+        self.content.truncate(self.nodeId, length)
+        self.model.truncate(length)
+
+    def test_writes_across_chunk_boundaries(self):
+        self.write(0, 2 * CHUNK_SIZE + 10)
+        self.write(CHUNK_SIZE - 3, 6)
+        self.write(2 * CHUNK_SIZE, CHUNK_SIZE)
+        self.write(CHUNK_SIZE, 1)
+        self.assertContent()
+
+    def test_write_past_the_end_leaves_a_hole(self):
+        self.write(0, 5)
+        self.write(3 * CHUNK_SIZE + 7, 9)
+        self.assertContent()
+        self.assertEqual(self.content.read(self.nodeId, 4, CHUNK_SIZE), bytes(4))
+
+    def test_partial_reads(self):
+        self.write(0, 3 * CHUNK_SIZE)
+        for offset, length in [(0, 1), (CHUNK_SIZE - 1, 2), (CHUNK_SIZE + 5, CHUNK_SIZE), (3 * CHUNK_SIZE - 1, 10)]:
+            self.assertEqual(self.content.read(self.nodeId, length, offset), bytes(self.model.data[offset:offset + length]))
+
+    def test_truncate_and_extend(self):
+        self.write(0, 2 * CHUNK_SIZE + 100)
+        self.truncate(CHUNK_SIZE + 1)
+        self.assertContent()
+        self.truncate(CHUNK_SIZE)
+        self.assertContent()
+        # The bytes cut are not visible again when the file grows
+        self.truncate(3 * CHUNK_SIZE)
+        self.assertContent()
+        self.truncate(0)
+        self.assertContent()
+
+    def test_random_operations(self):
+        for _ in range(200):
+            if self.rng.random() < 0.8:
+                self.write(self.rng.randrange(3 * CHUNK_SIZE), self.rng.randrange(1, CHUNK_SIZE + 100))
+            else:
+                self.truncate(self.rng.randrange(3 * CHUNK_SIZE))
+        self.assertContent()
+
+class CachedChunkedContentTest(ChunkedContentTest):
+
+    cache = True
+
+class WriteBufferTest(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = MemoryBackend()
+        self.content = ChunkedContent(self.backend)
+        self.nodeId = self.backend.evaluate("createFile", fileId = "file", now = 0)
+        self.model = ModelFile()
+        self.rng = random.Random(1)
+
+        initial = payload(self.rng, 2 * CHUNK_SIZE + 17)
+        self.content.write(self.nodeId, initial, 0)
+        self.model.write(initial, 0)
+        self.buffer = WriteBuffer(self.content, self.nodeId, len(initial))
+
+    def assertBuffered(self):
+        size = len(self.model.data)
+        self.assertEqual(self.buffer.size, size)
+        self.assertEqual(self.buffer.read(size + CHUNK_SIZE, 0), bytes(self.model.data))
+
+    def assertFlushed(self):
+        self.buffer.flush()
+        self.assertFalse(self.buffer.dirty)
+        size = len(self.model.data)
+        self.assertEqual(storedSize(self.backend, self.nodeId), size)
+        self.assertEqual(self.content.read(self.nodeId, size + CHUNK_SIZE, 0), bytes(self.model.data))
+
+    def test_nothing_is_written_before_the_flush(self):
+        before = self.content.read(self.nodeId, 3 * CHUNK_SIZE, 0)
+        self.buffer.write(b"abc", CHUNK_SIZE - 1)
+        self.model.write(b"abc", CHUNK_SIZE - 1)
+        self.assertEqual(self.content.read(self.nodeId, 3 * CHUNK_SIZE, 0), before)
+        self.assertBuffered()
+        self.assertFlushed()
+
+    def test_truncate_then_extend(self):
+        self.buffer.truncate(CHUNK_SIZE + 3)
+        self.model.truncate(CHUNK_SIZE + 3)
+        self.buffer.write(b"z", 2 * CHUNK_SIZE + 50)
+        self.model.write(b"z", 2 * CHUNK_SIZE + 50)
+        self.assertBuffered()
+        self.assertFlushed()
+
+    def test_random_operations(self):
+        for _ in range(20):
+            for _ in range(10):
+                if self.rng.random() < 0.75:
+                    data = payload(self.rng, self.rng.randrange(1, CHUNK_SIZE + 100))
+                    offset = self.rng.randrange(3 * CHUNK_SIZE)
+                    self.buffer.write(data, offset)
+                    self.model.write(data, offset)
+                else:
+                    length = self.rng.randrange(3 * CHUNK_SIZE)
+                    self.buffer.truncate(length)
+                    self.model.truncate(length)
+                self.assertBuffered()
+            self.assertFlushed()
+
+if __name__ == '__main__':
+    unittest.main()
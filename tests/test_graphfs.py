@@ -0,0 +1,464 @@
+import errno
+import os
+import stat
+import unittest
+from contextlib import contextmanager
+from time import time
+
+from lib.backends.memory import MemoryBackend
+
+try:
+    from fuse import FuseOSError
+    from graphfs import GraphFSNeo4j, RELATIME_INTERVAL
+    from lib.control import CONTROL_ROOT
+except (ImportError, OSError):
+    # fusepy, or the libfuse it loads, is not installed
+    GraphFSNeo4j = None
+
+# ---------------------------------------------------------
+# Operations of GraphFSNeo4j on the memory backend, called as FUSE calls them
+# (no mount needed).
+
+class QueryLog(object):
+    """
+    Names of the queries run by the backend, recorded in place of the measures of lib.stats.
+    """
+
+    def __init__(self):
+        self.names = []
+
+    @contextmanager
+    def query(self, name):
+        self.names.append(name)
+        yield
+
+@unittest.skipIf(GraphFSNeo4j is None, "graphfs needs fusepy and libfuse")
+class GraphFSTest(unittest.TestCase):
+    """
+    A mount on an empty graph. Content is not fetched ahead, so that only the queries
+    of the operations are run.
+    """
+
+    options = dict(readAheadChunks = 0)
+
+    def setUp(self):
+        self.queries = QueryLog()
+        self.backend = MemoryBackend(stats = self.queries)
+        self.fs = self.mount()
+
+    def tearDown(self):
+        self.fs.destroy("/")
+
+    def mount(self, **options):
+        return GraphFSNeo4j(self.backend, **dict(self.options, **options))
+
+    def writeFile(self, path, data, fs = None):
+        fs = fs or self.fs
+        fh = fs("create", path, 0o644)
+        fs("write", path, data, 0, fh)
+        fs("release", path, fh)
+
+    def readFile(self, path, fs = None):
+        fs = fs or self.fs
+        fh = fs("open", path, os.O_RDONLY)
+        try:
+            return fs("read", path, 1 << 20, 0, fh)
+        finally:
+            fs("release", path, fh)
+
+    def names(self, path, fs = None):
+        fs = fs or self.fs
+        return [name for name, attrs, offset in fs("readdir", path, None)]
+
+    def assertErrno(self, code, op, *args):
+        with self.assertRaises(FuseOSError) as context:
+            self.fs(op, *args)
+        self.assertEqual(context.exception.errno, code)
+
+class HandleTest(GraphFSTest):
+
+    def test_io_through_the_handle_resolves_no_path(self):
+        self.fs("mkdir", "/music", 0o755)
+        fh = self.fs("create", "/music/a", 0o644)
+        del self.queries.names[:]
+
+        self.fs("write", "/music/a", b"hello", 0, fh)
+        self.fs("truncate", "/music/a", 4, fh)
+        self.assertEqual(self.fs("read", "/music/a", 10, 0, fh), b"hell")
+        self.fs("flush", "/music/a", fh)
+        self.fs("release", "/music/a", fh)
+
+        self.assertNotIn("resolvePath", self.queries.names)
+        self.assertEqual(self.readFile("/music/a"), b"hell")
+
+    def test_each_open_gets_its_own_handle(self):
+        self.writeFile("/a", b"x")
+        first = self.fs("open", "/a", os.O_RDONLY)
+        second = self.fs("open", "/a", os.O_RDWR)
+
+        self.assertNotEqual(first, second)
+        self.assertEqual(len(self.fs.handles), 2)
+
+        self.fs("release", "/a", first)
+        self.assertEqual(self.fs("read", "/a", 1, 0, second), b"x")
+        self.fs("release", "/a", second)
+        self.assertEqual(len(self.fs.handles), 0)
+
+    def test_released_handle_is_invalid(self):
+        self.writeFile("/a", b"x")
+        fh = self.fs("open", "/a", os.O_RDONLY)
+        self.fs("release", "/a", fh)
+
+        self.assertErrno(errno.EBADF, "read", "/a", 1, 0, fh)
+
+    def test_writes_are_shared_by_the_handles_of_a_file(self):
+        self.writeFile("/a", b"")
+        writer = self.fs("open", "/a", os.O_WRONLY)
+        reader = self.fs("open", "/a", os.O_RDONLY)
+
+        self.fs("write", "/a", b"pending", 0, writer)
+        self.assertEqual(self.fs("read", "/a", 10, 0, reader), b"pending")
+
+        self.fs("release", "/a", writer)
+        self.fs("release", "/a", reader)
+        self.assertEqual(self.readFile("/a"), b"pending")
+
+class RelatimeTest(GraphFSTest):
+
+    def setUp(self):
+        super().setUp()
+        self.writeFile("/a", b"data")
+        self.nodeId = self.backend.files["a"]
+
+    def storedAtime(self):
+        return self.backend.nodes[self.nodeId]["atime"]
+
+    def readStoring(self):
+        """
+        Read the file with a new mount, which sees the stored times,
+        and return whether the access time was stored.
+        """
+        fs = self.mount()
+        try:
+            del self.queries.names[:]
+            self.readFile("/a", fs)
+            return "setTimes" in self.queries.names
+        finally:
+            fs.destroy("/")
+
+    def test_first_read_after_a_write_stores_the_access_time(self):
+        modified = self.backend.nodes[self.nodeId]["mtime"]
+        self.assertTrue(self.readStoring())
+        self.assertGreaterEqual(self.storedAtime(), modified)
+
+    def test_recent_access_time_is_kept(self):
+        self.assertTrue(self.readStoring())
+        atime = self.storedAtime()
+        self.assertFalse(self.readStoring())
+        self.assertEqual(self.storedAtime(), atime)
+
+    def test_access_time_older_than_the_interval_is_updated(self):
+        past = time() - 2 * RELATIME_INTERVAL
+        self.backend.run("setTimes", nodeId = self.nodeId, atime = past + 1, mtime = past, ctime = past)
+        self.assertTrue(self.readStoring())
+        self.assertGreater(self.storedAtime(), past + RELATIME_INTERVAL)
+
+    def test_handle_without_reads_stores_nothing(self):
+        fh = self.fs("open", "/a", os.O_RDONLY)
+        del self.queries.names[:]
+        self.fs("release", "/a", fh)
+        self.assertNotIn("setTimes", self.queries.names)
+
+class ListingTest(GraphFSTest):
+    """
+    Listings paginated in pages of 3 entries, read by a kernel whose buffer holds 4 entries.
+    """
+
+    options = dict(GraphFSTest.options, readdirPageSize = 3)
+    # Queries computing the keys of a listing of a group path
+    keyQueries = 1
+
+    def setUp(self):
+        super().setUp()
+        for group in ["music", "rock", "jazz"]:
+            self.fs("mkdir", "/" + group, 0o755)
+        for index in range(20):
+            path = "/music/rock/f{:02}" if index % 2 else "/music/f{:02}"
+            self.writeFile(path.format(index), b"x" * index)
+        self.writeFile("/loose", b"")
+
+    def listing(self, path, fh, offset = 0, count = None):
+        entries = []
+        for name, attrs, entryOffset in self.fs("readdir", path, fh, offset):
+            entries.append((name, entryOffset))
+            if len(entries) == count:
+                break
+        return entries
+
+    def resumedListing(self, path, bufferEntries = 4):
+        fh = self.fs("opendir", path)
+        try:
+            entries, offset = [], 0
+            while True:
+                part = self.listing(path, fh, offset, bufferEntries)
+                if not part:
+                    return entries
+                entries.extend(part)
+                offset = part[-1][1]
+        finally:
+            self.fs("releasedir", path, fh)
+
+    def test_resumed_listing_is_the_full_listing(self):
+        for path in ["/", "/music", "/music/rock", "/rock/music"]:
+            full = self.listing(path, None)
+            self.assertEqual(self.resumedListing(path), full, path)
+
+        self.assertEqual([name for name, offset in self.listing("/music/rock", None)]
+            , [".", ".."] + ["f{:02}".format(index) for index in range(1, 20, 2)])
+
+    def test_entries_carry_their_attributes(self):
+        entries = [(name, attrs) for name, attrs, offset in self.fs("readdir", "/music", None)][2:]
+        self.assertTrue(stat.S_ISDIR(dict(entries)["rock"]["st_mode"]))
+        for name, attrs in entries:
+            if name.startswith("f"):
+                self.assertTrue(stat.S_ISREG(attrs["st_mode"]))
+                self.assertEqual(attrs["st_size"], int(name[1:]))
+
+        # The getattr calls following the listing are served from the attribute cache
+        del self.queries.names[:]
+        for name, attrs in entries:
+            self.assertEqual(self.fs("getattr", "/music/" + name), attrs)
+        self.assertEqual(self.queries.names, [])
+
+    def test_keys_of_a_listing_are_computed_once(self):
+        self.fs.direntCache.clear()
+        del self.queries.names[:]
+        self.resumedListing("/music")
+        self.assertEqual(self.queries.names.count("readdirKeys"), self.keyQueries)
+        # Metadata is still read a page at a time
+        self.assertGreater(self.queries.names.count("nodeProperties"), 1)
+
+    def test_unknown_offset_lists_again(self):
+        full = self.listing("/music", None)
+        fh = self.fs("opendir", "/music")
+        try:
+            self.assertEqual(self.listing("/music", fh, 7), full[7:])
+        finally:
+            self.fs("releasedir", "/music", fh)
+
+    def test_files_changed_during_a_listing(self):
+        fh = self.fs("opendir", "/music")
+        try:
+            part = self.listing("/music", fh, 0, 4)
+            self.fs("unlink", "/music/f03")
+            rest = self.listing("/music", fh, part[-1][1])
+        finally:
+            self.fs("releasedir", "/music", fh)
+
+        names = [name for name, offset in part + rest]
+        self.assertNotIn("f03", names)
+        self.assertEqual(len(names), len(set(names)))
+
+class IndexedListingTest(ListingTest):
+
+    options = dict(ListingTest.options, membershipIndex = True)
+    keyQueries = 0
+
+class RenameTest(GraphFSTest):
+
+    options = dict(GraphFSTest.options, cacheTTL = 60)
+
+    def setUp(self):
+        super().setUp()
+        for group in ["music", "rock", "jazz"]:
+            self.fs("mkdir", "/" + group, 0o755)
+        self.writeFile("/music/a", b"song")
+        self.writeFile("/b", b"old")
+
+    def files(self, path):
+        return sorted(name for name in self.names(path)[2:] if name not in ("music", "rock", "jazz"))
+
+    def rename(self, old, new):
+        """
+        Rename and return the queries run, apart from the resolution of the paths.
+        """
+        del self.queries.names[:]
+        self.fs("rename", old, new)
+        return [name for name in self.queries.names if name != "resolvePath"]
+
+    def test_move_between_groups(self):
+        self.assertEqual(self.rename("/music/a", "/rock/jazz/a"), ["moveFile"])
+        self.assertEqual(self.files("/music"), [])
+        self.assertEqual(self.files("/rock/jazz"), ["a"])
+        self.assertEqual(self.readFile("/jazz/a"), b"song")
+
+    def test_rename_in_place(self):
+        self.assertEqual(self.rename("/music/a", "/music/c"), ["moveFile"])
+        self.assertEqual(self.files("/music"), ["c"])
+        self.assertErrno(errno.ENOENT, "getattr", "/a")
+        self.assertEqual(self.readFile("/c"), b"song")
+
+    def test_replace_an_existing_file(self):
+        self.assertEqual(self.rename("/music/a", "/b"), ["replaceFile"])
+        self.assertEqual(self.files("/"), ["b"])
+        self.assertEqual(self.files("/music"), ["b"])
+        self.assertEqual(self.readFile("/b"), b"song")
+        self.assertEqual(self.fs("getattr", "/b")["st_size"], 4)
+
+    def test_rename_a_group(self):
+        self.assertEqual(self.rename("/music", "/tunes"), ["renameGroup"])
+        self.assertEqual(self.files("/tunes"), ["a"])
+        self.assertErrno(errno.ENOENT, "getattr", "/music")
+
+    def test_groups_are_not_moved(self):
+        self.assertErrno(errno.EPERM, "rename", "/music", "/b")
+        self.assertErrno(errno.EPERM, "rename", "/music", "/rock")
+        self.assertEqual(self.files("/music"), ["a"])
+
+    def test_open_handle_follows_the_file(self):
+        fh = self.fs("open", "/music/a", os.O_RDWR)
+        self.fs("write", "/music/a", b"S", 0, fh)
+        self.fs("rename", "/music/a", "/b")
+        self.fs("write", "/b", b"G", 3, fh)
+        self.fs("release", "/b", fh)
+
+        self.assertEqual(self.readFile("/b"), b"SonG")
+
+class IndexedRenameTest(RenameTest):
+
+    options = dict(RenameTest.options, membershipIndex = True)
+
+class ControlFilesTest(GraphFSTest):
+
+    def setUp(self):
+        super().setUp()
+        self.writeFile("/a", b"data")
+
+    def readControl(self, name):
+        path = CONTROL_ROOT + "/" + name
+        fh = self.fs("open", path, os.O_RDONLY)
+        try:
+            return self.fs("read", path, 1 << 16, 0, fh).decode("utf-8")
+        finally:
+            self.fs("release", path, fh)
+
+    def test_served_without_queries(self):
+        del self.queries.names[:]
+        self.assertEqual(self.names(CONTROL_ROOT), [".", "..", "cache", "queries", "stats"])
+        self.assertTrue(stat.S_ISDIR(self.fs("getattr", CONTROL_ROOT)["st_mode"]))
+        self.assertIn("attributes", self.readControl("cache"))
+        self.assertIn("memory", self.readControl("queries"))
+        self.assertEqual(self.queries.names, [])
+
+    def test_hidden_from_the_root(self):
+        self.assertNotIn(CONTROL_ROOT[1:], self.names("/"))
+
+    def test_writing_the_cache_file_drops_the_caches(self):
+        self.fs("getattr", "/a")
+        self.assertGreater(len(self.fs.attrCache), 0)
+
+        path = CONTROL_ROOT + "/cache"
+        fh = self.fs("open", path, os.O_WRONLY)
+        self.fs("write", path, b"1", 0, fh)
+        self.fs("release", path, fh)
+
+        self.assertEqual(len(self.fs.attrCache), 0)
+
+    def test_read_only_namespace(self):
+        self.assertErrno(errno.EACCES, "open", CONTROL_ROOT + "/stats", os.O_WRONLY)
+        self.assertErrno(errno.EACCES, "mkdir", CONTROL_ROOT + "/new", 0o755)
+        self.assertErrno(errno.ENOENT, "getattr", CONTROL_ROOT + "/missing")
+
+class ScanningBackend(MemoryBackend):
+    """
+    Memory backend calling onScan once, right after the files of the membership index are read.
+    """
+
+    onScan = None
+
+    def data(self, name, **parameters):
+        records = super().data(name, **parameters)
+        if name == "membershipFiles" and self.onScan is not None:
+            onScan, self.onScan = self.onScan, None
+            onScan()
+        return records
+
+class ChangeFeedTest(GraphFSTest):
+    """
+    Two mounts of the same graph with a membership index: self.fs makes the changes,
+    and other polls the change log (by hand: the poll interval is never reached).
+    """
+
+    options = dict(GraphFSTest.options, membershipIndex = True, changePollInterval = 3600)
+
+    def setUp(self):
+        self.queries = QueryLog()
+        self.backend = ScanningBackend(stats = self.queries)
+        self.fs = self.mount()
+        self.fs("mkdir", "/music", 0o755)
+        self.writeFile("/music/a", b"old")
+        self.other = self.mount(cacheTTL = 3600)
+
+    def tearDown(self):
+        self.other.destroy("/")
+        super().tearDown()
+
+    def assertSameListings(self):
+        fresh = self.mount(membershipIndex = False, changePollInterval = None)
+        try:
+            for path in ["/", "/music", "/rock", "/music/rock"]:
+                try:
+                    expected = self.names(path, fresh)
+                except FuseOSError:
+                    expected = None
+                try:
+                    actual = self.names(path, self.other)
+                except FuseOSError:
+                    actual = None
+                self.assertEqual(actual, expected, path)
+        finally:
+            fresh.destroy("/")
+
+    def test_changes_are_applied_to_the_index(self):
+        # Fill the caches of the other mount
+        self.assertEqual(self.names("/music", self.other), [".", "..", "a"])
+        self.assertEqual(self.readFile("/music/a", self.other), b"old")
+
+        self.fs("mkdir", "/rock", 0o755)
+        self.writeFile("/music/rock/b", b"")
+        self.fs("rename", "/music/a", "/music/c")
+        self.writeFile("/music/c", b"new")
+        self.fs("unlink", "/b")
+
+        del self.queries.names[:]
+        self.other.changes.poll()
+
+        # Applied one by one, without loading the index again
+        self.assertNotIn("membershipFiles", self.queries.names)
+        self.assertEqual(self.other.changes.stats()["missed"], 0)
+        self.assertSameListings()
+        self.assertEqual(self.readFile("/music/c", self.other), b"new")
+
+    def test_missed_changes_load_the_index_again(self):
+        self.fs("mkdir", "/rock", 0o755)
+        self.writeFile("/rock/b", b"")
+        self.fs("unlink", "/music/a")
+        self.backend.pruneChanges(before = float("inf"))
+
+        self.other.changes.poll()
+
+        self.assertEqual(self.other.changes.stats()["missed"], 1)
+        self.assertSameListings()
+
+    def test_change_committed_while_the_index_is_loaded(self):
+        # The change is in the log, but not in the index read at mount
+        self.backend.onScan = lambda: self.writeFile("/music/b", b"")
+        mount = self.mount()
+        try:
+            mount.changes.poll()
+            self.assertEqual(self.names("/music", mount), [".", "..", "a", "b"])
+        finally:
+            mount.destroy("/")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,181 @@
+import itertools
+import json
+import random
+import unittest
+
+from lib.backends.memory import MemoryBackend
+from lib.membership import Bitmap, CONTAINER_SIZE, MembershipIndex
+
+class BitmapTest(unittest.TestCase):
+
+    def test_set_operations(self):
+        values = [0, 5, CONTAINER_SIZE - 1, CONTAINER_SIZE, 3 * CONTAINER_SIZE + 7]
+        bitmap = Bitmap()
+        for value in values:
+            bitmap.add(value)
+
+        self.assertEqual(list(bitmap), values)
+        self.assertEqual(len(bitmap), len(values))
+        self.assertIn(CONTAINER_SIZE, bitmap)
+        self.assertNotIn(1, bitmap)
+
+        other = Bitmap()
+        other.add(CONTAINER_SIZE)
+        other.add(2 * CONTAINER_SIZE)
+        self.assertEqual(list(bitmap & other), [CONTAINER_SIZE])
+        self.assertTrue(bitmap.intersects(other))
+
+        bitmap.discard(CONTAINER_SIZE)
+        self.assertFalse(bitmap.intersects(other))
+        # Empty containers are dropped
+        bitmap.discard(3 * CONTAINER_SIZE + 7)
+        self.assertEqual(sorted(bitmap.containers), [0])
+
+class MembershipIndexTest(unittest.TestCase):
+    """
+    Apply random changes to the graph and to the index, as GraphFSNeo4j does,
+    and compare the listings of the index with the ones of an index loaded afresh.
+    """
+
+    CHANGES = ["createGroup", "createFile", "moveFile", "replaceFile", "deleteFile", "renameGroup", "deleteEmptyGroup"]
+
+    def setUp(self):
+        self.backend = MemoryBackend()
+        self.rng = random.Random(2)
+        self.index = MembershipIndex()
+        self.counter = itertools.count()
+        # Updates applied to the index, as recorded in the change log
+        self.updates = []
+
+        for _ in range(6):
+            self.createGroup()
+        for _ in range(40):
+            self.createFile()
+
+        self.index.load(self.backend)
+
+    # Changes
+    # =======
+
+    def update(self, *update):
+        self.index.apply(list(update))
+        self.updates.append(json.dumps(update))
+
+    def randomChange(self):
+        getattr(self, self.rng.choice(self.CHANGES))()
+
+    def groups(self):
+        return sorted(self.backend.groups)
+
+    def files(self):
+        return sorted(self.backend.files)
+
+    def createGroup(self):
+        name = "g{}".format(next(self.counter))
+        nodeId = self.backend.evaluate("createGroup", groupId = name, now = 0)
+        self.update("addGroup", name, nodeId)
+
+    def createFile(self):
+        name = "f{}".format(next(self.counter))
+        groupNames = self.rng.sample(self.groups(), self.rng.randint(1, 3))
+        nodeId = self.backend.evaluate("createFile", fileId = name, now = 0)
+        self.backend.run("linkFile", nodeId = nodeId, groupIDs = groupNames)
+        self.update("addFile", name, nodeId, groupNames)
+
+    def moveFile(self):
+        name = self.rng.choice(self.files())
+        nodeId = self.backend.files[name]
+        newName = "f{}".format(next(self.counter)) if self.rng.random() < 0.5 else None
+        oldGroupNames = self.rng.sample(self.groups(), 1)
+        newGroupNames = self.rng.sample(self.groups(), 2)
+        self.backend.run("moveFile", nodeId = nodeId, newFileId = newName
+            , oldGroupIDs = oldGroupNames, newGroupIDs = newGroupNames, now = 0)
+        self.update("moveFile", nodeId, newName, oldGroupNames, newGroupNames)
+
+    def replaceFile(self):
+        fromName, toName = self.rng.sample(self.files(), 2)
+        fromId, toId = self.backend.files[fromName], self.backend.files[toName]
+        groupNames = self.rng.sample(self.groups(), 2)
+        self.backend.run("replaceFile", fromNodeId = fromId, toNodeId = toId, groupIDs = groupNames, now = 0)
+        self.update("replaceFile", fromId, toId, groupNames)
+
+    def deleteFile(self):
+        nodeId = self.backend.files[self.rng.choice(self.files())]
+        self.backend.run("deleteFile", nodeId = nodeId)
+        self.update("removeFile", nodeId)
+
+    def renameGroup(self):
+        nodeId = self.backend.groups[self.rng.choice(self.groups())]
+        newName = "g{}".format(next(self.counter))
+        self.backend.run("renameGroup", nodeId = nodeId, newGroupId = newName, now = 0)
+        self.update("renameGroup", nodeId, newName)
+
+    def deleteEmptyGroup(self):
+        for name in self.groups():
+            nodeId = self.backend.groups[name]
+            if not self.backend.groupFiles[nodeId]:
+                self.backend.run("deleteGroup", nodeId = nodeId)
+                self.update("removeGroup", nodeId)
+                return
+
+    # Checks
+    # ======
+
+    def assertSameListings(self, index = None):
+        index = index or self.index
+        fresh = MembershipIndex()
+        fresh.load(self.backend)
+
+        groups = self.groups()
+        self.assertEqual(index.listing(None), fresh.listing(None))
+        for count in (1, 2):
+            for groupNames in itertools.combinations(groups, count):
+                self.assertEqual(index.listing(groupNames), fresh.listing(groupNames), groupNames)
+
+    def test_listing(self):
+        self.assertSameListings()
+        groupName = self.groups()[0]
+        entries = self.index.listing([groupName])
+        fileIds = self.backend.groupFiles[self.backend.groups[groupName]]
+        self.assertEqual(sorted(nodeId for rank, name, nodeId in entries if rank == 1), sorted(fileIds))
+
+    def test_random_changes(self):
+        for step in range(300):
+            self.randomChange()
+            if step % 50 == 0:
+                # Fill the cache of the listings, which the next changes have to drop
+                self.index.listing(None)
+                self.index.listing(self.groups()[:1])
+        self.assertSameListings()
+
+    def test_remote_updates(self):
+        # Another mount, applying the updates read from the change log
+        remote = MembershipIndex()
+        remote.load(self.backend)
+
+        for _ in range(300):
+            self.randomChange()
+        for update in self.updates:
+            remote.apply(json.loads(update))
+        self.assertSameListings(remote)
+
+        with self.assertRaises(ValueError):
+            remote.apply(["load", self.backend])
+
+    def test_updates_during_load(self):
+        # The graph is read by load while other threads change it and update the index
+        test = self
+
+        class ChangingBackend(object):
+            def data(self, name):
+                result = test.backend.data(name)
+                for _ in range(20):
+                    test.randomChange()
+                return result
+
+        for _ in range(5):
+            self.index.load(ChangingBackend())
+            self.assertSameListings()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from lib.membership import MembershipIndex
+from lib.snapshot import SnapshotError, loadSnapshot, saveSnapshot
+
+GROUPS = [dict(nodeId = 1, name = "music"), dict(nodeId = 2, name = "été")]
+FILES = [
+    dict(nodeId = 10, name = "a.mp3", groupNodeIds = [1, 2])
+    , dict(nodeId = 11, name = "b", groupNodeIds = [])
+    , dict(nodeId = 12, name = "ç.txt", groupNodeIds = [2])
+]
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "snapshot")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        saveSnapshot(self.path, 42, GROUPS, FILES)
+        self.assertEqual(loadSnapshot(self.path, 42), (GROUPS, FILES))
+        self.assertFalse(os.path.exists(self.path + ".tmp"))
+
+    def test_index_built_from_the_snapshot(self):
+        saveSnapshot(self.path, "tick-7", GROUPS, FILES)
+        index = MembershipIndex()
+        index.build(*loadSnapshot(self.path, "tick-7"))
+
+        self.assertEqual(index.listing(["été"]), [(0, "music", 1), (1, "a.mp3", 10), (1, "ç.txt", 12)])
+
+    def test_stale_or_unknown_version(self):
+        saveSnapshot(self.path, 42, GROUPS, FILES)
+        self.assertIsNone(loadSnapshot(self.path, 43))
+        self.assertIsNone(loadSnapshot(self.path, None))
+        self.assertIsNone(loadSnapshot(os.path.join(self.directory, "missing"), 42))
+
+    def test_empty_graph(self):
+        saveSnapshot(self.path, 1, [], [])
+        self.assertEqual(loadSnapshot(self.path, 1), ([], []))
+
+    def test_truncated(self):
+        saveSnapshot(self.path, 42, GROUPS, FILES)
+        with open(self.path, "r+b") as output:
+            output.truncate(os.path.getsize(self.path) - 8)
+
+        with self.assertRaises(SnapshotError):
+            loadSnapshot(self.path, 42)
+
+    def test_not_a_snapshot(self):
+        with open(self.path, "wb") as output:
+            output.write(b"\0" * 64)
+
+        with self.assertRaises(SnapshotError):
+            loadSnapshot(self.path, 42)
+
+if __name__ == '__main__':
+    unittest.main()